@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+"""asyncio front end for orserver, calls are made on a dedicated thread
+pool using pooled RSO connections so that they do not block the event loop.
+
+Requires Python 3.7 or later (so not Jython).
+
+Example:
+
+    pool = orserver.get_rso_pool('comtest', 'localhost', max_size=4)
+    async with AsyncDispatcher(pool) as server:
+        result = await server.helloworld(hellostring='hello', counter=1)
+        results = await server.gather('helloworld', [{'counter': x} for x in range(10)])
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+import weakref
+
+import orserver
+
+
+_worker_state = threading.local()  # set on dispatcher executor threads, see _WorkerState
+
+
+class _WorkerState:
+    """Held (in _worker_state) by each initialized executor thread, calls
+    thread_uninit() for the backend the thread was initialized for. Thread
+    local data is released, on the thread itself, as the thread exits."""
+    __slots__ = ('backend',)
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __del__(self):
+        try:
+            self.backend.thread_uninit()
+        except Exception:
+            pass  # e.g. interpreter shutdown
+
+
+async def callproc_async(pool, procedure_name, func_sig=None, executor=None, **kwargs):
+    """asyncio version of orserver.callproc(), `pool` is an RSOPool.
+    The call is made using `executor` (default is the event loop default executor)."""
+    loop = asyncio.get_event_loop()
+    call = functools.partial(orserver.callproc, pool, procedure_name, func_sig=func_sig, **kwargs)
+    return await loop.run_in_executor(executor, call)
+
+
+class AsyncMethodProxy:
+    """Awaitable callable bound to a single procedure, see AsyncDispatcher"""
+    __slots__ = ('dispatcher', 'method_name')
+
+    def __init__(self, dispatcher, method_name):
+        self.dispatcher = dispatcher
+        self.method_name = method_name
+
+    def __repr__(self):
+        return '<AsyncMethodProxy %s>' % self.method_name
+
+    async def __call__(self, **kwargs):
+        return await self.dispatcher.callproc(self.method_name, **kwargs)
+
+
+class AsyncDispatcher:
+    """asyncio equivalent of orserver.SimpleDispatcher
+
+    pool - orserver.RSOPool used for connections
+    lookup_meta - if True metadata is looked up (once, on first call)
+    metadata_cache - see orserver.get_cached_meta_data()
+    max_concurrency - maximum number of calls in progress, default is pool max_size
+    executor - concurrent.futures executor to make (blocking) calls on,
+        default is a dedicated thread pool with max_concurrency threads
+
+    Cancelling a call that is already in progress on the server does not
+    abort it; the connection is returned to the pool (and the concurrency
+    slot released) when the call completes.
+
+    A dispatcher can be used from more than one event loop (e.g. successive
+    asyncio.run() calls), max_concurrency applies per event loop.
+    """
+
+    def __init__(self, pool, lookup_meta=True, max_concurrency=None, executor=None, metadata_cache=True):
+        if max_concurrency is None:
+            max_concurrency = pool.max_size
+        self.pool = pool
+        self.max_concurrency = max_concurrency
+        self._dispatcher = orserver.SimpleDispatcher(pool, lookup_meta=False)
+        self._lookup_meta = lookup_meta
+        self._metadata_cache = metadata_cache
+        self._loop_primitives = weakref.WeakKeyDictionary()  # event loop -> (semaphore, metadata lock)
+        self._owns_executor = executor is None
+        self._closed = False
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='aio_orserver', initializer=self._init_worker)
+        self._executor = executor
+        self._proxies = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    @staticmethod
+    def _init_worker():
+        backend = orserver.get_backend()
+        backend.thread_init()
+        _worker_state.worker = _WorkerState(backend)  # uninit on thread exit
+
+    def close(self):
+        """Shutdown executor (if created by the dispatcher), does not close the pool.
+        Worker threads exit, calling orserver.thread_uninit(), once calls in
+        progress complete."""
+        if not self._owns_executor or self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown(wait=False)
+
+    def __getattr__(self, key):
+        if key.startswith('__'):
+            raise AttributeError(key)
+        proxy = self._proxies.get(key)
+        if proxy is None:
+            proxy = self._proxies[key] = AsyncMethodProxy(self, key)
+        return proxy
+
+    def _primitives(self):
+        """Return (semaphore, metadata lock) for the running event loop"""
+        loop = asyncio.get_running_loop()
+        primitives = self._loop_primitives.get(loop)
+        if primitives is None:
+            primitives = self._loop_primitives[loop] = (asyncio.Semaphore(self.max_concurrency), asyncio.Lock())
+        return primitives
+
+    async def _run(self, func):
+        loop = asyncio.get_running_loop()
+        semaphore = self._primitives()[0]
+        await semaphore.acquire()
+
+        def release(future):
+            try:
+                loop.call_soon_threadsafe(semaphore.release)
+            except RuntimeError:
+                pass  # event loop closed
+
+        try:
+            future = self._executor.submit(func)
+        except:
+            semaphore.release()
+            raise
+        # release slot when the call is really complete, not when the awaiting task is cancelled
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    async def load_meta_data(self, force=True):
+        """(Re)load metadata from server, if force is False cached metadata may be used"""
+        app_metadata = await self._run(functools.partial(orserver.get_cached_meta_data, self.pool, metadata_cache=self._metadata_cache, force=force))
+        self._dispatcher.set_meta_data(app_metadata)
+        self._lookup_meta = False
+
+    async def _ensure_meta_data(self):
+        async with self._primitives()[1]:
+            if self._lookup_meta:
+                await self.load_meta_data(force=False)
+
+    async def callproc(self, method_name, **kwargs):
+        """Call procedure `method_name`, same as `await dispatcher.method_name(**kwargs)`"""
+        if self._lookup_meta:
+            await self._ensure_meta_data()
+        proxy = self._dispatcher._get_proxy(method_name)
+        return await self._run(functools.partial(proxy, **kwargs))
+
+    async def gather(self, method_name, list_of_kwargs, return_exceptions=True):
+        """Call procedure `method_name` once for each dictionary of parameters
+        in list_of_kwargs (concurrently, up to max_concurrency).
+        Returns list of results in the same order, with exceptions in place
+        of results for failed calls if return_exceptions is True."""
+        calls = [self.callproc(method_name, **kwargs) for kwargs in list_of_kwargs]
+        return await asyncio.gather(*calls, return_exceptions=return_exceptions)
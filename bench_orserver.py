@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+"""Client side benchmarks for orserver, no OpenROAD server is needed.
+Calls are made using the simulated backend (orserver.SimulatedBackend)
+with no latency, so only client side (marshalling) time is measured.
+
+To run issue:
+
+    python bench_orserver.py
+
+Options:
+
+    -k NAME     only run benchmarks with NAME in their name, may be repeated
+    --min-time  minimum number of seconds to run each benchmark for
+    --save FILE save results as JSON baseline
+    --compare FILE  compare results against JSON baseline, exit status
+                is 1 if any benchmark regressed by more than --threshold
+    --list      list benchmark names
+
+For example, before and after a change:
+
+    python bench_orserver.py --save before.json
+    python bench_orserver.py --compare before.json
+
+Peak memory is only reported under Python 3 (requires tracemalloc).
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import decimal
+import json
+import platform
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2.x and Jython
+    tracemalloc = None
+
+import orserver
+
+
+try:
+    timer = time.perf_counter
+except AttributeError:
+    # Python 2.x and Jython
+    timer = time.time
+
+PERCENTILES = (50, 90, 99)
+BENCH_IMAGE = 'bench'
+
+
+def make_metadata_xml(num_scps=5000, num_params=10, num_classes=500, num_attributes=10):
+    """Return synthetic GetMetaDataInterface XML"""
+    types = ('int', 'string', 'float', 'decimal', 'datetime')
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<interface>', '<scps>']
+    for scp_number in range(num_scps):
+        lines.append('<scp name="SCP_proc%d" procname="proc%d">' % (scp_number, scp_number))
+        lines.append('<param name="b_osca" type="UCOSCA"/>')
+        for param_number in range(num_params):
+            lines.append('<param name="p%d" type="%s" isarray="0" isnullable="1"/>' % (param_number, types[param_number % len(types)]))
+        lines.append('</scp>')
+    lines.append('</scps>')
+    lines.append('<classes>')
+    for class_number in range(num_classes):
+        lines.append('<class name="uc%d">' % class_number)
+        for attribute_number in range(num_attributes):
+            lines.append('<attribute name="a%d" type="%s" isarray="0" isnullable="1"/>' % (attribute_number, types[attribute_number % len(types)]))
+        lines.append('</class>')
+    lines.append('</classes>')
+    lines.append('</interface>')
+    return '\n'.join(lines)
+
+
+def parse_meta_data_tree(xml_metadata):
+    """Original, whole document ElementTree, metadata parser. For comparison only."""
+    app_metadata = {}
+    t = orserver.element_tree().fromstring(xml_metadata)
+    for scps in t.findall('scps'):
+        for scp in scps.findall('scp'):
+            app_metadata[scp.attrib['name']] = {}
+            app_metadata[scp.attrib['name']]['info'] = scp.attrib
+            app_metadata[scp.attrib['name']]['params'] = {}
+            for param in list(scp):
+                if param.attrib['name'] not in orserver.GSCP_SPECIAL_NAMES:
+                    app_metadata[scp.attrib['name']]['params'][param.attrib['name']] = param.attrib
+    app_metadata['*classes*'] = app_metadata.get('*classes*', {})
+    for _classes in t.findall('classes'):
+        for _class in _classes.findall('class'):
+            class_name = _class.attrib['name']
+            app_metadata['*classes*'][class_name] = {}
+            app_metadata['*classes*'][class_name]['info'] = _class.attrib
+            app_metadata['*classes*'][class_name]['params'] = {}
+            for param in list(_class):
+                app_metadata['*classes*'][class_name]['params'][param.attrib['name']] = param.attrib
+    return app_metadata
+
+
+def measure(func, *args, **kwargs):
+    """Call func, return (result, seconds, peak_bytes). peak_bytes is None if unavailable"""
+    peak = None
+    if tracemalloc:
+        tracemalloc.start()
+    start = timer()
+    try:
+        result = func(*args, **kwargs)
+        duration = timer() - start
+        if tracemalloc:
+            current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if tracemalloc:
+            tracemalloc.stop()
+    return result, duration, peak
+
+
+def format_bytes(num_bytes):
+    if num_bytes is None:
+        return 'n/a'
+    return '%.1f MiB' % (num_bytes / (1024.0 * 1024.0))
+
+
+def format_seconds(seconds):
+    if seconds < 1e-3:
+        return '%.1f us' % (seconds * 1e6)
+    elif seconds < 1:
+        return '%.2f ms' % (seconds * 1e3)
+    return '%.2f s' % seconds
+
+
+def percentile(sorted_values, percent):
+    """Nearest rank percentile of (sorted, non empty) list"""
+    index = int(round(percent / 100.0 * len(sorted_values) + 0.5)) - 1
+    return sorted_values[max(0, min(index, len(sorted_values) - 1))]
+
+
+def run_benchmark(func, min_time=1.0, max_calls=100000):
+    """Call func (with no arguments) repeatedly for at least min_time
+    seconds (and at least 3 times), the first call is a warm up and is
+    not measured. Peak memory is measured for a single, separate, call.
+
+    Returns dictionary of results.
+    """
+    func()  # warm up, e.g. call plan and metadata caches
+    latencies = []
+    start = timer()
+    deadline = start + min_time
+    while len(latencies) < max_calls:
+        call_start = timer()
+        func()
+        call_end = timer()
+        latencies.append(call_end - call_start)
+        if call_end >= deadline and len(latencies) >= 3:
+            break
+    duration = timer() - start
+    result, peak_duration, peak = measure(func)
+    latencies.sort()
+    results = {
+        'calls': len(latencies),
+        'seconds': duration,
+        'ops_per_sec': len(latencies) / duration,
+        'peak_bytes': peak,
+    }
+    for percent in PERCENTILES:
+        results['p%d' % percent] = percentile(latencies, percent)
+    return results
+
+
+def simulated_rows(params):
+    # rows are returned unchanged
+    return {'total': len(params['rows'])}
+
+
+def simulated_helloworld(params):
+    return {'hellostring': u'Well "%s" to you too.' % params['hellostring'], 'counter': params['counter'] + 1}
+
+
+def setup_backend(metadata_xml):
+    """Switch to (and return) a simulated backend serving BENCH_IMAGE"""
+    backend = orserver.set_backend(orserver.SimulatedBackend())
+    application = backend.register_application(BENCH_IMAGE, metadata_xml=metadata_xml)
+    application.register_procedure('helloworld', simulated_helloworld)
+    application.register_procedure('rows', simulated_rows)
+    return backend
+
+
+ROWS_META = {
+    'rows': 'UCARRAY',
+    'rows.id': 'INTEGER',
+    'rows.name': 'STRING',
+    'rows.score': 'FLOAT',
+    'rows.sub': 'USERCLASS',
+    'rows.sub.code': 'STRING',
+    'total': 'INTEGER',
+}
+
+
+def make_rows(num_rows):
+    return [{'id': i, 'name': 'name %d' % i, 'score': i * 0.5, 'sub': {'code': 'c%d' % (i % 10)}} for i in range(num_rows)]
+
+
+def make_rows_pdo(num_rows):
+    """Return (pdo, param_meta) for PDO holding a UCARRAY with num_rows rows"""
+    pdo = orserver.ParameterData(orserver.meta2func_sig(ROWS_META))
+    orserver.pdo_set_value(pdo, ROWS_META, 'rows', make_rows(num_rows))
+    orserver.pdo_set_value(pdo, ROWS_META, 'total', num_rows)
+    return pdo, ROWS_META
+
+
+def make_wide_values(num_params=200):
+    types = (1, u'string', 1.5, decimal.Decimal('1.23'), datetime.datetime(2000, 1, 2, 3, 4, 5))
+    return dict(('p%d' % i, types[i % len(types)]) for i in range(num_params))
+
+
+def make_nested_values(depth=4, width=5, num_rows=100):
+    """userclass nested depth deep, each with width scalars, plus a UCARRAY"""
+    values = {}
+    level = values
+    for i in range(depth):
+        for j in range(width):
+            level['a%d' % j] = j if j % 2 else u'x%d' % j
+        level['child'] = {}
+        level = level['child']
+    level['leaf'] = 1
+    return {'p1': values, 'rows': make_rows(num_rows)}
+
+
+def get_benchmarks(metadata_xml):
+    """Return list of (name, func), func is called with no arguments"""
+    benchmarks = []
+
+    func_sig = '; '.join('p%d=%s' % (i, ('STRING', 'INTEGER', 'FLOAT', 'DECIMAL', 'DATE')[i % 5]) for i in range(50))
+    param_meta = orserver.func_sig2meta(func_sig)
+    benchmarks.append(('func_sig2meta 50 params', lambda: orserver.func_sig2meta(func_sig)))
+    benchmarks.append(('meta2func_sig 50 params', lambda: orserver.meta2func_sig(param_meta)))
+
+    wide_values = make_wide_values()
+    nested_values = make_nested_values()
+    benchmarks.append(('guessmeta_from_values wide 200', lambda: orserver.guessmeta_from_values(wide_values)))
+    benchmarks.append(('guessmeta_from_values nested', lambda: orserver.guessmeta_from_values(nested_values)))
+
+    for num_rows in (10, 1000, 100000):
+        pdo, rows_meta = make_rows_pdo(num_rows)
+        benchmarks.append(('pdo2dict UCARRAY %d rows' % num_rows, lambda pdo=pdo, rows_meta=rows_meta: orserver.pdo2dict(pdo, rows_meta)))
+
+    def get_meta_data():
+        rso = orserver.or_connect(BENCH_IMAGE, 'localhost')
+        return orserver.get_meta_data(rso)
+    benchmarks.append(('get_meta_data %d KiB XML' % (len(metadata_xml) // 1024), get_meta_data))
+    benchmarks.append(('parse_meta_data_tree (original) %d KiB XML' % (len(metadata_xml) // 1024), lambda: parse_meta_data_tree(metadata_xml)))
+
+    rso = orserver.or_connect(BENCH_IMAGE, 'localhost')
+    benchmarks.append(('callproc helloworld', lambda: orserver.callproc(rso, 'helloworld', func_sig='hellostring=STRING; counter=INTEGER', hellostring='bench', counter=1)))
+    rows_func_sig = orserver.meta2func_sig(ROWS_META)
+    rows = make_rows(100)
+    benchmarks.append(('callproc UCARRAY 100 rows', lambda: orserver.callproc(rso, 'rows', func_sig=rows_func_sig, rows=rows, total=None)))
+    benchmarks.append(('callproc UCARRAY 100 rows columnar', lambda: orserver.callproc(rso, 'rows', func_sig=rows_func_sig, columnar=True, rows=rows, total=None)))
+    return benchmarks
+
+
+def print_result(name, results, baseline=None, regression=False):
+    line = '%-44s %12.1f/s  p50 %9s  p90 %9s  p99 %9s  peak %9s' % (
+        name,
+        results['ops_per_sec'],
+        format_seconds(results['p50']),
+        format_seconds(results['p90']),
+        format_seconds(results['p99']),
+        format_bytes(results['peak_bytes']),
+    )
+    if baseline is not None:
+        line += '  %+6.1f%%' % ((results['ops_per_sec'] / baseline['ops_per_sec'] - 1.0) * 100.0)
+        if regression:
+            line += '  REGRESSION'
+    print(line)
+    sys.stdout.flush()
+
+
+def is_regression(results, baseline, threshold):
+    """True if throughput dropped, or peak memory grew, by more than threshold (fraction)"""
+    if results['ops_per_sec'] < baseline['ops_per_sec'] * (1.0 - threshold):
+        return True
+    peak, baseline_peak = results['peak_bytes'], baseline.get('peak_bytes')
+    if peak is not None and baseline_peak is not None:
+        # ignore noise in tiny allocations
+        if peak > baseline_peak * (1.0 + threshold) and peak - baseline_peak > 64 * 1024:
+            return True
+    return False
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='orserver client side benchmarks')
+    parser.add_argument('-k', dest='names', action='append', help='only run benchmarks with NAME in their name')
+    parser.add_argument('--min-time', type=float, default=1.0, help='minimum seconds per benchmark (default %(default)s)')
+    parser.add_argument('--save', metavar='FILE', help='save results as JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare with JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.10, help='regression threshold, fraction (default %(default)s)')
+    parser.add_argument('--list', action='store_true', help='list benchmark names')
+    options = parser.parse_args(argv[1:])
+
+    baselines = None
+    if options.compare:
+        f = open(options.compare)
+        try:
+            baselines = json.load(f)['results']
+        finally:
+            f.close()
+
+    metadata_xml = make_metadata_xml()
+    setup_backend(metadata_xml)
+    benchmarks = get_benchmarks(metadata_xml)
+    if options.names:
+        benchmarks = [(name, func) for name, func in benchmarks if [x for x in options.names if x in name]]
+    if options.list:
+        for name, func in benchmarks:
+            print(name)
+        return 0
+
+    all_results = {}
+    regressions = []
+    for name, func in benchmarks:
+        results = run_benchmark(func, min_time=options.min_time)
+        all_results[name] = results
+        baseline = baselines and baselines.get(name)
+        regression = baseline is not None and is_regression(results, baseline, options.threshold)
+        if regression:
+            regressions.append(name)
+        print_result(name, results, baseline, regression)
+
+    if options.save:
+        f = open(options.save, 'w')
+        try:
+            json.dump({
+                'python': sys.version,
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'results': all_results,
+            }, f, indent=4, sort_keys=True)
+        finally:
+            f.close()
+
+    if regressions:
+        print('%d regression(s) against %s (threshold %.0f%%): %s' % (len(regressions), options.compare, options.threshold * 100.0, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,87 +18,85 @@ Java requires Jython.
 import array
 import datetime
 import decimal
-import calendar
+from collections import deque
+from collections import OrderedDict
+from collections import namedtuple
+import hashlib
 import os
-from pprint import pprint
+import random
+import re
 import sys
+import threading
+import time
+import weakref
+import zlib
 
 try:
-    import xml.etree.cElementTree as ET
+    import queue
 except ImportError:
-    try:
-        import cElementTree as ET
-    except ImportError:
-        import elementtree.ElementTree as ET
+    # Python 2.x
+    import Queue as queue
 
-# win32 specific
-try:
-    import pythoncom
-    import win32com.client
-    win32com_client_Dispatch = win32com.client.Dispatch
-    import pywintypes
-except ImportError:
-    win32com_client_Dispatch = None
+ET = None  # ElementTree, imported on first use, see element_tree()
 
-if win32com_client_Dispatch is None:
-    # Assume Jython
-    import java.sql  # for Date datatypes
+# Backend (OpenROAD client library) specific modules, these are imported
+# when the backend is created, see get_backend()
+pythoncom = None  # win32
+win32com = None  # win32
+pywintypes = None  # win32
+java = None  # Jython
+jarray = None  # Jython
 
-    import jarray
 
-    class classPathHacker(object):
-        """Original Author: SG Langer Jan 2007, conversion from Java to Jython
-        Updated version (supports Jython 2.5.2) from
-        http://glasblog.1durch0.de/?p=846
+class classPathHacker(object):
+    """Original Author: SG Langer Jan 2007, conversion from Java to Jython
+    Updated version (supports Jython 2.5.2) from
+    http://glasblog.1durch0.de/?p=846
 
-        Purpose: Allow runtime additions of new Class/jars either from
-        local files or URL
-        """
-        import java.lang.reflect.Method
+    Purpose: Allow runtime additions of new Class/jars either from
+    local files or URL
+    """
+    def addFile(self, s):
+        """Purpose: If adding a file/jar call this first
+        with s = path_to_jar"""
         import java.io.File
+        # make a URL out of 's'
+        f = java.io.File(s)
+        u = f.toURL()
+        a = self.addURL(u)
+        return a
+
+    def addURL(self, u):
+        """Purpose: Call this with u= URL for
+        the new Class/jar to be loaded"""
+        import java.lang.reflect.Method
         import java.net.URL
         import java.net.URLClassLoader
+        import jarray
+        sysloader = java.lang.ClassLoader.getSystemClassLoader()
+        sysclass = java.net.URLClassLoader
+        method = sysclass.getDeclaredMethod("addURL", [java.net.URL])
+        a = method.setAccessible(1)
+        jar_a = jarray.array([u], java.lang.Object)
+        b = method.invoke(sysloader, [u])
+        return u
 
-        def addFile(self, s):
-            """Purpose: If adding a file/jar call this first
-            with s = path_to_jar"""
-            # make a URL out of 's'
-            f = self.java.io.File(s)
-            u = f.toURL()
-            a = self.addURL(u)
-            return a
-
-        def addURL(self, u):
-            """Purpose: Call this with u= URL for
-            the new Class/jar to be loaded"""
-            sysloader = self.java.lang.ClassLoader.getSystemClassLoader()
-            sysclass = self.java.net.URLClassLoader
-            method = sysclass.getDeclaredMethod("addURL", [self.java.net.URL])
-            a = method.setAccessible(1)
-            jar_a = jarray.array([u], self.java.lang.Object)
-            b = method.invoke(sysloader, [u])
-            return u
-
-    # Sanity check.
-    # Try and add OpenROAD jar file to CLASSPATH automatically in case classpath
-    # was not setup
-    II_SYSTEM = os.environ.get('II_SYSTEM')
-    if II_SYSTEM is not None:
-        openroad_jar_path = os.path.join(II_SYSTEM, 'ingres', 'orjava', 'openroad.jar')
-    else:
-        # assume/hope jdbc driver is in the current directory
-        openroad_jar_path = os.path.join('openroad.jar')
 
-    print(openroad_jar_path)
-    jarLoad = classPathHacker()
-    a = jarLoad.addFile(openroad_jar_path)
+_loaded_jars = {}  # absolute path -> URL, jars added to the system class loader
+_loaded_jars_lock = threading.Lock()
+
 
-    # NOTE these require openroad.jar to be in the path
-    # and for the OpenROAD environment/path to be set
-    from com.ca.openroad import RemoteServer
-    from com.ca.openroad import ParameterData
-    from com.ca.openroad import ASOSession
-    from com.ca.openroad import COMException
+def load_jar(jar_path):
+    """Add jar to (Jython) CLASSPATH, once per process. Returns jar URL"""
+    jar_path = os.path.abspath(jar_path)
+    _loaded_jars_lock.acquire()
+    try:
+        url = _loaded_jars.get(jar_path)
+        if url is None:
+            url = _loaded_jars[jar_path] = classPathHacker().addFile(jar_path)
+        return url
+    finally:
+        _loaded_jars_lock.release()
 
 
 RP_LOCAL = 1  # Probably only useful for OpenROAD clients, here for completeness
@@ -111,6 +109,18 @@ except NameError:
     # probably Python 3
     unicode = str
 
+try:
+    basestring
+except NameError:
+    # probably Python 3
+    basestring = str
+
+try:
+    long
+except NameError:
+    # probably Python 3
+    long = int
+
 class AppServerError(Exception):
     """Base OpenROAD AppServer Exception"""
 
@@ -123,31 +133,85 @@ class ApplicationNotFound(AppServerError):
     """No such application"""
 
 
+class PoolTimeout(AppServerError):
+    """Timed out waiting for a connection from an RSOPool"""
+
+
+class PoolClosed(AppServerError):
+    """RSOPool has been closed"""
+
+
+class BackendNotAvailable(AppServerError):
+    """No OpenROAD client library (backend) available, see set_backend()"""
+
+
+class TransferError(AppServerError):
+    """Chunked transfer failed, see send_stream() and receive_stream().
+    offset is the number of bytes known to have been transferred (from the
+    start of the data), pass it to resume the transfer. error is the
+    original exception"""
+    def __init__(self, message, offset, error=None):
+        AppServerError.__init__(self, message)
+        self.offset = offset
+        self.error = error
+
+
 class Binary:
     """Simple class for caller to indicate data is binary
     Currently both str (bytes) and unicode Python types are treated as string,
     this may change but for now this offers a way to preserve that behavior
     and allow binary (LongByteObject / BitmapObject) to be sent/received.
     NOTE this is ONLY used to send binary to OpenROAD. str (bytes) are
-    always returned in Python for binary OpenROAD binary types.
+    returned in Python for binary OpenROAD binary types unless a binary
+    result type is requested, see callproc().
+
+    data can be any object supporting the buffer protocol, e.g. bytes,
+    bytearray, memoryview, array.array or mmap. It is not copied until
+    it is set in a PDO. To upload a file use Binary.from_file().
     """
     def __init__(self, data):
         self.data = data
+        self._file = None
 
-if win32com_client_Dispatch:
-    def ParameterData(func_sig):
-        """Emulate Java interface to generate pdo parameter defs"""
-        pdo = win32com_client_Dispatch('OpenROAD.ParameterData')
-        param_list = func_sig.split(';')
-        #print 'DEBUG', param_list
-        for param_info in param_list:
-            if param_info:
-                param_name, param_type = param_info.split('=')
-                param_name = param_name.strip()
-                param_type = param_type.strip()
-                #print 'DEBUG', (param_name, param_type)
-                pdo.DeclareAttribute(param_name, param_type)
-        return pdo
+    @classmethod
+    def from_file(cls, filename):
+        """Binary for the contents of a file, memory mapped where possible
+        so that the file is not read into memory (by Python).
+        Use close() (or with statement) when done"""
+        f = open(filename, 'rb')
+        try:
+            import mmap
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ImportError, ValueError, EnvironmentError):
+            # No mmap (Jython), or empty file which can not be mapped
+            data = f.read()
+        result = cls(data)
+        result._file = f
+        return result
+
+    def __len__(self):
+        return len(self.data)
+
+    def close(self):
+        """Release file (and mapping) for Binary.from_file()"""
+        if self._file is not None:
+            if hasattr(self.data, 'close'):
+                self.data.close()  # mmap
+            self._file.close()
+            self._file = None
+            self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+def ParameterData(func_sig):
+    """Return new PDO with parameters in signature string func_sig declared,
+    using the current backend"""
+    return get_backend().ParameterData(func_sig)
 
 
 def func_sig2meta(func_sig):
@@ -206,9 +270,9 @@ def guessmeta_from_values(values):
             # nested data...
             type_name = 'USERCLASS'
             # now all attributes in class
-            # FIXME this (probably) only works for un-nested UserClasses
+            # including nested userclass/array attributes
             tmp_param_meta = guessmeta_from_values(param_value)
-            for sub_param_name in param_value:
+            for sub_param_name in tmp_param_meta:
                 fully_qualified_sub_param_name = param_name + '.' + sub_param_name
                 param_meta[fully_qualified_sub_param_name] = tmp_param_meta[sub_param_name]
         elif isinstance(param_value, Binary):
@@ -223,18 +287,21 @@ def guessmeta_from_values(values):
             type_name = 'FLOAT'  # or DOUBLE/
         elif isinstance(param_value, datetime.date):
             type_name = 'DATE'
-            """
         elif isinstance(param_value, list) or isinstance(param_value, tuple):  # simple isinstance(param_value, collections.Iterable) check
-            # OpenROAD Array or some kind, really need to know the target
-            # type (/class). In all likely hood this is going to be a
-            # userclass
-
-            # for simple types, sniff the first item
-            first_item = None
-            for first_item in param_value:
-                break
-            type_name = 'ARRAY of....'
-            """
+            # OpenROAD Array of userclass, the target class is not known so
+            # guess attributes from a sample row made up of the first
+            # non-NULL value for each attribute (NULLs give STRING)
+            type_name = 'UCARRAY'
+            sample_row = {}
+            for row in param_value:
+                if not isinstance(row, dict):
+                    raise NotImplementedError('unsupported array item %r for param %r during set type, only arrays of userclasses (dict) are supported' % (type(row), param_name))
+                for sub_param_name in row:
+                    if sample_row.get(sub_param_name) is None:
+                        sample_row[sub_param_name] = row[sub_param_name]
+            tmp_param_meta = guessmeta_from_values(sample_row)
+            for sub_param_name in tmp_param_meta:
+                param_meta[param_name + '.' + sub_param_name] = tmp_param_meta[sub_param_name]
         else:
             pytype_info = '%r(%r)' % (param_value.__class__.__name__, type(param_value))
             raise NotImplementedError('unsupported type %r for param %r during set type' % (pytype_info, param_name))
@@ -269,34 +336,69 @@ def scp_clean_type_name(type_name):
     return type_name
 
 
-def scp_class_metadata_to_meta(app_metadata, class_name):
+def scp_is_array(param_info):
+    """Given SCP metadata for a param (or class attribute), return True if it is an array"""
+    return param_info.get('isarray', '0').lower() in ('1', 'true', 'yes')
+
+
+def scp_class_metadata_to_meta(app_metadata, class_name, class_memo=None, _in_progress=None):
+    """Given SCP data and userclass name, return dictionary of attribute
+    metadata for the class. Nested userclasses (and arrays) are flattened
+    into fully qualified names relative to the class, e.g.
+        {'attr_int': 'INTEGER', 'sub': 'USERCLASS', 'sub.attr_str': 'STRING'}
+
+    Returns None if the class is not in the metadata. Results are memoized
+    in dictionary `class_memo` (class_name -> class meta) if given, results
+    MUST NOT be modified. Classes that (indirectly) contain themselves can
+    not be flattened, NotImplementedError is raised.
+    """
+    if class_memo is None:
+        class_memo = {}
+    class_meta = class_memo.get(class_name)
+    if class_meta is not None:
+        return class_meta
+    userclass_metadata = app_metadata.get('*classes*', {}).get(class_name)
+    if userclass_metadata is None:
+        return None
+    if _in_progress is None:
+        _in_progress = set()
+    if class_name in _in_progress:
+        raise NotImplementedError('userclass %r contains itself, unsupported during scp_class_metadata_to_meta' % (class_name,))
+    _in_progress.add(class_name)
     class_meta = {}
-    userclasses_metadata = app_metadata['*classes*']
-    #print 'userclasses_metadata'
-    #pprint(userclasses_metadata )
-    
-    userclass_metadata = userclasses_metadata.get(class_name)
-    #print 'userclass_metadata', userclass_metadata
-    #pprint (userclass_metadata)
-    #pprint (userclass_metadata['params'])
     for attr_name in userclass_metadata['params']:
-        #print 'attr_name ', attr_name 
-        type_name = userclass_metadata['params'][attr_name]['type']
-        type_name = type_name.upper()
-        type_name = scp_clean_type_name(type_name)
-        if type_name not in VALID_OPENROAD_SIGNATURE_TYPES:
-            # this could be another userclass name!
-            raise NotImplementedError('unsupported type %r for class %r during scp_class_metadata_to_meta' % (type_name, class_name))
-        class_meta[attr_name] = type_name
-    return class_meta 
-
-def scp_metadata_to_meta(app_metadata, method_name):
+        _scp_param_to_meta(app_metadata, attr_name, userclass_metadata['params'][attr_name], class_meta, class_memo, _in_progress)
+    _in_progress.discard(class_name)
+    class_memo[class_name] = class_meta
+    return class_meta
+
+def _scp_param_to_meta(app_metadata, param_name, param_info, param_meta, class_memo, in_progress):
+    """Add metadata for one SCP param (or class attribute) to param_meta"""
+    type_name = param_info['type']
+    class_name = type_name.lower()
+    type_name = type_name.upper()
+    type_name = scp_clean_type_name(type_name)
+    if type_name not in VALID_OPENROAD_SIGNATURE_TYPES:
+        # This is almost certainly a UserClass, which we should be able to lookup in the metadata
+        class_meta = scp_class_metadata_to_meta(app_metadata, class_name, class_memo, in_progress)
+        if class_meta is None:
+            raise NotImplementedError('unsupported type %r for param %r during scp_metadata_to_meta' % (type_name, param_name))
+        for sub_param_name in class_meta:
+            param_meta[param_name + '.' + sub_param_name] = class_meta[sub_param_name]
+        if scp_is_array(param_info):
+            type_name = 'UCARRAY'
+        else:
+            type_name = 'USERCLASS'
+    param_meta[param_name] = type_name
+
+def scp_metadata_to_meta(app_metadata, method_name, class_memo=None):
     """Given SCP data and function/method name, return dictionary
     of parameter metadata suitable for use with meta2func_sig()
 
     `app_metadata` is output from get_meta_data(). SCP (obtained metadata)
     is provided in XML format by OpenROAD appserver, get_meta_data()
     obtains SCP data and converts into nested dicts.
+    `class_memo` see scp_class_metadata_to_meta()
     """
     param_meta = {}
     scp_function_metadata = app_metadata.get(method_name) or app_metadata.get('SCP_' + method_name)
@@ -305,26 +407,34 @@ def scp_metadata_to_meta(app_metadata, method_name):
         scp_param_data = scp_function_metadata['params']
         #pprint(scp_param_data)  # DEBUG
         for param_name in scp_param_data:
-            type_name = scp_param_data[param_name]['type']
-            type_name = type_name.upper()
-            type_name = scp_clean_type_name(type_name)
-            if type_name not in VALID_OPENROAD_SIGNATURE_TYPES:
-                # This is almost certainly a UserClass, which we should be able to lookup in the metadata
-                class_meta = scp_class_metadata_to_meta(app_metadata, type_name.lower())
-                if class_meta:
-                    for sub_param_name in class_meta:
-                        fully_qualified_sub_param_name = param_name + '.' + sub_param_name
-                        #print fully_qualified_sub_param_name
-                        sub_type_name = class_meta[sub_param_name]
-                        param_meta[fully_qualified_sub_param_name] = sub_type_name
-
-                    type_name = 'USERCLASS'
-                else:
-                    raise NotImplementedError('unsupported type %r for param %r during scp_metadata_to_meta' % (type_name, param_name))
-            param_meta[param_name] = type_name
+            _scp_param_to_meta(app_metadata, param_name, scp_param_data[param_name], param_meta, class_memo, None)
     return param_meta
 
 
+def scp_metadata_class_names(app_metadata, method_name):
+    """Given SCP data and function/method name, return dictionary of
+    param_name -> userclass name for userclass and array parameters
+    (including nested attributes), names as in scp_metadata_to_meta()
+    """
+    class_names = {}
+    scp_function_metadata = app_metadata.get(method_name) or app_metadata.get('SCP_' + method_name)
+    if scp_function_metadata:
+        _scp_class_names(app_metadata, scp_function_metadata['params'], '', class_names, set())
+    return class_names
+
+def _scp_class_names(app_metadata, params, prefix, class_names, in_progress):
+    classes = app_metadata.get('*classes*', {})
+    for param_name in params:
+        class_name = params[param_name]['type'].lower()
+        userclass_metadata = classes.get(class_name)
+        if userclass_metadata is None or class_name in in_progress:
+            continue  # simple type (or unsupported recursive class)
+        class_names[prefix + param_name] = class_name
+        in_progress.add(class_name)
+        _scp_class_names(app_metadata, userclass_metadata['params'], prefix + param_name + '.', class_names, in_progress)
+        in_progress.discard(class_name)
+
+
 ARRAY_INDICATOR = '*array*'
 
 
@@ -349,13 +459,358 @@ def meta2metatree(param_meta):
             for tmp_name in tmp_name_list:
                 tmp_dict[tmp_name] = tmp_dict.get(tmp_name, {})
                 tmp_dict = tmp_dict[tmp_name]
-            tmp_dict[last_name] = param_type
+            if param_type in ('USERCLASS', 'UCARRAY'):
+                # nested userclass/array, may already have been created by an attribute
+                tmp_dict[last_name] = tmp_dict.get(last_name, {})
+                if param_type == 'UCARRAY':
+                    tmp_dict[last_name][ARRAY_INDICATOR] = True
+            else:
+                tmp_dict[last_name] = param_type
     return new_param_meta
 
 
-def pdo_set_value(pdo, param_meta, param_name, param_value):
+class LRUCache(object):
+    """Thread safe, bounded, least recently used cache with hit/miss/eviction
+    counters. Used to hold compiled CallPlan instances.
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value  # now most recently used
+            self.hits += 1
+            return value
+        finally:
+            self._lock.release()
+
+    def put(self, key, value):
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
+
+
+class CallPlan(object):
+    """Compiled (immutable) call plan for a procedure signature.
+
+    Holds everything callproc() needs that only depends on the signature:
+        func_sig - signature string, as accepted by ParameterData()
+        param_meta - flat dictionary, see func_sig2meta()
+        meta_tree - nested dictionary, see meta2metatree()
+        value_names - tuple of (non userclass/array) attribute names
+        reusable - True if a PDO declared with this plan can be reset and reused
+        setters - dictionary of param_name -> setter, see compile_setters()
+        getters - list of compiled getters, see compile_getters()
+        class_names - dictionary of param_name -> userclass name (may be
+            empty), used to name Record types, see scp_metadata_class_names()
+        backend - Backend the setters and getters were compiled for, plans
+            for a previous backend are recompiled by resolve_call_plan()
+
+    Getters for other result modes are compiled on first use, see
+    result_getters().
+
+    Do not create directly, use get_call_plan() so that parsing
+    happens once per distinct signature. param_meta and meta_tree are shared
+    between callers and MUST NOT be modified.
+    """
+    __slots__ = ('func_sig', 'param_meta', 'meta_tree', 'value_names', 'reusable', 'setters', 'getters', 'class_names', 'backend', '_result_getters')
+
+    def __init__(self, func_sig, param_meta, class_names=None):
+        object.__setattr__(self, 'backend', get_backend())
+        object.__setattr__(self, 'func_sig', func_sig)
+        object.__setattr__(self, 'param_meta', param_meta)
+        object.__setattr__(self, 'class_names', class_names or {})
+        object.__setattr__(self, 'meta_tree', meta2metatree(param_meta))
+        value_names = [name for name in param_meta if param_meta[name] not in ('USERCLASS', 'UCARRAY')]
+        value_names.sort()
+        object.__setattr__(self, 'value_names', tuple(value_names))
+        # array rows can not be removed from a PDO, so only plans without arrays can be reused
+        object.__setattr__(self, 'reusable', 'UCARRAY' not in param_meta.values())
+        # bind each parameter to the converter for the backend once, rather than per call
+        object.__setattr__(self, 'setters', compile_setters(param_meta))
+        object.__setattr__(self, 'getters', compile_getters(self.meta_tree))
+        object.__setattr__(self, '_result_getters', {(False, False, None): self.getters})
+
+    def result_getters(self, columnar=False, records=False, binary=None):
+        """Return compiled getters for result mode, see callproc()"""
+        key = (bool(columnar), bool(records), binary)
+        getters = self._result_getters.get(key)
+        if getters is None:
+            if binary not in BINARY_RESULT_TYPES:
+                raise ValueError('invalid binary result type %r' % (binary,))
+            # NOTE compiling more than once (race between threads) is harmless
+            getters = self._result_getters[key] = compile_getters(self.meta_tree, columnar=columnar, records=records, binary=binary, class_names=self.class_names)
+        return getters
+
+    @property
+    def columnar_getters(self):
+        return self.result_getters(columnar=True)
+
+    @property
+    def record_getters(self):
+        return self.result_getters(records=True)
+
+    def __setattr__(self, key, value):
+        raise AttributeError('CallPlan is immutable')
+
+    def __delattr__(self, key):
+        raise AttributeError('CallPlan is immutable')
+
+    def __repr__(self):
+        return '<CallPlan %r>' % self.func_sig
+
+
+call_plan_cache = LRUCache(maxsize=512)
+
+
+def get_call_plan(func_sig=None, param_meta=None, class_names=None):
+    """Return (cached) CallPlan for either a signature string `func_sig`
+    or a dictionary of parameter metadata `param_meta`.
+    class_names is an optional dictionary of param_name -> userclass name,
+    see scp_metadata_class_names().
+
+    Example:
+        plan = get_call_plan('hellostring=STRING; counter=INTEGER')
+        plan = get_call_plan(param_meta={u'counter': 'INTEGER', u'hellostring': 'STRING'})
+    """
+    if func_sig is not None:
+        key = func_sig
+    else:
+        key = frozenset(param_meta.items())
+    if class_names:
+        key = (key, frozenset(class_names.items()))
+    plan = call_plan_cache.get(key)
+    if plan is None:
+        if func_sig is not None:
+            if func_sig:
+                param_meta = func_sig2meta(func_sig)
+            else:
+                param_meta = {}
+        else:
+            func_sig = meta2func_sig(param_meta)
+            param_meta = dict(param_meta)  # take a private copy
+        plan = CallPlan(func_sig, param_meta, dict(class_names or {}))
+        call_plan_cache.put(key, plan)
+    return plan
+
+
+def _unsupported_set(pdo, param_name, param_value):
+    pytype_info = '%r(%r)' % (param_value.__class__.__name__, type(param_value))
+    raise NotImplementedError('unsupported type %r for param %r during set data' % (pytype_info, param_name))
+
+
+def _com_set_value(pdo, param_name, param_value):
+    pdo.SetAttribute(param_name, param_value)
+
+
+def _ubyte_array(data):
+    """Return array.array('B') with contents of data (any buffer protocol
+    object), copied once with no per byte conversion"""
+    if isinstance(data, array.array) and data.typecode == 'B':
+        return data
+    result = array.array('B')
+    if hasattr(result, 'frombytes'):
+        view = memoryview(data)
+        try:
+            result.frombytes(view)
+        finally:
+            view.release()  # so that an mmap can be closed
+    else:
+        # Python 2.x
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        result.fromstring(data)
+    return result
+
+
+def _com_set_binary(pdo, param_name, param_value):
+    if isinstance(param_value, Binary):
+        param_value = param_value.data
+    # end up with UTF16-LE values in target (and results) if just use bytes/str and built in COM translation
+    #param_value = array.array('B', param_value)  # fails, arrays of 'B' are supposed to be supported :-(
+    # Passing in bytes/str into VARIANT does not work either
+    param_value = win32com.client.VARIANT(pythoncom.VT_ARRAY | pythoncom.VT_UI1, _ubyte_array(param_value))
+    pdo.SetAttribute(param_name, param_value)  # now treat like a regular attribute
+
+
+def _com_set_date(pdo, param_name, param_value):
+    # Python has a Date and a DateTime type, it makes sense to support both (as input)
+    # No attempt is made to deal with timezone information (partly as OpenROAD DCOM library appears to be doing something
+
+    """
+    # NOTE this tz code makes no impact on tests
+    if isinstance(param_value, datetime.datetime):
+        if param_value.utcoffset() is None:
+            # no tzinfo specified, OpenROAD will likely apply some tz foo
+            import win32timezone
+            utc_tzinfo = win32timezone.TimeZoneInfo('UTC', True)
+            param_value.replace(tzinfo = utc_tzinfo)
+    """
+
+    # check datetime first as datetime is also an instance of date
+    if isinstance(param_value, datetime.datetime):
+        pdo.SetAttribute(param_name, param_value)  # treat like a regular attribute
+    elif isinstance(param_value, datetime.date):
+        # date only
+        pdo.SetDateWithoutTime(param_name, param_value)
+    else:
+        _unsupported_set(pdo, param_name, param_value)
+
+
+def _java_set_binary(pdo, param_name, param_value):
+    if isinstance(param_value, Binary):
+        param_value = param_value.data
+    if not isinstance(param_value, (str, array.array)):
+        # bytearray, memoryview, etc. str and array are passed as byte[] as-is
+        param_value = memoryview(param_value).tobytes()
+    pdo.setByteArray(param_name, param_value)
+
+
+def _java_set_string(pdo, param_name, param_value):
+    pdo.setString(param_name, param_value)
+
+
+def _java_set_integer(pdo, param_name, param_value):
+    pdo.setInt(param_name, param_value)
+
+
+def _java_set_date(pdo, param_name, param_value):
+    # No attempt is made to deal with timezone information (partly as OpenROAD DCOM library appears to be doing something
+    # TODO currently using a mix of util and sql Date classes
+
+    # Python has a Date and a DateTime type, it makes sense to support both (as input)
+    # check datetime first as datetime is also an instance of date
+    if isinstance(param_value, datetime.datetime):
+        param_value = java.sql.Timestamp.valueOf(param_value.strftime('%Y-%m-%d %H:%M:%S') + ('.%d' % param_value.microsecond))
+        pdo.setDate(param_name, param_value)
+    elif isinstance(param_value, datetime.date):
+        #param_value = java.sql.Date.valueOf(param_value.isoformat())  # date only using sql class
+        param_value = java.util.Date(param_value.year - 1900, param_value.month - 1, param_value.day, 0, 0, 0)  # NOTE using Deprecated methods, as of JDK version 1.1
+        #print 'param_value.getTimezoneOffset()', param_value.getTimezoneOffset()
+        pdo.setDateWithoutTime(param_name, param_value)
+    else:
+        _unsupported_set(pdo, param_name, param_value)
+
+
+def _java_set_decimal(pdo, param_name, param_value):
+    pdo.setBigDecimal(param_name, param_value)
+
+
+def _java_set_float(pdo, param_name, param_value):
+    pdo.setDouble(param_name, param_value)
+
+
+# Setter dispatch tables, type_name -> function(pdo, param_name, param_value)
+# To support a new type add an entry to the table for the backend.
+COM_VALUE_SETTERS = {
+    'BINARY': _com_set_binary,
+    'DATE': _com_set_date,
+}
+JAVA_VALUE_SETTERS = {
+    'BINARY': _java_set_binary,
+    'STRING': _java_set_string,
+    'INTEGER': _java_set_integer,
+    'DATE': _java_set_date,
+    'DECIMAL': _java_set_decimal,
+    'FLOAT': _java_set_float,
+}
+
+
+def get_value_setter(type_name):
+    """Return setter function(pdo, param_name, param_value) for (non userclass) `type_name`"""
+    backend = get_backend()
+    return backend.value_setters.get(type_name, backend.default_value_setter)
+
+
+def compile_setters(param_meta):
+    """Return dictionary of param_name -> setter function(pdo, param_name, param_value)
+    for every (fully qualified) parameter name in `param_meta`.
+    """
+    setters = {}
+
+    # NOTE setters are looked up by (unindexed) metadata name, param_name
+    # passed to the setter is the real attribute name which for attributes
+    # of array rows includes the row index, e.g. 'p1[3].attr_int'
+    def make_userclass_setter(meta_name):
+        def set_userclass(pdo, param_name, param_value):
+            # There is no SetAttribute() for UserClasses
+            # set each attribute for the userclass seperately
+            for sub_param_name in param_value:
+                setters[meta_name + '.' + sub_param_name](pdo, param_name + '.' + sub_param_name, param_value[sub_param_name])
+        return set_userclass
+
+    def make_array_setter(meta_name):
+        meta_prefix = meta_name + '.'
+        def set_array(pdo, param_name, param_value):
+            # one row (userclass) at a time, OpenROAD indexes start from 1
+            row_number = 0
+            for row in param_value:
+                row_number += 1
+                row_prefix = '%s[%d].' % (param_name, row_number)
+                for sub_param_name in row:
+                    setters[meta_prefix + sub_param_name](pdo, row_prefix + sub_param_name, row[sub_param_name])
+        return set_array
+
+    for param_name in param_meta:
+        type_name = param_meta[param_name]
+        if type_name == 'USERCLASS':
+            setters[param_name] = make_userclass_setter(param_name)
+        elif type_name == 'UCARRAY':
+            setters[param_name] = make_array_setter(param_name)
+        else:
+            setters[param_name] = get_value_setter(type_name)
+    return setters
+
+
+def pdo_set_value(pdo, param_meta, param_name, param_value, meta_name=None):
+    """meta_name is the name in param_meta if different to param_name,
+    i.e. for attributes of array rows"""
     #import pdb ; pdb.set_trace()
-    type_name = param_meta[param_name]
+    if meta_name is None:
+        meta_name = param_name
+    type_name = param_meta[meta_name]
 
     if type_name == 'USERCLASS':
         # There is no SetAttribute() for UserClasses
@@ -363,178 +818,304 @@ def pdo_set_value(pdo, param_meta, param_name, param_value):
         for sub_param_name in param_value:
             fully_qualified_sub_param_name = param_name + '.' + sub_param_name
             sub_param_value = param_value.get(sub_param_name)
-            pdo_set_value(pdo, param_meta, fully_qualified_sub_param_name, sub_param_value)
+            pdo_set_value(pdo, param_meta, fully_qualified_sub_param_name, sub_param_value, meta_name=meta_name + '.' + sub_param_name)
+        return
+    elif type_name == 'UCARRAY':
+        for row_number, row in enumerate(param_value):
+            row_prefix = '%s[%d].' % (param_name, row_number + 1)  # OpenROAD indexes start from 1
+            for sub_param_name in row:
+                pdo_set_value(pdo, param_meta, row_prefix + sub_param_name, row[sub_param_name], meta_name=meta_name + '.' + sub_param_name)
         return
 
-    if win32com_client_Dispatch:
-        if type_name == 'BINARY':
-            if isinstance(param_value, Binary):
-                param_value = param_value.data
-            # end up with UTF16-LE values in target (and results) if just use bytes/str and built in COM translation
-            #param_value = array.array('B', param_value)  # fails, arrays of 'B' are supposed to be supported :-(
-            # Passing in bytes/str into VARIANT does not work either
-            param_value = win32com.client.VARIANT(pythoncom.VT_ARRAY | pythoncom.VT_UI1, array.array('B', param_value))
-            pdo.SetAttribute(param_name, param_value)  # now treat like a regular attribute
-        elif type_name == 'DATE':
-            # Python has a Date and a DateTime type, it makes sense to support both (as input)
-            # No attempt is made to deal with timezone information (partly as OpenROAD DCOM library appears to be doing something
-
-            """
-            # NOTE this tz code makes no impact on tests
-            if isinstance(param_value, datetime.datetime):
-                if param_value.utcoffset() is None:
-                    # no tzinfo specified, OpenROAD will likely apply some tz foo
-                    import win32timezone
-                    utc_tzinfo = win32timezone.TimeZoneInfo('UTC', True)
-                    param_value.replace(tzinfo = utc_tzinfo)
-            """
-
-            # check datetime first as datetime is also an instance of date
-            if isinstance(param_value, datetime.datetime):
-                pdo.SetAttribute(param_name, param_value)  # treat like a regular attribute
-            elif isinstance(param_value, datetime.date):
-                # date only
-                pdo.SetDateWithoutTime(param_name, param_value)
-            else:
-                pytype_info = '%r(%r)' % (param_value.__class__.__name__, type(param_value))
-                raise NotImplementedError('unsupported type %r for param %r during set data' % (pytype_info, param_name))
-        else:
-            pdo.SetAttribute(param_name, param_value)
+    get_value_setter(type_name)(pdo, param_name, param_value)
+
+
+def pdo_set_null(pdo, param_name):
+    get_backend().pdo_set_null(pdo, param_name)
+
+
+class ParameterDataPool(object):
+    """Per signature pool of already declared ParameterData (PDO) templates.
+
+    A PDO is checked out for exclusive use by one call, once the call is
+    complete it is checked back in where the values are reset to NULL ready
+    for reuse by the next call with the same plan. PDOs from failed calls
+    should NOT be checked in.
+
+    Plans with arrays (UCARRAY) are never pooled, checkout() always
+    returns a new PDO for them.
+    """
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle  # maximum number of idle PDOs per signature
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def checkout(self, plan):
+        if plan.reusable:
+            self._lock.acquire()
+            try:
+                idle = self._idle.get(plan.func_sig)
+                if idle:
+                    return idle.pop()
+            finally:
+                self._lock.release()
+        return ParameterData(plan.func_sig)
+
+    def reset(self, plan, pdo):
+        """Set all values in PDO to NULL. Returns False if PDO can not be reused"""
+        if not plan.reusable:
+            return False
+        try:
+            for param_name in plan.value_names:
+                pdo_set_null(pdo, param_name)
+        except Exception:
+            return False
+        return True
+
+    def checkin(self, plan, pdo, reset=True):
+        """Return PDO for reuse, reset should only be False if reset() has already been called"""
+        if not plan.reusable or self.max_idle <= 0:
+            return
+        if reset and not self.reset(plan, pdo):
+            return  # unable to reset, do not reuse
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(plan.func_sig, [])
+            if len(idle) < self.max_idle:
+                idle.append(pdo)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+
+parameter_data_pool = ParameterDataPool()
+
+
+def _unsupported_get(pdo, param_name):
+    raise NotImplementedError('unsupported type for param %r during get data' % (param_name,))
+
+
+# COM interface returns reasonable type for
+#   STRING, INTEGER, and FLOAT
+# COM returns STRING for Decimal values
+def _com_get_value(pdo, param_name):
+    return pdo.GetAttribute(param_name)
+
+
+def _com_get_binary(pdo, param_name):
+    result = pdo.GetAttribute(param_name)
+    if result is not None:
+        # We end up with a buffer (py3 memoryview)
+        # Whilst buffers are memory efficient, they are not
+        # directly convertable to simple types without manual
+        # intervention
+        result = result[:]
+    return result
+
+
+def _memoryview(data):
+    """memoryview of data, without a copy where possible. Python 2 buffer
+    objects (returned by pywin32) do not support memoryview, they are
+    copied into a str first"""
+    try:
+        return memoryview(data)
+    except TypeError:
+        return memoryview(data[:])
+
+
+def _com_get_bytearray(pdo, param_name):
+    result = pdo.GetAttribute(param_name)
+    if result is not None:
+        result = bytearray(result)  # single copy, from the buffer
+    return result
+
+
+def _com_get_memoryview(pdo, param_name):
+    result = pdo.GetAttribute(param_name)
+    if result is not None:
+        result = _memoryview(result)  # no copy, except under Python 2
+    return result
+
+
+def _com_get_date(pdo, param_name):
+    # OpenROAD always returns a DateTime, never Date only
+    # No attempt is made to deal with timezone information (partly as OpenROAD DCOM library appears to be doing something
+    """Python COM type is PyTime as described at
+    http://timgolden.me.uk/pywin32-docs/PyTime.html
+    Properties
+        int year
+        int month
+        int weekday
+        int day
+        int hour
+        int minute
+        int second
+        int msec
+
+    Also it is likely UTC based which means pytz will be needed
+    """
+    pytime_value = pdo.GetAttribute(param_name)
+    if pytime_value is None:
+        return None
+    # ignore timezone
+    return datetime.datetime(
+        year=pytime_value.year,
+        month=pytime_value.month,
+        day=pytime_value.day,
+        hour=pytime_value.hour,
+        minute=pytime_value.minute,
+        second=pytime_value.second
+    )
+
+
+def _com_get_decimal(pdo, param_name):
+    result = pdo.GetAttribute(param_name)
+    if result is not None:
+        result = decimal.Decimal(result)
+    return result
+
+
+def _java_get_string(pdo, param_name):
+    if pdo.isNull(param_name):
+        return None
+    return pdo.getString(param_name)
+
+
+def _java_get_integer(pdo, param_name):
+    if pdo.isNull(param_name):
+        return None
+    return pdo.getInt(param_name)
+
+
+def _java_get_binary(pdo, param_name):
+    if pdo.isNull(param_name):
+        return None
+    result = pdo.getByteArray(param_name)
+    # this is now a Python array type
+    if result.typecode == 'b':
+        result = result.tostring()  # Convert to a bytes (str) i.e. not Unicode
     else:
-        if type_name == 'BINARY':
-            if isinstance(param_value, Binary):
-                param_value = param_value.data
-            pdo.setByteArray(param_name, param_value)
-        elif type_name == 'STRING':
-            pdo.setString(param_name, param_value)
-        elif type_name == 'INTEGER':
-            pdo.setInt(param_name, param_value)
-        elif type_name == 'DATE':
-            # No attempt is made to deal with timezone information (partly as OpenROAD DCOM library appears to be doing something
-            # TODO currently using a mix of util and sql Date classes
-
-            # Python has a Date and a DateTime type, it makes sense to support both (as input)
-            # check datetime first as datetime is also an instance of date
-            if isinstance(param_value, datetime.datetime):
-                param_value = java.sql.Timestamp.valueOf(param_value.strftime('%Y-%m-%d %H:%M:%S') + ('.%d' % param_value.microsecond))
-                pdo.setDate(param_name, param_value)
-            elif isinstance(param_value, datetime.date):
-                #param_value = java.sql.Date.valueOf(param_value.isoformat())  # date only using sql class
-                param_value = java.util.Date(param_value.year - 1900, param_value.month - 1, param_value.day, 0, 0, 0)  # NOTE using Deprecated methods, as of JDK version 1.1
-                #print 'param_value.getTimezoneOffset()', param_value.getTimezoneOffset()
-                pdo.setDateWithoutTime(param_name, param_value)
-            else:
-                pytype_info = '%r(%r)' % (param_value.__class__.__name__, type(param_value))
-                raise NotImplementedError('unsupported type %r for param %r during set data' % (pytype_info, param_name))
-        elif type_name == 'DECIMAL':
-            pdo.setBigDecimal(param_name, param_value)
-        elif type_name == 'FLOAT':
-            pdo.setDouble(param_name, param_value)
-        else:
-            pytype_info = '%r(%r)' % (param_value.__class__.__name__, type(param_value))
-            raise NotImplementedError('unsupported type %r for param %r during set data' % (pytype_info, param_name))
+        pytype_info = '%r(%r)' % (result.__class__.__name__, type(result))
+        raise NotImplementedError('unsupported type %r for BINARY  typecode %r during get data' % (pytype_info, result.typecode))
+    return result
+
+
+def _java_get_bytearray(pdo, param_name):
+    result = _java_get_binary(pdo, param_name)
+    if result is not None:
+        result = bytearray(result)
+    return result
+
+
+def _java_get_memoryview(pdo, param_name):
+    result = _java_get_binary(pdo, param_name)
+    if result is not None:
+        result = _memoryview(result)
+    return result
+
+
+def _java_get_date(pdo, param_name):
+    if pdo.isNull(param_name):
+        return None
+    # OpenROAD always returns a DateTime, never Date only
+    # specifically a java.util.Date
+    # No attempt is made to deal with timezone information (partly as OpenROAD DCOM library appears to be doing something
+
+    # ignore timezone
+    d = pdo.getDate(param_name)
+    result = datetime.datetime(1900 + d.getYear(), 1 + d.getMonth(), d.getDate(), d.getHours(), d.getMinutes(), d.getSeconds())  # NOTE using Deprecated methods, as of JDK version 1.1
+    """
+    # NOTE this code causes test_comtest_echotypesnullable_027 to pass but test_comtest_echotypesnullable_029 to fail
+    # attempt to deal with timezone/tz NOTE really need tzinfo to handle this correctly
+    tz_offset = d.getTimezoneOffset()
+    if tz_offset:
+        result = result + datetime.timedelta(minutes=tz_offset)
+    """
+    return result
+
+
+def _java_get_money(pdo, param_name):
+    if pdo.isNull(param_name):
+        return None
+    return pdo.getBigDecimal(param_name)
+
+
+def _java_get_decimal(pdo, param_name):
+    if pdo.isNull(param_name):
+        return None
+    result = pdo.getBigDecimal(param_name)
+    # COM returns FLOAT? for Decimal values
+    if result:
+        result = decimal.Decimal(str(result))  # FIXME use more use formatting options?
+    return result
+
+
+def _java_get_float(pdo, param_name):
+    if pdo.isNull(param_name):
+        return None
+    return pdo.getDouble(param_name)
+
+
+# Getter dispatch tables, type_name -> function(pdo, param_name)
+# To support a new type add an entry to the table for the backend.
+COM_VALUE_GETTERS = {
+    'BINARY': _com_get_binary,
+    'DATE': _com_get_date,
+    'DECIMAL': _com_get_decimal,
+}
+JAVA_VALUE_GETTERS = {
+    'STRING': _java_get_string,
+    'INTEGER': _java_get_integer,
+    'SMALLINT': _java_get_integer,
+    'BINARY': _java_get_binary,
+    'DATE': _java_get_date,
+    'MONEY': _java_get_money,
+    'DECIMAL': _java_get_decimal,
+    'FLOAT': _java_get_float,
+}
+# TODO consider converting BINARY into Python 2.x str type?
+
+# Result types for BINARY values, see callproc()
+BINARY_BYTES = None  # default, str/bytes
+BINARY_BYTEARRAY = 'bytearray'
+BINARY_MEMORYVIEW = 'memoryview'  # no copy with COM, read only
+BINARY_RESULT_TYPES = (BINARY_BYTES, BINARY_BYTEARRAY, BINARY_MEMORYVIEW)
+
+# binary result type -> BINARY getter
+COM_BINARY_RESULT_GETTERS = {
+    BINARY_BYTEARRAY: _com_get_bytearray,
+    BINARY_MEMORYVIEW: _com_get_memoryview,
+}
+JAVA_BINARY_RESULT_GETTERS = {
+    BINARY_BYTEARRAY: _java_get_bytearray,
+    BINARY_MEMORYVIEW: _java_get_memoryview,
+}
+
+
+def get_value_getter(type_name):
+    """Return getter function(pdo, param_name) for (non userclass) `type_name`"""
+    backend = get_backend()
+    return backend.value_getters.get(type_name, backend.default_value_getter)
+
+
+def get_result_value_getter(type_name, binary=BINARY_BYTES):
+    """As get_value_getter() but BINARY values are returned as type `binary`"""
+    if type_name == 'BINARY' and binary is not BINARY_BYTES:
+        return get_backend().binary_result_getters[binary]
+    return get_value_getter(type_name)
+
 
 def pdo_get_value(pdo, param_meta, param_name, force_type_name=None):
     #import pdb ; pdb.set_trace()
     type_name = force_type_name or param_meta[param_name]
-    if win32com_client_Dispatch:
-        result = pdo.GetAttribute(param_name)
-        # COM interface returns reasonable type for
-        #   STRING, INTEGER, and FLOAT
-        # COM returns STRING for Decimal values
-        if result is not None:
-            if type_name == 'BINARY':
-                # We end up with a buffer (py3 memoryview)
-                # Whilst buffers are memory efficient, they are not
-                # directly convertable to simple types without manual
-                # intervention
-                result = result[:]
-            elif type_name == 'DATE':
-                # OpenROAD always returns a DateTime, never Date only
-                # No attempt is made to deal with timezone information (partly as OpenROAD DCOM library appears to be doing something
-                """Python COM type is PyTime as described at
-                http://timgolden.me.uk/pywin32-docs/PyTime.html
-                Properties
-                    int year
-                    int month
-                    int weekday
-                    int day
-                    int hour
-                    int minute
-                    int second
-                    int msec
-
-                Also it is likely UTC based which means pytz will be needed
-                """
-                """
-                # assume date only for now....
-                pytime_value = result
-                result = datetime.date(
-                    year=pytime_value.year,
-                    month=pytime_value.month,
-                    day=pytime_value.day
-                )
-                """
-                pytime_value = result
-                # ignore timezone
-                result = datetime.datetime(
-                    year=pytime_value.year,
-                    month=pytime_value.month,
-                    day=pytime_value.day,
-                    hour=pytime_value.hour,
-                    minute=pytime_value.minute,
-                    second=pytime_value.second
-                )
-            elif type_name == 'DECIMAL':
-                result = decimal.Decimal(result)
-    else:
-        if pdo.isNull(param_name):
-            result = None
-        elif type_name == 'STRING':
-            result = pdo.getString(param_name)
-        elif type_name == 'INTEGER':
-            result = pdo.getInt(param_name)
-        elif type_name == 'SMALLINT':
-            result = pdo.getInt(param_name)
-        elif type_name == 'BINARY':
-            result = pdo.getByteArray(param_name)
-            # this is now a Python array type
-            if result.typecode == 'b':
-                result = result.tostring()  # Convert to a bytes (str) i.e. not Unicode
-            else:
-                pytype_info = '%r(%r)' % (result.__class__.__name__, type(result))
-                raise NotImplementedError('unsupported type %r for BINARY  typecode %r during get data' % (pytype_info, result.typecode))
-        elif type_name == 'DATE':
-            # OpenROAD always returns a DateTime, never Date only
-            # specifically a java.util.Date
-            # No attempt is made to deal with timezone information (partly as OpenROAD DCOM library appears to be doing something
-
-            # ignore timezone
-            d = pdo.getDate(param_name)
-            result = datetime.datetime(1900 + d.getYear(), 1 + d.getMonth(), d.getDate(), d.getHours(), d.getMinutes(), d.getSeconds())  # NOTE using Deprecated methods, as of JDK version 1.1
-            """
-            # NOTE this code causes test_comtest_echotypesnullable_027 to pass but test_comtest_echotypesnullable_029 to fail
-            # attempt to deal with timezone/tz NOTE really need tzinfo to handle this correctly
-            tz_offset = d.getTimezoneOffset()
-            if tz_offset:
-                result = result + datetime.timedelta(minutes=tz_offset)
-            """
-        elif type_name == 'MONEY':
-            result = pdo.getBigDecimal(param_name)
-        elif type_name == 'DECIMAL':
-            result = pdo.getBigDecimal(param_name)
-            # COM returns FLOAT? for Decimal values
-            if result:
-                if type_name == 'DECIMAL':
-                    result = decimal.Decimal(str(result))  # FIXME use more use formatting options?
-        elif type_name == 'FLOAT':
-            result = pdo.getDouble(param_name)
-        else:
-                pytype_info = '%r(%r)' % (param_value.__class__.__name__, type(param_value))
-                raise NotImplementedError('unsupported type %r for param %r during get data' % (pytype_info, param_name))
-    # TODO consider converting BINARY into Python 2.x str type?
+    return get_value_getter(type_name)(pdo, param_name)
 
-    return result
 
 def pdo2flatdict(pdo, param_meta):
     """Optional add a "flat=True" parameter. If flat is true, user class attribute names are left as class.attribute, instead of creating a sub dictionary for the attributes
@@ -549,9 +1130,11 @@ def pdo2flatdict(pdo, param_meta):
             result[tmp_name] = pdo_get_value(pdo, param_meta, tmp_name)
     return result
 
-def pdo2treedict(pdo, param_meta, prefix=''):
+def pdo2treedict(pdo, param_meta, prefix='', records=False):
     """convert PDO into a (potentially) nested tree dictionary
     NOTE param_meta is expected to be nested, i.e. output from meta2metatree()
+    If records is True userclasses (and array rows) are Record instances
+    rather than dictionaries, see get_record_class()
     """
     result = {}
     for tmp_name in param_meta:
@@ -569,23 +1152,22 @@ def pdo2treedict(pdo, param_meta, prefix=''):
             new_tmp_name = tmp_name
             if prefix:
                 new_tmp_name = prefix + '.' + tmp_name
-            result[new_tmp_name] = result.get(new_tmp_name, [])
             is_array = type_info.get(ARRAY_INDICATOR)
             if is_array:
                 #import pdb ; pdb.set_trace()
-                if win32com_client_Dispatch:
-                    num_items = pdo.LastRow(new_tmp_name)
-                else:
-                    num_items = pdo.lastRow(new_tmp_name)
+                rows = result[tmp_name] = []
+                num_items = pdo_last_row(pdo, new_tmp_name)
                 # NOTE named tuple would be more space efficient but plain list of dict is easier to visualize as json
                 for i in range(1, num_items + 1):  # NOTE index starts from 1 in dcom?
                     # now need to get each element name in the array if a class.....
                     array_tmp_name = '%s[%d]' % (new_tmp_name, i)
-                    tmp_row = pdo2treedict(pdo, type_info, prefix=array_tmp_name)
-                    result[new_tmp_name].append(tmp_row)
+                    tmp_row = pdo2treedict(pdo, type_info, prefix=array_tmp_name, records=records)
+                    rows.append(tmp_row)
             else:
                 # userclass
-                result[tmp_name] = pdo2treedict(pdo, type_info, prefix=new_tmp_name)
+                result[tmp_name] = pdo2treedict(pdo, type_info, prefix=new_tmp_name, records=records)
+    if records and prefix:
+        result = get_record_class(result)(**result)
     return result
 
 def pdo2dict(pdo, param_meta):
@@ -593,57 +1175,466 @@ def pdo2dict(pdo, param_meta):
     result = pdo2treedict(pdo, tree_param_meta)
     return result
 
-def get_rso():
-    if win32com_client_Dispatch:
-        rso = win32com_client_Dispatch('OpenROAD.RemoteServer')
-    else:
-        rso = RemoteServer()
-    return rso
+class Record(object):
+    """Base class for generated userclass record types, see get_record_class().
+    Attributes are stored in __slots__, so instances are much smaller than
+    the equivalent dictionary.
+    """
+    __slots__ = ()
+    _fields = ()  # sorted attribute names
 
-def get_aso():
-    if win32com_client_Dispatch:
-        aso = win32com_client_Dispatch('OpenROAD.ASOSession')
-    else:
-        aso = ASOSession()
-    return aso
+    def __init__(self, *args, **kwargs):
+        for name, value in zip(self._fields, args):
+            object.__setattr__(self, name, value)
+        for name in self._fields[len(args):]:
+            object.__setattr__(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError('%s has no attribute(s) %r' % (self.__class__.__name__, sorted(kwargs)))
 
-def get_aso_and_attach_rso(rso):
-    aso = get_aso()
-    if win32com_client_Dispatch:
-        aso.AttachRSO(rso)
-    else:
-        aso.attachRSO(rso)
-    return aso
+    def to_dict(self):
+        """Return (nested) dictionary, as returned when records are not used"""
+        result = {}
+        for name in self._fields:
+            value = getattr(self, name)
+            if isinstance(value, Record):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [x.to_dict() if isinstance(x, Record) else x for x in value]
+            result[name] = value
+        return result
 
+    def __eq__(self, other):
+        if not isinstance(other, Record) or self._fields != other._fields:
+            return NotImplemented
+        for name in self._fields:
+            if getattr(self, name) != getattr(other, name):
+                return False
+        return True
 
-"""
-if win32com_client_Dispatch:
-    rso_initiate = rso.Initiate
-    rso_callproc = rso.CallProc
-else:
-    rso_initiate = rso.initiate
-    rso_callproc = rso.callProc
-"""
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
 
-# TODO Should callproc check i_error_no?
-if win32com_client_Dispatch:
-    def rso_initiate(rso, *args, **kwargs):
-        return rso.Initiate(*args, **kwargs)
-    def rso_callproc(rso, procedure_name, pdo_by_value, pdo_by_byref):
-        try:
-            return rso.CallProc(procedure_name, pdo_by_value, pdo_by_byref)
-        except pywintypes.com_error as info:
-            if info.excepinfo[2] == u'The specified procedure name was not found in the initiated application.':
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join('%s=%r' % (name, getattr(self, name)) for name in self._fields))
+
+
+record_classes = {}  # userclass name -> Record subclass
+unnamed_record_classes = {}  # tuple of sorted attribute names -> Record subclass
+record_classes_lock = threading.Lock()
+
+
+def get_record_class(attribute_names, class_name=None):
+    """Return (generated) Record subclass for a userclass with the given
+    attribute names (any iterable, order does not matter).
+
+    class_name is the OpenROAD userclass name, there is one record type per
+    userclass (replaced if the attributes of the class change). Without a
+    name (e.g. guessed signatures) lookup is structural, unnamed classes
+    with the same attribute names share a record type named Record.
+    """
+    fields = [str(name) for name in attribute_names if name != ARRAY_INDICATOR]
+    fields.sort()
+    fields = tuple(fields)
+    if class_name:
+        registry, key = record_classes, class_name
+    else:
+        registry, key = unnamed_record_classes, fields
+    record_class = registry.get(key)
+    if record_class is None or record_class._fields != fields:
+        record_classes_lock.acquire()
+        try:
+            record_class = registry.get(key)
+            if record_class is None or record_class._fields != fields:
+                record_class = type(str(class_name or 'Record'), (Record,), {'__slots__': fields, '_fields': fields})
+                record_class.class_name = class_name
+                registry[key] = record_class
+        finally:
+            record_classes_lock.release()
+    return record_class
+
+
+def register_record_classes(app_metadata):
+    """Create record types for all userclasses in metadata (output from
+    get_meta_data()). Returns dictionary of class_name -> Record subclass.
+    """
+    result = {}
+    for class_name, class_metadata in app_metadata.get('*classes*', {}).items():
+        result[class_name] = get_record_class(class_metadata['params'], class_name)
+    return result
+
+
+def pdo_last_row(pdo, param_name):
+    return get_backend().pdo_last_row(pdo, param_name)
+
+class RecordGetters(list):
+    """compile_getters() result for a userclass (or array row) decoded as a Record"""
+    __slots__ = ('record_class',)
+
+
+def compile_getters(meta_tree, prefix='', columnar=False, records=False, binary=None, class_names=None, meta_prefix=''):
+    """From nested parameter meta data (output from meta2metatree()) create
+    a flat list of (key, param_name, getter, sub_getters, is_array) entries
+    for use with pdo_decode().
+
+    getter is a function(pdo, param_name) for simple types, for userclasses
+    and arrays getter is None and sub_getters is the compiled list for the
+    class attributes. Array element attribute names are relative to the row.
+
+    If columnar is True arrays are decoded as a dictionary of column lists,
+    see compile_columnar_getter(). If records is True userclasses and array
+    rows are decoded as Record instances, see get_record_class(). binary
+    is the type for BINARY values, see get_result_value_getter().
+    class_names (param_name -> userclass name) names the Record types,
+    meta_prefix is the name of meta_tree in class_names (when nested).
+    """
+    getters = []
+    for key in meta_tree:
+        if key == ARRAY_INDICATOR:
+            continue  # skip, not a real attribute
+        type_info = meta_tree[key]
+        param_name = prefix + key
+        meta_name = meta_prefix + key
+        if not isinstance(type_info, dict):
+            getters.append((key, param_name, get_result_value_getter(type_info, binary), None, False))
+        elif type_info.get(ARRAY_INDICATOR):
+            if columnar:
+                getters.append((key, param_name, compile_columnar_getter(type_info, records=records, binary=binary, class_names=class_names, meta_name=meta_name), None, False))
+            else:
+                getters.append((key, param_name, None, _compile_sub_getters(type_info, '', False, records, binary, class_names, meta_name), True))
+        else:
+            # userclass
+            getters.append((key, param_name, None, _compile_sub_getters(type_info, param_name + '.', columnar, records, binary, class_names, meta_name), False))
+    return getters
+
+def _compile_sub_getters(type_info, prefix, columnar, records, binary, class_names=None, meta_name=''):
+    if not records:
+        return compile_getters(type_info, prefix=prefix, columnar=columnar, binary=binary)
+    # Record attributes are positional, sorted by name
+    sorted_type_info = OrderedDict((key, type_info[key]) for key in sorted(type_info))
+    getters = RecordGetters(compile_getters(sorted_type_info, prefix=prefix, columnar=columnar, records=True, binary=binary, class_names=class_names, meta_prefix=meta_name + '.'))
+    getters.record_class = get_record_class(type_info, class_names and class_names.get(meta_name))
+    return getters
+
+def pdo_decode(pdo, getters, row_prefix=''):
+    """Same result as pdo2treedict() but using getters from compile_getters()"""
+    result = {}
+    for key, param_name, getter, sub_getters, is_array in getters:
+        if row_prefix:
+            param_name = row_prefix + param_name
+        if getter is not None:
+            result[key] = getter(pdo, param_name)
+        else:
+            if sub_getters.__class__ is RecordGetters:
+                decode = pdo_decode_record
+            else:
+                decode = pdo_decode
+            if is_array:
+                rows = []
+                num_items = pdo_last_row(pdo, param_name)
+                for i in range(1, num_items + 1):  # NOTE index starts from 1 in dcom?
+                    rows.append(decode(pdo, sub_getters, row_prefix='%s[%d].' % (param_name, i)))
+                result[key] = rows
+            else:
+                result[key] = decode(pdo, sub_getters, row_prefix=row_prefix)
+    return result
+
+def pdo_decode_record(pdo, getters, row_prefix=''):
+    """As pdo_decode() but for RecordGetters, returns Record instance"""
+    values = []
+    for entry in getters:
+        getter = entry[2]
+        if getter is not None:
+            values.append(getter(pdo, row_prefix + entry[1]))
+        else:
+            values.append(pdo_decode(pdo, (entry,), row_prefix=row_prefix)[entry[0]])
+    return getters.record_class(*values)
+
+# array.array type codes for columnar decoding, other types use a list
+COLUMN_TYPECODES = {
+    'INTEGER': 'i',
+    'SMALLINT': 'h',
+    'FLOAT': 'd',
+}
+
+def _compile_columns(row_tree, records, binary, prefix='', class_names=None, meta_prefix=''):
+    """list of (column_key, getter, typecode) for (flattened) attributes of an array row"""
+    columns = []
+    for key in row_tree:
+        if key == ARRAY_INDICATOR:
+            continue  # skip, not a real attribute
+        type_info = row_tree[key]
+        column_key = prefix + key
+        if not isinstance(type_info, dict):
+            columns.append((column_key, get_result_value_getter(type_info, binary), COLUMN_TYPECODES.get(type_info)))
+        elif type_info.get(ARRAY_INDICATOR):
+            # nested array, one list of rows per parent row
+            columns.append((column_key, _compile_row_array_getter(_compile_sub_getters(type_info, '', False, records, binary, class_names, meta_prefix + key)), None))
+        else:
+            # userclass, flatten into dotted column names
+            columns.extend(_compile_columns(type_info, records, binary, prefix=column_key + '.', class_names=class_names, meta_prefix=meta_prefix + key + '.'))
+    return columns
+
+def _compile_row_array_getter(sub_getters):
+    if sub_getters.__class__ is RecordGetters:
+        decode = pdo_decode_record
+    else:
+        decode = pdo_decode
+
+    def get_rows(pdo, param_name):
+        num_items = pdo_last_row(pdo, param_name)
+        return [decode(pdo, sub_getters, row_prefix='%s[%d].' % (param_name, i)) for i in range(1, num_items + 1)]
+    return get_rows
+
+def _decode_column(pdo, getter, template, num_rows, typecode):
+    if typecode is None:
+        return [getter(pdo, template % i) for i in range(1, num_rows + 1)]
+    values = array.array(typecode)
+    append = values.append
+    for i in range(1, num_rows + 1):
+        value = getter(pdo, template % i)
+        try:
+            append(value)
+        except (TypeError, OverflowError):
+            # NULL (or out of range) value, rest of column is a plain list
+            values = values.tolist()
+            values.append(value)
+            values.extend([getter(pdo, template % j) for j in range(i + 1, num_rows + 1)])
+            break
+    return values
+
+def compile_columnar_getter(row_tree, records=False, binary=None, class_names=None, meta_name=''):
+    """Return getter function(pdo, param_name) for an array (nested metadata
+    for the row, see meta2metatree()) that decodes the array as a dictionary
+    of column_name -> list of values, rather than a list of row dictionaries.
+
+    INTEGER, SMALLINT and FLOAT columns are array.array instances unless
+    they contain NULLs (None), in which case they are lists. Userclass
+    attributes are flattened into dotted column names, e.g. 'address.city'.
+    Arrays nested in rows are decoded as lists of row dictionaries (or
+    Records if records is True). class_names and meta_name (name of the
+    array in class_names) name the Record types, see compile_getters().
+    """
+    columns = _compile_columns(row_tree, records, binary, class_names=class_names, meta_prefix=meta_name + '.')
+    templates = {}  # param_name -> list of attribute name templates, one per column
+    # NOTE compile_getters() only uses this for arrays that are not nested in arrays, so param_name is fixed
+
+    def get_columns(pdo, param_name):
+        column_templates = templates.get(param_name)
+        if column_templates is None:
+            column_templates = [param_name + '[%d].' + column_key.replace('%', '%%') for column_key, getter, typecode in columns]
+            templates[param_name] = column_templates
+        num_rows = pdo_last_row(pdo, param_name)
+        result = {}
+        for (column_key, getter, typecode), template in zip(columns, column_templates):
+            result[column_key] = _decode_column(pdo, getter, template, num_rows, typecode)
+        return result
+    return get_columns
+
+class Backend(object):
+    """OpenROAD client library interface, see get_backend().
+
+    Everything that differs between client libraries is here (or in the
+    value_setters/value_getters tables), the rest of the module only uses
+    the backend through module level functions such as get_rso(),
+    rso_callproc() and get_value_setter().
+    """
+    name = None
+    rso_errors = ()  # errors that may indicate RSO is no longer usable
+    persistent_metadata = True  # if False metadata is never cached on disk
+    value_setters = {}  # type_name -> function(pdo, param_name, param_value)
+    default_value_setter = staticmethod(_unsupported_set)
+    value_getters = {}  # type_name -> function(pdo, param_name)
+    default_value_getter = staticmethod(_unsupported_get)
+    binary_result_getters = {}  # BINARY_BYTEARRAY/BINARY_MEMORYVIEW -> function(pdo, param_name)
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.name)
+
+    def get_rso(self):
+        raise NotImplementedError()
+
+    def get_aso(self):
+        raise NotImplementedError()
+
+    def aso_attach_rso(self, aso, rso):
+        raise NotImplementedError()
+
+    def ParameterData(self, func_sig):
+        raise NotImplementedError()
+
+    def pdo_set_null(self, pdo, param_name):
+        raise NotImplementedError()
+
+    def pdo_last_row(self, pdo, param_name):
+        raise NotImplementedError()
+
+    def rso_connect(self, rso, w4gl_image, appserver_hostname):
+        """Connect without using the Name Server, raises ApplicationNotFound"""
+        raise NotImplementedError()
+
+    def rso_initiate(self, rso, *args, **kwargs):
+        raise NotImplementedError()
+
+    def rso_callproc(self, rso, procedure_name, pdo_by_value, pdo_by_byref):
+        """Raises MethodNotFound if procedure does not exist"""
+        raise NotImplementedError()
+
+    def thread_init(self):
+        pass
+
+    def thread_uninit(self):
+        pass
+
+
+class ComBackend(Backend):
+    """Windows DCOM, requires pywin32"""
+    name = 'com'
+    value_setters = COM_VALUE_SETTERS
+    default_value_setter = staticmethod(_com_set_value)
+    value_getters = COM_VALUE_GETTERS
+    default_value_getter = staticmethod(_com_get_value)
+    binary_result_getters = COM_BINARY_RESULT_GETTERS
+
+    def __init__(self):
+        global pythoncom, win32com, pywintypes
+        import pythoncom
+        import win32com.client
+        import pywintypes
+        self.rso_errors = (pywintypes.com_error,)
+        self.Dispatch = win32com.client.Dispatch
+
+    def get_rso(self):
+        return self.Dispatch('OpenROAD.RemoteServer')
+
+    def get_aso(self):
+        return self.Dispatch('OpenROAD.ASOSession')
+
+    def aso_attach_rso(self, aso, rso):
+        aso.AttachRSO(rso)
+
+    def ParameterData(self, func_sig):
+        """Emulate Java interface to generate pdo parameter defs"""
+        pdo = self.Dispatch('OpenROAD.ParameterData')
+        param_list = func_sig.split(';')
+        #print 'DEBUG', param_list
+        for param_info in param_list:
+            if param_info:
+                param_name, param_type = param_info.split('=')
+                param_name = param_name.strip()
+                param_type = param_type.strip()
+                #print 'DEBUG', (param_name, param_type)
+                pdo.DeclareAttribute(param_name, param_type)
+        return pdo
+
+    def pdo_set_null(self, pdo, param_name):
+        pdo.SetAttribute(param_name, None)
+
+    def pdo_last_row(self, pdo, param_name):
+        return pdo.LastRow(param_name)
+
+    def rso_connect(self, rso, w4gl_image, appserver_hostname):
+        try:
+            rso.connect(w4gl_image, appserver_hostname, '')
+        except pywintypes.com_error as info:
+            error_text = info.excepinfo[2]
+            if isinstance(error_text, basestring) and error_text.startswith("Name Server error.\ni_error_no = -329, v_msg_txt = 'uc_name_server.GetInitiateParams: An Application Known As [") and error_text.endswith("] is not registered with the name server, or is suspended or disabled'"):
+                raise ApplicationNotFound('Application %r not found on server %r' % (w4gl_image, appserver_hostname))
+            else:
+                raise
+
+    def rso_initiate(self, rso, *args, **kwargs):
+        return rso.Initiate(*args, **kwargs)
+
+    def rso_callproc(self, rso, procedure_name, pdo_by_value, pdo_by_byref):
+        try:
+            return rso.CallProc(procedure_name, pdo_by_value, pdo_by_byref)
+        except pywintypes.com_error as info:
+            if info.excepinfo[2] == u'The specified procedure name was not found in the initiated application.':
                 raise MethodNotFound('method %r not found' % procedure_name)
             else:
                 raise
-else:
-    def rso_initiate(rso, *args, **kwargs):
+
+    def thread_init(self):
+        pythoncom.CoInitializeEx(pythoncom.COINIT_MULTITHREADED)
+
+    def thread_uninit(self):
+        pythoncom.CoUninitialize()
+
+
+class JavaBackend(Backend):
+    """OpenROAD Java client (openroad.jar), requires Jython"""
+    name = 'java'
+    value_setters = JAVA_VALUE_SETTERS
+    value_getters = JAVA_VALUE_GETTERS
+    binary_result_getters = JAVA_BINARY_RESULT_GETTERS
+
+    def __init__(self):
+        global java, jarray
+        import java.sql  # for Date datatypes
+        import java.util
+        import jarray
+
+        # Sanity check.
+        # Try and add OpenROAD jar file to CLASSPATH automatically in case classpath
+        # was not setup
+        II_SYSTEM = os.environ.get('II_SYSTEM')
+        if II_SYSTEM is not None:
+            openroad_jar_path = os.path.join(II_SYSTEM, 'ingres', 'orjava', 'openroad.jar')
+        else:
+            # assume/hope jdbc driver is in the current directory
+            openroad_jar_path = os.path.join('openroad.jar')
+        load_jar(openroad_jar_path)
+
+        # NOTE these require openroad.jar to be in the path
+        # and for the OpenROAD environment/path to be set
+        from com.ca.openroad import RemoteServer
+        from com.ca.openroad import ParameterData
+        from com.ca.openroad import ASOSession
+        from com.ca.openroad import COMException
+        self.RemoteServer = RemoteServer
+        self.ParameterData = ParameterData
+        self.ASOSession = ASOSession
+        self.COMException = COMException
+        self.rso_errors = (COMException,)
+
+    def get_rso(self):
+        return self.RemoteServer()
+
+    def get_aso(self):
+        return self.ASOSession()
+
+    def aso_attach_rso(self, aso, rso):
+        aso.attachRSO(rso)
+
+    def pdo_set_null(self, pdo, param_name):
+        pdo.setNull(param_name)
+
+    def pdo_last_row(self, pdo, param_name):
+        return pdo.lastRow(param_name)
+
+    def rso_connect(self, rso, w4gl_image, appserver_hostname):
+        try:
+            rso.connect(w4gl_image, appserver_hostname, '')
+        except self.COMException as info:
+            #except com.ca.openroad.COMException
+            error_text = info.message
+            if isinstance(error_text, basestring) and error_text.startswith("HRESULT=0x8004b100; Name Server error.\ni_error_no = -329, v_msg_txt = 'uc_name_server.GetInitiateParams: An Application Known As [") and error_text.endswith("] is not registered with the name server, or is suspended or disabled'"):
+                raise ApplicationNotFound('Application %r not found on server %r' % (w4gl_image, appserver_hostname))
+            else:
+                raise
+
+    def rso_initiate(self, rso, *args, **kwargs):
         return rso.initiate(*args, **kwargs)
-    def rso_callproc(rso, procedure_name, pdo_by_value, pdo_by_byref):
+
+    def rso_callproc(self, rso, procedure_name, pdo_by_value, pdo_by_byref):
         try:
             return rso.callProc(procedure_name, pdo_by_value, pdo_by_byref)
-        except COMException as info:
+        except self.COMException as info:
             #except com.ca.openroad.COMException
             if info.message == u'HRESULT=0x80041200; The specified procedure name was not found in the initiated application.':
                 raise MethodNotFound('method %r not found' % procedure_name)
@@ -651,6 +1642,385 @@ else:
                 raise
 
 
+class SimulatedError(Exception):
+    """Error from the simulated backend, equivalent of a COM error"""
+
+
+SIMULATED_METHOD_NOT_FOUND = 'The specified procedure name was not found in the initiated application.'
+SIMULATED_APPLICATION_NOT_FOUND = 'An Application Known As [%s] is not registered with the name server, or is suspended or disabled'
+_ROW_INDEX = re.compile(r'\[(\d+)\]')
+
+
+class SimulatedParameterData(object):
+    """Pure Python ParameterData, values are held as Python objects.
+    Attributes must be declared before use, a value of None is NULL."""
+
+    def __init__(self, func_sig=''):
+        self.declared = {}  # (unindexed) attribute name -> type name
+        self.values = {}  # attribute name, indexed for array rows, -> value
+        self.rows = {}  # (indexed) array name -> last row number
+        if func_sig:
+            param_meta = func_sig2meta(func_sig)
+            for param_name in param_meta:
+                self.declare_attribute(param_name, param_meta[param_name])
+
+    def declare_attribute(self, param_name, type_name):
+        self.declared[param_name] = type_name.upper()
+
+    def set_attribute(self, param_name, value):
+        if '[' in param_name:
+            if _ROW_INDEX.sub('', param_name) not in self.declared:
+                raise SimulatedError('attribute %r not declared' % param_name)
+            for match in _ROW_INDEX.finditer(param_name):
+                array_name = param_name[:match.start()]
+                row_number = int(match.group(1))
+                if row_number > self.rows.get(array_name, 0):
+                    self.rows[array_name] = row_number
+        elif param_name not in self.declared:
+            raise SimulatedError('attribute %r not declared' % param_name)
+        if value is None:
+            self.values.pop(param_name, None)
+        else:
+            self.values[param_name] = value
+
+    def get_attribute(self, param_name):
+        return self.values.get(param_name)
+
+    def last_row(self, param_name):
+        return self.rows.get(param_name, 0)
+
+    def clear_rows(self, param_name):
+        """Remove all rows from array param_name"""
+        prefix = param_name + '['
+        for name in [name for name in self.values if name.startswith(prefix)]:
+            del self.values[name]
+        for name in [name for name in self.rows if name == param_name or name.startswith(prefix)]:
+            del self.rows[name]
+
+    def to_tree(self, meta_tree=None, prefix=''):
+        """Return values as nested dictionary, userclasses as dictionaries and arrays as lists"""
+        if meta_tree is None:
+            meta_tree = meta2metatree(self.declared)
+        result = {}
+        for key in meta_tree:
+            if key == ARRAY_INDICATOR:
+                continue
+            type_info = meta_tree[key]
+            param_name = prefix + key
+            if not isinstance(type_info, dict):
+                result[key] = self.values.get(param_name)
+            elif type_info.get(ARRAY_INDICATOR):
+                result[key] = [self.to_tree(type_info, '%s[%d].' % (param_name, i)) for i in range(1, self.last_row(param_name) + 1)]
+            else:
+                result[key] = self.to_tree(type_info, param_name + '.')
+        return result
+
+    def from_tree(self, values, meta_tree=None, prefix=''):
+        """Set values from nested dictionary, reverse of to_tree()"""
+        if meta_tree is None:
+            meta_tree = meta2metatree(self.declared)
+        for key in values:
+            param_name = prefix + key
+            type_info = meta_tree.get(key)
+            if type_info is None:
+                raise SimulatedError('attribute %r not declared' % param_name)
+            value = values[key]
+            if not isinstance(type_info, dict):
+                self.set_attribute(param_name, value)
+            elif type_info.get(ARRAY_INDICATOR):
+                self.clear_rows(param_name)
+                for row_number, row in enumerate(value or []):
+                    self.from_tree(row, type_info, '%s[%d].' % (param_name, row_number + 1))
+                    self.rows[param_name] = row_number + 1
+            elif value is not None:
+                self.from_tree(value, type_info, param_name + '.')
+
+
+class SimulatedApplication(object):
+    """Application (image) served by the simulated backend.
+
+    procedures - dictionary of procedure_name -> function(params), see register_procedure()
+    metadata_xml - returned by GetMetaDataInterface, see get_meta_data()
+    """
+    def __init__(self, name, procedures=None, metadata_xml=None):
+        self.name = name
+        self.procedures = dict(procedures or {})
+        self.metadata_xml = metadata_xml
+
+    def register_procedure(self, procedure_name, func):
+        """func is called with a dictionary of (all) parameter values,
+        userclasses as dictionaries and arrays as lists of dictionaries.
+        It returns a dictionary of (byref) values to return, parameters
+        not in the dictionary are returned unchanged. Raise SimulatedError
+        to simulate a server error."""
+        self.procedures[procedure_name] = func
+
+    def call(self, procedure_name, pdo):
+        func = self.procedures.get(procedure_name)
+        if func is None:
+            if procedure_name == 'GetMetaDataInterface' and self.metadata_xml is not None:
+                pdo.set_attribute('b_so_interface', self.metadata_xml)
+                return 0
+            raise SimulatedError(SIMULATED_METHOD_NOT_FOUND)
+        result = func(pdo.to_tree())
+        if result:
+            pdo.from_tree(result)
+        return 0
+
+
+class SimulatedRemoteServer(object):
+    """Pure Python RemoteServer, connected to a SimulatedApplication"""
+    def __init__(self, backend):
+        self.backend = backend
+        self.application = None
+
+    def connect(self, w4gl_image, appserver_hostname, routing):
+        self.backend._delay()
+        application = self.backend.applications.get(w4gl_image)
+        if application is None:
+            raise SimulatedError(SIMULATED_APPLICATION_NOT_FOUND % w4gl_image)
+        self.application = application
+
+    def initiate(self, w4gl_image_filename, startflags, appserver_hostname, connection_mode, rptype):
+        w4gl_image = w4gl_image_filename
+        if w4gl_image.lower().endswith('.img'):
+            w4gl_image = w4gl_image[:-len('.img')]
+        return self.connect(w4gl_image, appserver_hostname, connection_mode)
+
+    def disconnect(self):
+        self.application = None
+
+    def callproc(self, procedure_name, pdo_by_value, pdo_by_byref):
+        if self.application is None:
+            raise SimulatedError('RemoteServer not connected')
+        self.backend._delay()
+        self.backend.call_count += 1
+        return self.application.call(procedure_name, pdo_by_byref)
+
+
+class SimulatedASOSession(object):
+    def __init__(self):
+        self.rso = None
+
+    def attach_rso(self, rso):
+        self.rso = rso
+
+
+def _simulated_set_value(pdo, param_name, param_value):
+    pdo.set_attribute(param_name, param_value)
+
+
+def _simulated_set_binary(pdo, param_name, param_value):
+    if isinstance(param_value, Binary):
+        param_value = param_value.data
+    if param_value is not None:
+        param_value = memoryview(param_value).tobytes()  # copy, as when marshalled
+    pdo.set_attribute(param_name, param_value)
+
+
+def _simulated_set_date(pdo, param_name, param_value):
+    # OpenROAD always returns a DateTime, never Date only
+    if isinstance(param_value, datetime.date) and not isinstance(param_value, datetime.datetime):
+        param_value = datetime.datetime(param_value.year, param_value.month, param_value.day)
+    pdo.set_attribute(param_name, param_value)
+
+
+def _simulated_get_value(pdo, param_name):
+    return pdo.get_attribute(param_name)
+
+
+def _simulated_get_bytearray(pdo, param_name):
+    result = pdo.get_attribute(param_name)
+    if result is not None:
+        result = bytearray(result)
+    return result
+
+
+def _simulated_get_memoryview(pdo, param_name):
+    result = pdo.get_attribute(param_name)
+    if result is not None:
+        result = _memoryview(result)
+    return result
+
+
+class SimulatedBackend(Backend):
+    """In process, pure Python, simulated AppServer for testing and
+    profiling without OpenROAD. Applications (and their procedures) are
+    registered with register_application().
+
+    latency - seconds added to each connect and call, or a function
+        returning the number of seconds (e.g. for random jitter)
+    """
+    name = 'simulated'
+    persistent_metadata = False
+    rso_errors = (SimulatedError,)
+    value_setters = {
+        'BINARY': _simulated_set_binary,
+        'DATE': _simulated_set_date,
+    }
+    default_value_setter = staticmethod(_simulated_set_value)
+    value_getters = {}
+    default_value_getter = staticmethod(_simulated_get_value)
+    binary_result_getters = {
+        BINARY_BYTEARRAY: _simulated_get_bytearray,
+        BINARY_MEMORYVIEW: _simulated_get_memoryview,
+    }
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.applications = {}
+        self.call_count = 0  # number of procedure calls made, not thread safe
+
+    def register_application(self, w4gl_image, procedures=None, metadata_xml=None):
+        """Register (or replace) application `w4gl_image`, returns SimulatedApplication"""
+        application = SimulatedApplication(w4gl_image, procedures=procedures, metadata_xml=metadata_xml)
+        self.applications[w4gl_image] = application
+        return application
+
+    def _delay(self):
+        latency = self.latency
+        if callable(latency):
+            latency = latency()
+        if latency:
+            time.sleep(latency)
+
+    def get_rso(self):
+        return SimulatedRemoteServer(self)
+
+    def get_aso(self):
+        return SimulatedASOSession()
+
+    def aso_attach_rso(self, aso, rso):
+        aso.attach_rso(rso)
+
+    def ParameterData(self, func_sig):
+        return SimulatedParameterData(func_sig)
+
+    def pdo_set_null(self, pdo, param_name):
+        pdo.set_attribute(param_name, None)
+
+    def pdo_last_row(self, pdo, param_name):
+        return pdo.last_row(param_name)
+
+    def rso_connect(self, rso, w4gl_image, appserver_hostname):
+        try:
+            rso.connect(w4gl_image, appserver_hostname, '')
+        except SimulatedError as info:
+            if str(info) == SIMULATED_APPLICATION_NOT_FOUND % w4gl_image:
+                raise ApplicationNotFound('Application %r not found on server %r' % (w4gl_image, appserver_hostname))
+            raise
+
+    def rso_initiate(self, rso, *args, **kwargs):
+        return rso.initiate(*args, **kwargs)
+
+    def rso_callproc(self, rso, procedure_name, pdo_by_value, pdo_by_byref):
+        try:
+            return rso.callproc(procedure_name, pdo_by_value, pdo_by_byref)
+        except SimulatedError as info:
+            if str(info) == SIMULATED_METHOD_NOT_FOUND:
+                raise MethodNotFound('method %r not found' % procedure_name)
+            raise
+
+
+BACKENDS = {
+    'com': ComBackend,
+    'java': JavaBackend,
+    'simulated': SimulatedBackend,
+}
+
+def _default_backend():
+    """Backend named by environment variable ORSERVER_BACKEND,
+    otherwise the first of COM and Java that can be loaded"""
+    backend_name = os.environ.get('ORSERVER_BACKEND')
+    if backend_name:
+        return BACKENDS[backend_name]()
+    for backend_class in (ComBackend, JavaBackend):
+        try:
+            return backend_class()
+        except ImportError:
+            pass
+    return None
+
+
+_backend = None
+_default_backend_loaded = False
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return current Backend, raises BackendNotAvailable if there is none.
+    The default backend is loaded on first use, not on import."""
+    backend = _backend
+    if backend is None:
+        backend = _load_default_backend()
+    return backend
+
+
+def _load_default_backend():
+    global _backend, _default_backend_loaded
+    _backend_lock.acquire()
+    try:
+        if _backend is None and not _default_backend_loaded:
+            _default_backend_loaded = True  # only try once
+            _backend = _default_backend()
+        backend = _backend
+    finally:
+        _backend_lock.release()
+    if backend is None:
+        raise BackendNotAvailable('No OpenROAD client library found (pywin32 or Jython with openroad.jar), see set_backend()')
+    return backend
+
+
+def set_backend(backend):
+    """Switch backend, `backend` is a Backend instance or name ('com', 'java'
+    or 'simulated'). Returns the backend.
+
+    Compiled call plans, pooled PDOs and shared RSO pools belong to the
+    previous backend, so they are discarded (pools are closed). Plans still
+    held elsewhere (e.g. by SimpleDispatcher) are recompiled on use. RSOs
+    from the previous backend MUST NOT be used after switching.
+    """
+    global _backend
+    if isinstance(backend, basestring):
+        backend = BACKENDS[backend]()
+    _backend_lock.acquire()
+    try:
+        _backend = backend
+    finally:
+        _backend_lock.release()
+    call_plan_cache.clear()
+    parameter_data_pool.clear()
+    _rso_pools_lock.acquire()
+    try:
+        pools = list(_rso_pools.values())
+        _rso_pools.clear()
+    finally:
+        _rso_pools_lock.release()
+    for pool in pools:
+        pool.close()
+    return backend
+
+
+def get_rso():
+    return get_backend().get_rso()
+
+def get_aso():
+    return get_backend().get_aso()
+
+def get_aso_and_attach_rso(rso):
+    aso = get_aso()
+    get_backend().aso_attach_rso(aso, rso)
+    return aso
+
+
+# TODO Should callproc check i_error_no?
+def rso_initiate(rso, *args, **kwargs):
+    return get_backend().rso_initiate(rso, *args, **kwargs)
+
+def rso_callproc(rso, procedure_name, pdo_by_value, pdo_by_byref):
+    return get_backend().rso_callproc(rso, procedure_name, pdo_by_value, pdo_by_byref)
+
+
 # TODO Make Python Class wrappers for rso and pdo (following pep8?)
 
 def or_connect(w4gl_image, appserver_hostname, connection_mode=None, rptype=None, startflags=None):
@@ -770,25 +2140,7 @@ def or_connect(w4gl_image, appserver_hostname, connection_mode=None, rptype=None
     if connection_mode is None:
         # Connect directly to OpenROAD Server without using Name Server
         # NOTE for me this works every other call! :-( clach04
-        if win32com_client_Dispatch:
-            try:
-                rso.connect(w4gl_image, appserver_hostname, '')
-            except pywintypes.com_error as info:
-                error_text = info.excepinfo[2]
-                if isinstance(error_text, basestring) and error_text.startswith("Name Server error.\ni_error_no = -329, v_msg_txt = 'uc_name_server.GetInitiateParams: An Application Known As [") and error_text.endswith("] is not registered with the name server, or is suspended or disabled'"):
-                    raise ApplicationNotFound('Application %r not found on server %r' % (w4gl_image, appserver_hostname))
-                else:
-                    raise
-        else:
-            try:
-                rso.connect(w4gl_image, appserver_hostname, '')
-            except COMException as info:
-                #except com.ca.openroad.COMException
-                error_text = info.message
-                if isinstance(error_text, basestring) and error_text.startswith("HRESULT=0x8004b100; Name Server error.\ni_error_no = -329, v_msg_txt = 'uc_name_server.GetInitiateParams: An Application Known As [") and error_text.endswith("] is not registered with the name server, or is suspended or disabled'"):
-                    raise ApplicationNotFound('Application %r not found on server %r' % (w4gl_image, appserver_hostname))
-                else:
-                    raise
+        get_backend().rso_connect(rso, w4gl_image, appserver_hostname)
     else:
         # Connect to OpenROAD Server using Name Server
         w4gl_image_filename = w4gl_image
@@ -796,114 +2148,2103 @@ def or_connect(w4gl_image, appserver_hostname, connection_mode=None, rptype=None
             # if using http use AKA name (i.e. name) not the filename.
             w4gl_image_filename = w4gl_image_filename + '.img'
         rso_initiate(rso, w4gl_image_filename, startflags, appserver_hostname, connection_mode, rptype)
+    _set_rso_metadata_key(rso, appserver_hostname, w4gl_image)
     return rso
 
-def callproc(rso, procedure_name, func_sig=None, **kwargs):
-    """params:
-    @rso - already connected rso
-    procedure_name - string containing name of procedure
-    func_sig - optional parameter with procedure parameter signature, see OR AppServer Java manuual, example for comtest.helloworld() is 'hellostring=STRING; counter=INTEGER'
-    """
 
-    if func_sig:
-        param_meta = func_sig2meta(func_sig)
+_rso_metadata_keys = {}  # id(rso) -> (weak reference to rso, (appserver_hostname, w4gl_image))
+
+
+def _set_rso_metadata_key(rso, appserver_hostname, w4gl_image):
+    rso_id = id(rso)
+
+    def forget(ref):
+        entry = _rso_metadata_keys.get(rso_id)
+        if entry is not None and entry[0] is ref:
+            _rso_metadata_keys.pop(rso_id, None)
+    try:
+        ref = weakref.ref(rso, forget)
+    except TypeError:
+        return  # can not track, metadata for this rso is not cached
+    _rso_metadata_keys[rso_id] = (ref, (appserver_hostname, w4gl_image))
+
+
+def get_rso_metadata_key(rso):
+    """Return (appserver_hostname, w4gl_image) for an rso connected with
+    or_connect() or an RSOPool, or None if unknown"""
+    if isinstance(rso, BaseRSOPool):
+        return (rso.appserver_hostname, rso.w4gl_image)
+    entry = _rso_metadata_keys.get(id(rso))
+    if entry is not None and entry[0]() is rso:
+        return entry[1]
+    return None
+
+def resolve_call_plan(func_sig, kwargs):
+    """Return CallPlan for func_sig (signature string or CallPlan),
+    if func_sig is not provided guess from values in kwargs"""
+    if isinstance(func_sig, CallPlan):
+        if func_sig.backend is not _backend:
+            # compiled before set_backend(), e.g. held by a MethodProxy
+            return get_call_plan(param_meta=func_sig.param_meta, class_names=func_sig.class_names)
+        return func_sig
+    elif func_sig:
+        return get_call_plan(func_sig)
     else:
-        param_meta = guessmeta_from_values(kwargs)
-        func_sig = meta2func_sig(param_meta)
-    #print 'func_sig', func_sig
+        return get_call_plan(param_meta=guessmeta_from_values(kwargs))
 
-    # use PDO to declare attribute names (parameters) that will be passed
-    pdo = ParameterData(func_sig)
 
-    # use PDO to set values
-    for param_name in kwargs:
-        param_value = kwargs[param_name]
-        pdo_set_value(pdo, param_meta, param_name, param_value)
+class CallTrace(object):
+    """Details of a single call, passed to call hooks, see add_call_hook().
+    Phase durations are in seconds, phases not reached (on error) are 0.0:
 
-    # Call the procedure in the Application Server
-    rso_callproc(rso, procedure_name, None, pdo)
+        plan - signature handling, resolving/guessing the CallPlan
+        declare - PDO declaration (or checkout from parameter_data_pool)
+        set - setting parameter values in the PDO
+        call - rso_callproc(), i.e. round trip to server (and server time)
+        decode - retrieving results from the PDO
 
-    # Call is complete, retrieve data from pdo byref variables
-    result = pdo2dict(pdo, param_meta)
+    attribute_count - number of declared PDO attributes
+    array_rows - dictionary of (top level) array name -> number of rows returned
+    error - exception raised by the call, None on success
+    start - time.time() the call started
+    """
+    __slots__ = ('procedure_name', 'start', 'plan', 'declare', 'set', 'call', 'decode', 'attribute_count', 'array_rows', 'error')
 
-    return result
+    def __init__(self, procedure_name):
+        self.procedure_name = procedure_name
+        self.start = time.time()
+        self.plan = self.declare = self.set = self.call = self.decode = 0.0
+        self.attribute_count = 0
+        self.array_rows = {}
+        self.error = None
 
+    def __repr__(self):
+        return '<CallTrace %s total=%.6f call=%.6f error=%r>' % (self.procedure_name, self.total, self.call, self.error)
 
-def get_meta_data(rso):
-    """Get metadata from server"""
-    func_sig = 'b_osca=USERCLASS; b_osca.i_context_id=INTEGER; b_osca.i_error_type=INTEGER; b_osca.i_error_no=INTEGER; b_so_interface=STRING'
-    # Call the procedure in the Application Server
-    result = callproc(rso, 'GetMetaDataInterface', func_sig=func_sig)
-    xml_metadata = result['b_so_interface']
-
-    # Process meta data
-    app_metadata = {}
-    gscp_special_names = ('b_osca', 'b_so_xml', 'p_arr_UCXML_Include', 'p_so_xmlin')
-    t = ET.fromstring(xml_metadata)
-
-    '''
-    # Debug
-    def prettify(elem):
-        """Return a pretty-printed XML string for the Element."""
-        from xml.dom import minidom
-        rough_string = ET.tostring(elem, 'utf-8')
-        reparsed = minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="\t")
-    print prettify(t)
-    '''
-    for scps in t.findall('scps'):
-        for scp in scps.findall('scp'):
-            #print scp.attrib['name']
-            app_metadata[scp.attrib['name']] = {}
-            app_metadata[scp.attrib['name']]['info'] = scp.attrib
-            app_metadata[scp.attrib['name']]['params'] = {}
-            for param in scp.getchildren():
-                if param.attrib['name'] not in gscp_special_names:
-                    app_metadata[scp.attrib['name']]['params'][param.attrib['name']] = param.attrib
-
-    app_metadata['*classes*'] = app_metadata.get('*classes*', {})
-    for _classes in t.findall('classes'):
-        for _class in _classes.findall('class'):
-            #print _class.attrib['name']
-            class_name = _class.attrib['name']
-            app_metadata['*classes*'][class_name] = {}
-            app_metadata['*classes*'][class_name]['info'] = _class.attrib
-            app_metadata['*classes*'][class_name]['params'] = {}
-            for param in _class.getchildren():
-                app_metadata['*classes*'][class_name]['params'][param.attrib['name']] = param.attrib
-
-    return app_metadata
+    @property
+    def ok(self):
+        return self.error is None
 
-class SimpleDispatcher:
-    def __init__(self, rso, lookup_meta=True):
-        """rso should already be connected
-        if lookup_meta is False then no attempt to lookup meta data is made"""
-        self.__rso = rso
-        self.__app_metadata = None
-        if lookup_meta:
-            self.__app_metadata = get_meta_data(rso)
-            #pprint(self.__app_metadata)
+    @property
+    def client(self):
+        """Time spent in client side code"""
+        return self.plan + self.declare + self.set + self.decode
 
-    def _raw_callproc(self, method_name, func_sig=None, *args, **kwargs):
-        return callproc(self.__rso, method_name, func_sig=func_sig, *args, **kwargs)
+    @property
+    def total(self):
+        return self.client + self.call
 
-    def __getattr__(self, key):
-        if self.__dict__.has_key(key):
-            return self.__dict__[key]
-        else:
-            # Assume this is a method lookup
 
-            def gen_function(method_name):
-                # Curried function, on method name
-                def proxy_function(*args, **kwargs):
-                    #print (method_name, args, kwargs)  # DEBUG
-                    # FIXME inefficient (although unclear on overhead/impact cost), always lookup and convert metadata
-                    func_sig = None
-                    if self.__app_metadata:
-                        param_meta = scp_metadata_to_meta(self.__app_metadata, method_name)
-                        func_sig = meta2func_sig(param_meta)
-                    #print 'func_sig=', func_sig
-                    return callproc(self.__rso, method_name, func_sig=func_sig, *args, **kwargs)
-                return proxy_function
-
-            return gen_function(key)
+_call_hooks = ()  # replaced (never modified) so callers need no lock
+_call_hooks_lock = threading.Lock()
+
+
+def add_call_hook(hook):
+    """Register function hook(trace) to be called, with a CallTrace, after
+    each callproc() (and each call in callproc_batch()) completes or fails.
+    Hooks are called on the calling thread, exceptions raised by hooks
+    are ignored. Calls are not traced when no hooks are registered."""
+    global _call_hooks
+    _call_hooks_lock.acquire()
+    try:
+        _call_hooks = _call_hooks + (hook,)
+    finally:
+        _call_hooks_lock.release()
+
+
+def remove_call_hook(hook):
+    """Unregister hook added with add_call_hook()"""
+    global _call_hooks
+    _call_hooks_lock.acquire()
+    try:
+        hooks = list(_call_hooks)
+        hooks.remove(hook)
+        _call_hooks = tuple(hooks)
+    finally:
+        _call_hooks_lock.release()
+
+
+def _run_call_hooks(trace):
+    for hook in _call_hooks:
+        try:
+            hook(trace)
+        except Exception:
+            pass  # tracing must not break calls
+
+
+def _array_rows(pdo, plan):
+    meta_tree = plan.meta_tree
+    return dict((name, pdo_last_row(pdo, name)) for name in meta_tree if isinstance(meta_tree[name], dict) and meta_tree[name].get(ARRAY_INDICATOR))
+
+
+class CallTracer(object):
+    """Context manager that collects a CallTrace for every call made (by
+    any thread) whilst active, e.g.:
+
+        with CallTracer() as tracer:
+            server.helloworld(hellostring='hello', counter=1)
+        print(tracer.summary())
+
+    max_traces - if set only the most recent max_traces are kept
+    """
+    def __init__(self, max_traces=None):
+        self.traces = deque(maxlen=max_traces)
+
+    def __call__(self, trace):
+        self.traces.append(trace)
+
+    def __enter__(self):
+        add_call_hook(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        remove_call_hook(self)
+        return False
+
+    def summary(self):
+        """Return dictionary of procedure_name -> dictionary of number of
+        calls, errors and total seconds for each phase"""
+        result = {}
+        for trace in list(self.traces):
+            totals = result.get(trace.procedure_name)
+            if totals is None:
+                totals = result[trace.procedure_name] = {'calls': 0, 'errors': 0, 'plan': 0.0, 'declare': 0.0, 'set': 0.0, 'call': 0.0, 'decode': 0.0}
+            totals['calls'] += 1
+            if trace.error is not None:
+                totals['errors'] += 1
+            for phase in ('plan', 'declare', 'set', 'call', 'decode'):
+                totals[phase] += getattr(trace, phase)
+        return result
+
+
+def _set_trace_phases(trace, start, *timestamps):
+    # on error timestamps after the phase that failed are None
+    previous = start
+    for phase, timestamp in zip(('plan', 'declare', 'set', 'call', 'decode'), timestamps):
+        if timestamp is None:
+            setattr(trace, phase, timestamps[-1] - previous)  # failed in this phase
+            break
+        setattr(trace, phase, timestamp - previous)
+        previous = timestamp
+
+
+def _callproc_timed(rso, procedure_name, func_sig, columnar, records, binary, kwargs, pdos):
+    """Make a single call, used by callproc() and callproc_batch(). The PDO
+    is obtained from pdos.checkout(plan) and, if the call succeeds, returned
+    with pdos.checkin(plan, pdo). Runs call hooks when registered.
+    Returns (result, CallTiming)"""
+    trace = None
+    if _call_hooks:
+        trace = CallTrace(procedure_name)
+    start = _clock()
+    planned = declared = prepared = called = None
+    try:
+        plan = resolve_call_plan(func_sig, kwargs)
+        getters = plan.result_getters(columnar, records, binary)
+        if trace is not None:
+            trace.attribute_count = len(plan.param_meta)
+        planned = _clock()
+
+        # use (pooled) PDO to declare attribute names (parameters) that will be passed
+        pdo = pdos.checkout(plan)
+        declared = _clock()
+
+        # use PDO to set values
+        setters = plan.setters
+        for param_name in kwargs:
+            setters[param_name](pdo, param_name, kwargs[param_name])
+        prepared = _clock()
+
+        # Call the procedure in the Application Server
+        rso_callproc(rso, procedure_name, None, pdo)
+        called = _clock()
+
+        # Call is complete, retrieve data from pdo byref variables
+        result = pdo_decode(pdo, getters)
+        decoded = _clock()
+        if trace is not None:
+            trace.array_rows = _array_rows(pdo, plan)
+        pdos.checkin(plan, pdo)
+    except Exception as info:
+        if trace is not None:
+            trace.error = info
+            _set_trace_phases(trace, start, planned, declared, prepared, called, _clock())
+            _run_call_hooks(trace)
+        raise
+    if trace is not None:
+        _set_trace_phases(trace, start, planned, declared, prepared, called, decoded)
+        _run_call_hooks(trace)
+    return result, CallTiming(prepared - start, called - prepared, decoded - called)
+
+
+def callproc(rso, procedure_name, func_sig=None, columnar=False, records=False, binary=None, result_cache=None, single_flight=None, hedge=None, **kwargs):
+    """params:
+    @rso - already connected rso
+    procedure_name - string containing name of procedure
+    func_sig - optional parameter with procedure parameter signature, see OR AppServer Java manuual, example for comtest.helloworld() is 'hellostring=STRING; counter=INTEGER'
+               can also be a CallPlan, see get_call_plan()
+    columnar - if True arrays (UCARRAY) in the result are dictionaries of
+               column lists rather than lists of row dictionaries,
+               see compile_columnar_getter()
+    records - if True userclasses (and array rows) in the result are
+              Record instances rather than dictionaries, see get_record_class()
+    binary - type for BINARY values in the result, None (default, bytes),
+             BINARY_BYTEARRAY or BINARY_MEMORYVIEW
+    result_cache - ResultCache to use, results are only cached for
+             procedures registered with the cache
+    single_flight - SingleFlight to use, to coalesce identical concurrent calls
+    hedge - HedgePolicy to use, for hedged calls (rso must be an RSOPool)
+
+    @rso can also be an RSOPool, a connection is checked out for the duration of the call
+
+    See add_call_hook() for timing/tracing calls.
+    """
+    if result_cache is not None:
+        return result_cache.callproc(rso, procedure_name, func_sig=func_sig, columnar=columnar, records=records, binary=binary, single_flight=single_flight, hedge=hedge, **kwargs)
+    if single_flight is not None:
+        return single_flight.callproc(rso, procedure_name, func_sig=func_sig, columnar=columnar, records=records, binary=binary, hedge=hedge, **kwargs)
+    if hedge is not None:
+        return hedge.callproc(rso, procedure_name, func_sig=func_sig, columnar=columnar, records=records, binary=binary, **kwargs)
+    if isinstance(rso, BaseRSOPool):
+        with rso.connection() as conn:
+            return callproc(conn, procedure_name, func_sig=func_sig, columnar=columnar, records=records, binary=binary, **kwargs)
+    return _callproc_timed(rso, procedure_name, func_sig, columnar, records, binary, kwargs, parameter_data_pool)[0]
+
+
+class CallTiming(namedtuple('CallTiming', 'prepare call decode')):
+    """Timings, in seconds, for a single call:
+        prepare - client side, call plan, PDO and setting values
+        call - rso_callproc(), i.e. round trip to server (and server time)
+        decode - client side, retrieving results from PDO
+    """
+    __slots__ = ()
+
+    @property
+    def client(self):
+        return self.prepare + self.decode
+
+    @property
+    def total(self):
+        return self.prepare + self.call + self.decode
+
+
+class _BatchPDOs(object):
+    """PDOs for callproc_batch(), one per plan reused for each call in the
+    batch. A PDO is only reused if its call succeeded and it was reset"""
+    def __init__(self):
+        self._pdos = {}  # func_sig -> (plan, PDO) ready for next call
+
+    def checkout(self, plan):
+        plan_pdo = self._pdos.pop(plan.func_sig, None)
+        if plan_pdo is None:
+            return parameter_data_pool.checkout(plan)
+        return plan_pdo[1]
+
+    def checkin(self, plan, pdo):
+        if parameter_data_pool.reset(plan, pdo):
+            self._pdos[plan.func_sig] = (plan, pdo)
+
+    def close(self):
+        """Return PDOs to parameter_data_pool"""
+        for plan, pdo in self._pdos.values():
+            parameter_data_pool.checkin(plan, pdo, reset=False)
+        self._pdos = {}
+
+
+def callproc_batch(rso, procedure_name, list_of_kwargs, func_sig=None, columnar=False, records=False, binary=None, return_exceptions=False):
+    """Call procedure_name once for each dictionary of parameters in
+    list_of_kwargs, back to back on a single connection.
+
+    The call plan (if func_sig given) and the declared PDO are set up once
+    and reused for every call. If func_sig is not given a plan is guessed
+    for each set of values, with one PDO per distinct plan.
+
+    Returns tuple of (results, timings) lists, timings are CallTiming.
+    Stops on the first error, unless return_exceptions is True in which
+    case the exception is returned in place of the result (and the timing
+    is None) for failed calls. For columnar, records and binary see callproc().
+
+    @rso can also be an RSOPool, a single connection is used for the batch
+    """
+    if isinstance(rso, BaseRSOPool):
+        with rso.connection() as conn:
+            return callproc_batch(conn, procedure_name, list_of_kwargs, func_sig=func_sig, columnar=columnar, records=records, binary=binary, return_exceptions=return_exceptions)
+
+    if func_sig:
+        func_sig = resolve_call_plan(func_sig, None)  # once for the batch
+    pdos = _BatchPDOs()
+    results = []
+    timings = []
+    try:
+        for kwargs in list_of_kwargs:
+            try:
+                result, timing = _callproc_timed(rso, procedure_name, func_sig, columnar, records, binary, kwargs, pdos)
+            except Exception as info:
+                if not return_exceptions:
+                    raise
+                result, timing = info, None
+            results.append(result)
+            timings.append(timing)
+    finally:
+        pdos.close()
+    return results, timings
+
+
+def rso_disconnect(rso):
+    """Disconnect RSO, ignoring errors (e.g. already disconnected)"""
+    try:
+        rso.disconnect()
+    except Exception:
+        pass
+
+
+try:
+    _clock = time.monotonic
+except AttributeError:
+    # Python 2.x
+    _clock = time.time
+
+
+class PooledConnection(object):
+    """Context manager for a connection checked out of a pool, see BaseRSOPool.connection()"""
+    def __init__(self, pool, timeout=None):
+        self.pool = pool
+        self.timeout = timeout
+        self.rso = None
+
+    def __enter__(self):
+        self.rso = self.pool.checkout(timeout=self.timeout)
+        return self.rso
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        rso, self.rso = self.rso, None
+        # AppServerError (e.g. MethodNotFound) and client side errors leave the RSO usable
+        broken = exc_type is not None and issubclass(exc_type, get_backend().rso_errors)
+        self.pool.checkin(rso, broken=broken)
+        return False
+
+
+class BaseRSOPool(object):
+    """Base class for pools of connected RSOs, callproc() (and everything
+    else accepting an RSOPool) accepts any pool. Subclasses implement
+    checkout(), checkin(), close() and max_size."""
+    max_size = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def checkout(self, timeout=None):
+        raise NotImplementedError()
+
+    def checkin(self, rso, broken=False):
+        raise NotImplementedError()
+
+    def connection(self, timeout=None):
+        """Context manager, checkout connection on entry and checkin on exit.
+        Connections are discarded if a backend (COM) error is raised."""
+        return PooledConnection(self, timeout=timeout)
+
+    def close(self):
+        raise NotImplementedError()
+
+
+class RSOPool(BaseRSOPool):
+    """Thread safe pool of connected RemoteServer objects (RSOs) for a single
+    (w4gl_image, appserver_hostname, connection_mode, rptype), see or_connect()
+    for connection parameters. Use get_rso_pool() to share one pool per process.
+
+    Example:
+        pool = get_rso_pool('comtest', 'localhost', max_size=4)
+        with pool.connection() as rso:
+            result = callproc(rso, 'helloworld', hellostring='hello')
+        # or let callproc() (and SimpleDispatcher) checkout/checkin
+        result = callproc(pool, 'helloworld', hellostring='hello')
+
+    min_size - number of connections to open up front and keep open when reaping idle connections
+    max_size - maximum number of connections (in use and idle)
+    timeout - default number of seconds checkout() waits for a free connection, None means wait forever
+    max_idle_time - idle connections older than this (seconds) are closed, None means never.
+        Idle connections are reaped on checkout() and checkin(), if the pool
+        may go unused for a long time call reap() periodically (e.g. from a
+        timer) so that they are closed
+    health_check - optional function(rso) returning True if the connection is usable,
+        called before handing out an idle connection that has not been used
+        for health_check_interval seconds
+    connect - function used to create connections, defaults to or_connect()
+
+    NOTE under Windows connections are shared between threads, the COM
+    apartment model needs to permit this, e.g. set sys.coinit_flags = 0
+    (COINIT_MULTITHREADED) before pythoncom is imported.
+    """
+    def __init__(self, w4gl_image, appserver_hostname, connection_mode=None, rptype=None, startflags=None,
+                 min_size=0, max_size=8, timeout=30, max_idle_time=300,
+                 health_check=None, health_check_interval=0, connect_retries=1, connect=None):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError('invalid pool size min_size=%r max_size=%r' % (min_size, max_size))
+        self.w4gl_image = w4gl_image
+        self.appserver_hostname = appserver_hostname
+        self.connection_mode = connection_mode
+        self.rptype = rptype
+        self.startflags = startflags
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle_time = max_idle_time
+        self.health_check = health_check
+        self.health_check_interval = health_check_interval
+        self.connect_retries = connect_retries
+        self._connect_func = connect or or_connect
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []  # list of (rso, last_used), most recently used at the end
+        self._size = 0  # connections in use plus idle
+        self._closed = False
+        self.fill()
+
+    def __repr__(self):
+        return '<RSOPool %r on %r size=%d idle=%d>' % (self.w4gl_image, self.appserver_hostname, self._size, len(self._idle))
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    @property
+    def in_use(self):
+        return self._size - len(self._idle)
+
+    def _connect(self):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return self._connect_func(self.w4gl_image, self.appserver_hostname, connection_mode=self.connection_mode, rptype=self.rptype, startflags=self.startflags)
+            except ApplicationNotFound:
+                raise
+            except Exception:
+                # direct connect() is known to be unreliable, retry
+                if attempt > self.connect_retries:
+                    raise
+
+    def fill(self):
+        """Open connections until there are at least min_size"""
+        while True:
+            self._cond.acquire()
+            try:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            finally:
+                self._cond.release()
+            try:
+                rso = self._connect()
+            except:
+                self._discard(None)
+                raise
+            self.checkin(rso)
+
+    def _discard(self, rso):
+        if rso is not None:
+            rso_disconnect(rso)
+        self._cond.acquire()
+        try:
+            self._size -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def checkout(self, timeout=None):
+        """Return a connected RSO for exclusive use, MUST be returned with checkin().
+        Waits up to `timeout` seconds (default is pool timeout) for
+        a connection to become free, raising PoolTimeout on expiry.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None
+        if timeout is not None:
+            deadline = _clock() + timeout
+        self.reap()
+        while True:
+            rso = None
+            last_used = None
+            self._cond.acquire()
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolClosed('pool %r is closed' % self)
+                    if self._idle:
+                        rso, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    if deadline is None:
+                        self._cond.wait()
+                    else:
+                        remaining = deadline - _clock()
+                        if remaining <= 0:
+                            raise PoolTimeout('timed out waiting for connection from %r' % self)
+                        self._cond.wait(remaining)
+            finally:
+                self._cond.release()
+
+            if rso is None:
+                try:
+                    return self._connect()
+                except:
+                    self._discard(None)
+                    raise
+            if self.health_check is not None and _clock() - last_used >= self.health_check_interval:
+                try:
+                    healthy = self.health_check(rso)
+                except Exception:
+                    healthy = False
+                if not healthy:
+                    self._discard(rso)
+                    continue  # try another
+            return rso
+
+    def checkin(self, rso, broken=False):
+        """Return RSO obtained from checkout() to the pool.
+        If `broken` is True the connection is closed rather than reused."""
+        if broken:
+            self._discard(rso)
+            return
+        self._cond.acquire()
+        try:
+            if not self._closed:
+                self._idle.append((rso, _clock()))
+                self._cond.notify()
+                rso = None
+        finally:
+            self._cond.release()
+        if rso is not None:
+            self._discard(rso)  # pool closed whilst in use
+        self.reap()
+
+    def reap(self):
+        """Close idle connections unused for more than max_idle_time seconds,
+        keeping at least min_size connections. Returns number closed"""
+        if self.max_idle_time is None:
+            return 0
+        expired = []
+        cutoff = _clock() - self.max_idle_time
+        self._cond.acquire()
+        try:
+            # oldest are at the start of the list
+            while self._idle and self._idle[0][1] < cutoff and self._size - len(expired) > self.min_size:
+                expired.append(self._idle.pop(0)[0])
+        finally:
+            self._cond.release()
+        for rso in expired:
+            self._discard(rso)
+        return len(expired)
+
+    def close(self):
+        """Close all idle connections, in use connections are closed when checked in"""
+        self._cond.acquire()
+        try:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+        for rso, last_used in idle:
+            self._discard(rso)
+
+
+_rso_pools = {}
+_rso_pools_lock = threading.Lock()
+
+
+def get_rso_pool(w4gl_image, appserver_hostname, connection_mode=None, rptype=None, **kwargs):
+    """Return shared RSOPool for (w4gl_image, appserver_hostname, connection_mode, rptype),
+    creating it (with RSOPool keyword arguments `kwargs`) on first use"""
+    key = (w4gl_image, appserver_hostname, connection_mode, rptype or 0)
+    _rso_pools_lock.acquire()
+    try:
+        pool = _rso_pools.get(key)
+        if pool is None or pool._closed:
+            pool = RSOPool(w4gl_image, appserver_hostname, connection_mode=connection_mode, rptype=rptype, **kwargs)
+            _rso_pools[key] = pool
+        return pool
+    finally:
+        _rso_pools_lock.release()
+
+
+BALANCE_LEAST_OUTSTANDING = 'least_outstanding'  # fewest calls in progress (per unit of weight)
+BALANCE_EWMA = 'ewma'  # lowest moving average latency, scaled by calls in progress
+
+
+class HostState(object):
+    """Per host state of a MultiHostPool, see MultiHostPool.stats()"""
+    __slots__ = ('appserver_hostname', 'weight', 'pool', 'in_flight', 'ewma', 'failures', 'ejected_at', 'ejected_until', 'probing', 'calls', 'errors')
+
+    def __init__(self, appserver_hostname, weight, pool):
+        self.appserver_hostname = appserver_hostname
+        self.weight = weight
+        self.pool = pool
+        self.in_flight = 0
+        self.ewma = None  # seconds, None until first call completes
+        self.failures = 0  # consecutive
+        self.ejected_at = None  # _clock() time of latest ejection
+        self.ejected_until = None  # _clock() time, None if not ejected
+        self.probing = False
+        self.calls = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return '<HostState %r in_flight=%d ewma=%r ejected=%r>' % (self.appserver_hostname, self.in_flight, self.ewma, self.ejected_until is not None)
+
+
+class MultiHostPool(BaseRSOPool):
+    """Load balanced connections to several AppServer hosts serving the
+    same application, accepted anywhere an RSOPool is, e.g.:
+
+        pool = MultiHostPool('comtest', ['host1', ('host2', 2)], max_size=4)
+        server = SimpleDispatcher(pool)
+
+    hosts - list of appserver_hostname or (appserver_hostname, weight),
+        default weight is 1
+    strategy - BALANCE_LEAST_OUTSTANDING or BALANCE_EWMA
+    eject_after - number of consecutive failures (connect or backend
+        errors) after which a host is ejected (no longer used)
+    eject_time - seconds before an ejected host is probed, a single call
+        is sent to it and the host is put back in use if it succeeds
+    ewma_alpha - weight of latest latency in moving average
+    connection_mode, rptype, startflags and other keyword arguments
+        (e.g. max_size, per host) are passed on to the RSOPool for each host
+
+    If all hosts are ejected, the host due to be probed first is used.
+    """
+    def __init__(self, w4gl_image, hosts, connection_mode=None, rptype=None, strategy=BALANCE_LEAST_OUTSTANDING,
+                 eject_after=3, eject_time=30, ewma_alpha=0.3, **kwargs):
+        if strategy not in (BALANCE_LEAST_OUTSTANDING, BALANCE_EWMA):
+            raise ValueError('invalid strategy %r' % (strategy,))
+        if not hosts:
+            raise ValueError('no hosts')
+        self.w4gl_image = w4gl_image
+        self.connection_mode = connection_mode
+        self.rptype = rptype
+        self.strategy = strategy
+        self.eject_after = eject_after
+        self.eject_time = eject_time
+        self.ewma_alpha = ewma_alpha
+        self.hosts = []
+        for host in hosts:
+            if isinstance(host, basestring):
+                host = (host, 1)
+            appserver_hostname, weight = host
+            if weight <= 0:
+                raise ValueError('invalid weight %r for %r' % (weight, appserver_hostname))
+            pool = RSOPool(w4gl_image, appserver_hostname, connection_mode=connection_mode, rptype=rptype, **kwargs)
+            self.hosts.append(HostState(appserver_hostname, weight, pool))
+        # for metadata cache key, hosts are assumed to serve the same application
+        self.appserver_hostname = ','.join(sorted(host.appserver_hostname for host in self.hosts))
+        self._lock = threading.Lock()
+        self._checked_out = {}  # id(rso) -> (rso, HostState, checkout time, probe)
+
+    def __repr__(self):
+        return '<MultiHostPool %r on %r in_flight=%r>' % (self.w4gl_image, [host.appserver_hostname for host in self.hosts], self.in_flight())
+
+    @property
+    def max_size(self):
+        return sum(host.pool.max_size for host in self.hosts)
+
+    def in_flight(self):
+        """Return dictionary of appserver_hostname -> number of connections in use"""
+        return dict((host.appserver_hostname, host.in_flight) for host in self.hosts)
+
+    def stats(self):
+        """Return dictionary of appserver_hostname -> dictionary of host state"""
+        result = {}
+        for host in self.hosts:
+            result[host.appserver_hostname] = {
+                'weight': host.weight,
+                'in_flight': host.in_flight,
+                'ewma': host.ewma,
+                'failures': host.failures,
+                'ejected': host.ejected_until is not None,
+                'calls': host.calls,
+                'errors': host.errors,
+            }
+        return result
+
+    def _score(self, host):
+        if self.strategy == BALANCE_EWMA:
+            return (host.ewma or 0.0) * (host.in_flight + 1) / host.weight
+        return float(host.in_flight) / host.weight
+
+    def _choose(self, exclude):
+        """Pick host, marks it in flight. Returns (host, probe), (None, False)
+        if there are no hosts left. NOTE lock must be held"""
+        now = _clock()
+        candidates = []
+        for host in self.hosts:
+            if host in exclude:
+                continue
+            if host.ejected_until is not None:
+                if now >= host.ejected_until and not host.probing:
+                    host.probing = True  # probe, see _record()
+                    host.in_flight += 1
+                    return host, True
+                continue
+            candidates.append(host)
+        if not candidates:
+            ejected = [host for host in self.hosts if host not in exclude]
+            if not ejected:
+                return None, False
+            ejected.sort(key=lambda host: host.ejected_until)
+            candidates = ejected[:1]
+        best_score = min(self._score(host) for host in candidates)
+        best = [host for host in candidates if self._score(host) == best_score]
+        # weighted random choice between equally good hosts
+        choice = random.uniform(0, sum(host.weight for host in best))
+        for host in best:
+            choice -= host.weight
+            if choice <= 0:
+                break
+        host.in_flight += 1
+        return host, False
+
+    def _record(self, host, ok, duration=None, start=None, probe=False):
+        """Update host state after a call (or connect) started at `start`.
+        Only a probe, or a call started after the host was ejected, puts an
+        ejected host back in use. NOTE lock must be held"""
+        host.in_flight -= 1
+        host.calls += 1
+        if ok:
+            host.failures = 0
+            if host.ejected_until is not None and (probe or (start is not None and start >= host.ejected_at)):
+                host.ejected_until = None
+            if duration is not None:
+                if host.ewma is None:
+                    host.ewma = duration
+                else:
+                    host.ewma = self.ewma_alpha * duration + (1.0 - self.ewma_alpha) * host.ewma
+        else:
+            host.errors += 1
+            host.failures += 1
+            if probe or host.failures >= self.eject_after:
+                host.ejected_at = _clock()
+                host.ejected_until = host.ejected_at + self.eject_time
+        if probe:
+            host.probing = False
+
+    def checkout(self, timeout=None):
+        """Return a connected RSO from the best host, MUST be returned with checkin().
+        If connecting to a host fails, or it has no free connection within
+        `timeout` (PoolTimeout), the other hosts are tried. The error from
+        the last host tried is raised if none succeed."""
+        tried = []
+        error = None
+        while True:
+            self._lock.acquire()
+            try:
+                host, probe = self._choose(tried)
+            finally:
+                self._lock.release()
+            if host is None:
+                raise error
+            tried.append(host)
+            try:
+                rso = host.pool.checkout(timeout=timeout)
+            except PoolTimeout as info:
+                # saturated, not a host failure
+                error = info
+                self._lock.acquire()
+                try:
+                    host.in_flight -= 1
+                    if probe:
+                        host.probing = False
+                finally:
+                    self._lock.release()
+                continue
+            except PoolClosed:
+                self._lock.acquire()
+                try:
+                    host.in_flight -= 1
+                    if probe:
+                        host.probing = False
+                finally:
+                    self._lock.release()
+                raise
+            except Exception as info:
+                error = info
+                self._lock.acquire()
+                try:
+                    self._record(host, False, probe=probe)
+                finally:
+                    self._lock.release()
+                continue
+            self._lock.acquire()
+            try:
+                self._checked_out[id(rso)] = (rso, host, _clock(), probe)
+            finally:
+                self._lock.release()
+            return rso
+
+    def checkin(self, rso, broken=False):
+        """Return RSO obtained from checkout(), `broken` (backend error) counts as a host failure"""
+        self._lock.acquire()
+        try:
+            rso, host, start, probe = self._checked_out.pop(id(rso))
+            self._record(host, not broken, _clock() - start, start, probe)
+        finally:
+            self._lock.release()
+        host.pool.checkin(rso, broken=broken)
+
+    def close(self):
+        for host in self.hosts:
+            host.pool.close()
+
+
+def thread_init():
+    """Per thread initialization required by backend, call at start of a
+    thread that uses RSOs (threads started by this module already do this)"""
+    get_backend().thread_init()
+
+
+def thread_uninit():
+    """Reverse of thread_init(), call before thread exits"""
+    get_backend().thread_uninit()
+
+
+class CallResult(object):
+    """Outcome of a single call, as returned by callproc_imap().
+    Exactly one of result and error is set, get() returns result or
+    raises error"""
+    __slots__ = ('index', 'kwargs', 'result', 'error')
+
+    def __init__(self, index, kwargs, result=None, error=None):
+        self.index = index  # position in input
+        self.kwargs = kwargs
+        self.result = result
+        self.error = error
+
+    def __repr__(self):
+        return '<CallResult %d %r>' % (self.index, self.error or self.result)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def get(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def callproc_imap(pool, procedure_name, iterable_of_kwargs, max_in_flight=None, ordered=True, func_sig=None, binary=None):
+    """Generator, call procedure_name once for each dictionary of parameters
+    in iterable_of_kwargs. Calls are made concurrently (on a thread pool)
+    using connections from `pool` (RSOPool), with at most `max_in_flight`
+    calls outstanding (default is pool max_size).
+
+    Yields a CallResult per call, either in input order (ordered=True) or
+    as they complete. Errors are returned in the CallResult, they do not
+    stop the other calls.
+
+    iterable_of_kwargs is consumed lazily, so can be a generator, the
+    dictionaries are not modified. For binary see callproc().
+
+    Example:
+        for call_result in callproc_imap(pool, 'helloworld', ({'counter': x} for x in range(1000))):
+            print call_result.get()
+    """
+    if max_in_flight is None:
+        max_in_flight = pool.max_size
+    if max_in_flight < 1:
+        raise ValueError('max_in_flight must be at least 1, got %r' % max_in_flight)
+    tasks = queue.Queue()
+    results = queue.Queue()
+
+    def worker():
+        try:
+            thread_init()
+            init_error = None
+        except Exception as info:
+            init_error = info  # reported for each call made by this worker
+        try:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    return
+                index, kwargs = task
+                if init_error is not None:
+                    call_result = CallResult(index, kwargs, error=init_error)
+                else:
+                    try:
+                        call_result = CallResult(index, kwargs, result=callproc(pool, procedure_name, func_sig=func_sig, binary=binary, **kwargs))
+                    except Exception as info:
+                        call_result = CallResult(index, kwargs, error=info)
+                results.put(call_result)
+        finally:
+            if init_error is None:
+                thread_uninit()
+
+    threads = []
+    for i in range(max_in_flight):
+        t = threading.Thread(target=worker, name='callproc_imap-%d' % i)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    try:
+        iterator = iter(iterable_of_kwargs)
+        exhausted = False
+        in_flight = 0  # submitted but not yet yielded
+        next_index = 0
+        next_to_yield = 0
+        completed = {}  # out of order results waiting to be yielded (ordered only)
+        while True:
+            while not exhausted and in_flight < max_in_flight:
+                try:
+                    kwargs = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                tasks.put((next_index, kwargs))
+                next_index += 1
+                in_flight += 1
+            if in_flight == 0:
+                break
+            call_result = results.get()
+            if ordered:
+                completed[call_result.index] = call_result
+                while next_to_yield in completed:
+                    in_flight -= 1
+                    yield completed.pop(next_to_yield)
+                    next_to_yield += 1
+            else:
+                in_flight -= 1
+                yield call_result
+    finally:
+        # stop workers, any outstanding calls are completed (and discarded)
+        for t in threads:
+            tasks.put(None)
+
+
+def normalize_value(value):
+    """Return hashable, stable, representation of a parameter value for
+    use in cache keys. Values that marshal differently (e.g. 1, 1.0 and
+    Decimal('1')) normalize differently. Binary data is represented by a
+    digest. Raises TypeError for unsupported values."""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return ('dict', tuple(sorted((key, normalize_value(value[key])) for key in value)))
+    elif isinstance(value, (list, tuple)):
+        return ('list', tuple(normalize_value(x) for x in value))
+    elif isinstance(value, Record):
+        return normalize_value(value.to_dict())
+    elif isinstance(value, Binary):
+        return ('binary', hashlib.sha1(value.data).hexdigest())
+    elif isinstance(value, memoryview):
+        return ('binary', hashlib.sha1(value.tobytes()).hexdigest())
+    elif isinstance(value, bytearray) or (bytes is not str and isinstance(value, bytes)):
+        return ('binary', hashlib.sha1(bytes(value)).hexdigest())
+    elif isinstance(value, basestring):
+        return ('str', value)
+    elif isinstance(value, (datetime.date, datetime.time)):
+        # includes datetime, isoformat() keeps microseconds and timezone
+        return (value.__class__.__name__, value.isoformat())
+    elif isinstance(value, decimal.Decimal):
+        return ('decimal', str(value))
+    elif isinstance(value, (bool, int, long, float)):
+        return (value.__class__.__name__, value)
+    raise TypeError('can not normalize %r for cache key' % (value,))
+
+
+def _copy_result(value):
+    """Copy of (decoded) result, mutable containers are copied, immutable
+    values are shared"""
+    if isinstance(value, dict):
+        return dict((key, _copy_result(value[key])) for key in value)
+    elif isinstance(value, list):
+        return [_copy_result(x) for x in value]
+    elif isinstance(value, Record):
+        return value.__class__(*[_copy_result(getattr(value, name)) for name in value._fields])
+    elif isinstance(value, array.array):
+        return array.array(value.typecode, value)
+    elif isinstance(value, bytearray):
+        return bytearray(value)
+    return value
+
+
+def _estimate_size(value):
+    """Approximate memory used by (decoded) result, in bytes"""
+    try:
+        size = sys.getsizeof(value)
+    except (AttributeError, TypeError, NotImplementedError):
+        # Jython
+        size = 64
+    if isinstance(value, dict):
+        for key in value:
+            size += _estimate_size(value[key])
+    elif isinstance(value, list):
+        for x in value:
+            size += _estimate_size(x)
+    elif isinstance(value, Record):
+        for name in value._fields:
+            size += _estimate_size(getattr(value, name))
+    return size
+
+
+def _call_key(rso, procedure_name, func_sig, columnar, records, binary, kwargs):
+    """Key identifying identical calls (to the same application and
+    AppServer), raises TypeError if parameter values can not be normalized"""
+    server = get_rso_metadata_key(rso) or id(rso)
+    signature = func_sig.func_sig if isinstance(func_sig, CallPlan) else func_sig
+    return (server, procedure_name, signature, bool(columnar), bool(records), binary, normalize_value(kwargs))
+
+
+class _Flight(object):
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Coalesce identical concurrent calls, i.e. same procedure and
+    (normalized, see normalize_value()) parameter values, into a single
+    call. Threads that make a call whilst an identical call is in
+    progress wait for it and receive a copy of its result (or its error).
+    Only use for read-only procedures, e.g.:
+
+        single_flight = SingleFlight(['GetAllNameServerData'])
+        server = SimpleDispatcher(pool, single_flight=single_flight)
+
+    procedure_names - procedures to coalesce, None means all procedures
+        called through it
+    """
+    def __init__(self, procedure_names=None):
+        if procedure_names is not None:
+            procedure_names = set(procedure_names)
+        self.procedure_names = procedure_names
+        self._flights = {}  # key -> _Flight, calls in progress
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def __repr__(self):
+        return '<SingleFlight in_flight=%d>' % len(self._flights)
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._flights),
+        }
+
+    def callproc(self, rso, procedure_name, func_sig=None, columnar=False, records=False, binary=None, hedge=None, **kwargs):
+        """callproc(), coalesced with identical calls in progress"""
+        options = {'func_sig': func_sig, 'columnar': columnar, 'records': records, 'binary': binary, 'hedge': hedge}
+        if self.procedure_names is not None and procedure_name not in self.procedure_names:
+            return callproc(rso, procedure_name, **dict(options, **kwargs))
+        try:
+            key = _call_key(rso, procedure_name, func_sig, columnar, records, binary, kwargs)
+        except TypeError:
+            return callproc(rso, procedure_name, **dict(options, **kwargs))
+
+        self._lock.acquire()
+        try:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+        finally:
+            self._lock.release()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return _copy_result(flight.result)
+
+        try:
+            result = flight.result = callproc(rso, procedure_name, **dict(options, **kwargs))
+        except Exception as info:
+            flight.error = info
+            raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._flights[key]  # no more waiters after this
+            finally:
+                self._lock.release()
+            flight.done.set()
+        if flight.waiters:
+            result = _copy_result(result)  # waiters copy the original
+        return result
+
+
+class CachePolicy(object):
+    """Caching settings for a single procedure, see ResultCache.cache_procedure()"""
+    __slots__ = ('ttl', 'stale_ttl', 'tags')
+
+    def __init__(self, ttl, stale_ttl=0, tags=()):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.tags = tuple(tags)
+
+    def __repr__(self):
+        return '<CachePolicy ttl=%r stale_ttl=%r tags=%r>' % (self.ttl, self.stale_ttl, self.tags)
+
+
+class _CacheEntry(object):
+    __slots__ = ('result', 'size', 'expires', 'stale_until', 'tags', 'refreshing')
+
+    def __init__(self, result, size, expires, stale_until, tags):
+        self.result = result
+        self.size = size
+        self.expires = expires
+        self.stale_until = stale_until
+        self.tags = tags
+        self.refreshing = False
+
+
+class ResultCache(object):
+    """Thread safe cache of procedure results, for procedures that are
+    pure lookups. Only procedures registered with cache_procedure() are
+    cached, e.g.:
+
+        cache = ResultCache(maxsize=1000, max_bytes=64 * 1024 * 1024)
+        cache.cache_procedure('GetAllNameServerData', ttl=300, stale_ttl=60, tags=['nameserver'])
+        cache.invalidate_on('SetNameServerData', ['nameserver'])
+        server = SimpleDispatcher(pool, result_cache=cache)
+        # or
+        result = callproc(pool, 'GetAllNameServerData', result_cache=cache)
+
+    Results are keyed on procedure name, call options and (normalized,
+    see normalize_value()) parameter values. Entries are evicted least
+    recently used first when there are more than maxsize entries or the
+    (estimated) size of all results exceeds max_bytes (if set).
+
+    Callers get a copy of the cached result, so it can be modified.
+
+    single_flight - SingleFlight used for cache misses, so that threads
+        missing the same entry at once share a single call. Default (True)
+        is a new SingleFlight, None (or False) disables coalescing.
+    """
+    def __init__(self, maxsize=1024, max_bytes=None, single_flight=True):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        if single_flight is True:
+            single_flight = SingleFlight()
+        self.single_flight = single_flight or None
+        self.policies = {}  # procedure_name -> CachePolicy
+        self.invalidations = {}  # procedure_name -> tags invalidated by calling it
+        self._data = OrderedDict()  # key -> _CacheEntry, least recently used first
+        self._bytes = 0
+        self._generations = {}  # tag -> number of times invalidated
+        self._epoch = 0  # number of times cleared
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self.invalidated = 0
+        self.uncacheable = 0
+
+    def __repr__(self):
+        return '<ResultCache size=%d bytes=%d>' % (len(self._data), self._bytes)
+
+    def __len__(self):
+        return len(self._data)
+
+    def cache_procedure(self, procedure_name, ttl=60, stale_ttl=0, tags=()):
+        """Cache results of procedure_name for ttl seconds.
+
+        stale_ttl - for a further stale_ttl seconds the expired result
+            is returned whilst it is refreshed in the background
+            (stale-while-revalidate). Requires calls to be made with an
+            RSOPool, otherwise expired results are refreshed by the caller.
+        tags - names that can be used to invalidate results, see invalidate_on()
+        """
+        self.policies[procedure_name] = CachePolicy(ttl, stale_ttl, tags)
+
+    def invalidate_on(self, procedure_name, tags):
+        """Invalidate results tagged with any of tags whenever
+        procedure_name (e.g. a write) is called through the cache"""
+        self.invalidations[procedure_name] = tuple(self.invalidations.get(procedure_name, ())) + tuple(tags)
+
+    def invalidate(self, tags):
+        """Remove all results tagged with any of tags"""
+        tags = set(tags)
+        self._lock.acquire()
+        try:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            for key in [key for key, entry in self._data.items() if tags.intersection(entry.tags)]:
+                self._remove(key)
+                self.invalidated += 1
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+            self._bytes = 0
+            self._epoch += 1
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'evictions': self.evictions,
+            'invalidated': self.invalidated,
+            'uncacheable': self.uncacheable,
+            'size': len(self._data),
+            'bytes': self._bytes,
+            'maxsize': self.maxsize,
+            'max_bytes': self.max_bytes,
+        }
+
+    def _remove(self, key):
+        # NOTE lock must be held
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+
+    def _version(self, tags):
+        # NOTE lock must be held
+        return (self._epoch,) + tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def _put(self, key, result, policy, version):
+        size = _estimate_size(result)
+        now = _clock()
+        entry = _CacheEntry(result, size, now + policy.ttl, now + policy.ttl + policy.stale_ttl, policy.tags)
+        self._lock.acquire()
+        try:
+            if self._version(policy.tags) != version:
+                return  # invalidated whilst calling, result may be out of date
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = entry
+            self._bytes += size
+            while self._data and (len(self._data) > self.maxsize or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def _call(self, rso, procedure_name, key, policy, options, kwargs):
+        self._lock.acquire()
+        try:
+            version = self._version(policy.tags)
+        finally:
+            self._lock.release()
+        result = callproc(rso, procedure_name, single_flight=self.single_flight, **dict(options, **kwargs))
+        self._put(key, result, policy, version)
+        return result
+
+    def _refresh(self, rso, procedure_name, key, policy, options, kwargs):
+        thread_init()
+        try:
+            try:
+                self._call(rso, procedure_name, key, policy, options, kwargs)
+            except Exception:
+                pass  # stale result is used until it expires, then callers see the error
+        finally:
+            self._lock.acquire()
+            try:
+                entry = self._data.get(key)
+                if entry is not None:
+                    entry.refreshing = False
+            finally:
+                self._lock.release()
+            thread_uninit()
+
+    def callproc(self, rso, procedure_name, func_sig=None, columnar=False, records=False, binary=None, single_flight=None, hedge=None, **kwargs):
+        """callproc() using the cache, see callproc() for parameters.
+        single_flight is only used for procedures that are not cached."""
+        options = {'func_sig': func_sig, 'columnar': columnar, 'records': records, 'binary': binary, 'hedge': hedge}
+        invalidate_tags = self.invalidations.get(procedure_name)
+        if invalidate_tags:
+            try:
+                return callproc(rso, procedure_name, single_flight=single_flight, **dict(options, **kwargs))
+            finally:
+                self.invalidate(invalidate_tags)
+        policy = self.policies.get(procedure_name)
+        if policy is None:
+            return callproc(rso, procedure_name, single_flight=single_flight, **dict(options, **kwargs))
+        try:
+            key = _call_key(rso, procedure_name, func_sig, columnar, records, binary, kwargs)
+        except TypeError:
+            self.uncacheable += 1
+            return callproc(rso, procedure_name, single_flight=single_flight, **dict(options, **kwargs))
+
+        refresh = False
+        self._lock.acquire()
+        try:
+            entry = self._data.get(key)
+            if entry is not None:
+                now = _clock()
+                if now < entry.expires:
+                    self._data[key] = self._data.pop(key)  # now most recently used
+                    self.hits += 1
+                    result = entry.result
+                elif now < entry.stale_until and isinstance(rso, BaseRSOPool):
+                    self._data[key] = self._data.pop(key)
+                    self.stale_hits += 1
+                    result = entry.result
+                    if not entry.refreshing:
+                        entry.refreshing = refresh = True
+                        self.refreshes += 1
+                else:
+                    self._remove(key)  # expired
+                    entry = None
+            if entry is None:
+                self.misses += 1
+        finally:
+            self._lock.release()
+
+        if entry is None:
+            return _copy_result(self._call(rso, procedure_name, key, policy, options, kwargs))
+        if refresh:
+            thread = threading.Thread(target=self._refresh, args=(rso, procedure_name, key, policy, options, kwargs), name='ResultCache refresh %s' % procedure_name)
+            thread.daemon = True
+            thread.start()
+        return _copy_result(result)
+
+
+def _percentile(sorted_values, percent):
+    """Nearest rank percentile of (sorted, non empty) list"""
+    index = int(round(percent / 100.0 * len(sorted_values) + 0.5)) - 1
+    return sorted_values[max(0, min(index, len(sorted_values) - 1))]
+
+
+class HedgePolicy(object):
+    """Hedged requests for idempotent procedures, to cut tail latency.
+    If a call has not completed after a delay a duplicate call is made on
+    a second pooled connection, the first result wins and the other is
+    discarded when it completes. Only use for procedures that are safe
+    to call twice, e.g.:
+
+        hedge = HedgePolicy(['GetAllNameServerData'])
+        server = SimpleDispatcher(pool, hedge=hedge)
+
+    procedure_names - procedures to hedge
+    delay - seconds to wait before hedging, until min_samples latencies
+        have been observed for a procedure. None means do not hedge until then
+    percentile - once min_samples are available, hedge after this
+        percentile of the most recent `window` observed latencies
+    min_delay - lower bound for the observed percentile delay
+
+    Calls must be made with an RSOPool (others are not hedged), which
+    needs room for the extra connections. Once a delay is known, hedged
+    procedure calls are made on worker threads owned by the policy, these
+    are initialized (thread_init()) once and reused, see close().
+    """
+    def __init__(self, procedure_names, delay=None, percentile=95, min_samples=20, window=1000, min_delay=0.0):
+        self.procedure_names = set(procedure_names)
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay = min_delay
+        self._latencies = {}  # procedure_name -> deque of recent latencies
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0  # number of duplicate calls made
+        self.hedge_wins = 0  # number of times duplicate completed first
+        self._tasks = queue.Queue()  # for worker threads, replaced by close()
+        self._workers = 0
+        self._idle = 0  # workers waiting for (or about to get) a task
+
+    def __repr__(self):
+        return '<HedgePolicy %r>' % (sorted(self.procedure_names),)
+
+    def _count(self, name):
+        self._lock.acquire()
+        try:
+            setattr(self, name, getattr(self, name) + 1)
+        finally:
+            self._lock.release()
+
+    def record(self, procedure_name, seconds):
+        """Record observed latency, for the hedge delay"""
+        self._lock.acquire()
+        try:
+            latencies = self._latencies.get(procedure_name)
+            if latencies is None:
+                latencies = self._latencies[procedure_name] = deque(maxlen=self.window)
+            latencies.append(seconds)
+        finally:
+            self._lock.release()
+
+    def get_delay(self, procedure_name):
+        """Seconds to wait before hedging procedure_name, None means do not hedge"""
+        self._lock.acquire()
+        try:
+            latencies = self._latencies.get(procedure_name)
+            if latencies is None or len(latencies) < self.min_samples:
+                return self.delay
+            latencies = sorted(latencies)
+        finally:
+            self._lock.release()
+        return max(self.min_delay, _percentile(latencies, self.percentile))
+
+    def stats(self):
+        """Counters, hedge_rate is the fraction of calls that were hedged and
+        win_rate the fraction of hedges that completed first"""
+        return {
+            'calls': self.calls,
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'hedge_rate': self.calls and float(self.hedged) / self.calls,
+            'win_rate': self.hedged and float(self.hedge_wins) / self.hedged,
+            'delays': dict((procedure_name, self.get_delay(procedure_name)) for procedure_name in self.procedure_names),
+        }
+
+    def _attempt(self, index, pool, procedure_name, options, kwargs):
+        start = _clock()
+        try:
+            result = callproc(pool, procedure_name, **dict(options, **kwargs))
+        except Exception as info:
+            return CallResult(index, kwargs, error=info)
+        self.record(procedure_name, _clock() - start)
+        return CallResult(index, kwargs, result=result)
+
+    def _worker(self, tasks):
+        try:
+            thread_init()
+            init_error = None
+        except Exception as info:
+            init_error = info  # reported for each call made by this worker
+        try:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    return
+                index, pool, procedure_name, options, kwargs, results = task
+                if init_error is not None:
+                    call_result = CallResult(index, kwargs, error=init_error)
+                else:
+                    call_result = self._attempt(index, pool, procedure_name, options, kwargs)
+                # idle before the result is seen, so the next call reuses this worker
+                self._lock.acquire()
+                try:
+                    closed = tasks is not self._tasks
+                    if not closed:
+                        self._idle += 1
+                finally:
+                    self._lock.release()
+                results.put(call_result)
+                if closed:
+                    return
+        finally:
+            if init_error is None:
+                thread_uninit()
+
+    def _start(self, index, pool, procedure_name, options, kwargs, results):
+        self._lock.acquire()
+        try:
+            tasks = self._tasks
+            if self._idle:
+                self._idle -= 1
+                thread = None
+            else:
+                self._workers += 1
+                thread = threading.Thread(target=self._worker, args=(tasks,), name='HedgePolicy-%d' % self._workers)
+                thread.daemon = True
+        finally:
+            self._lock.release()
+        if thread is not None:
+            thread.start()
+        tasks.put((index, pool, procedure_name, options, kwargs, results))
+
+    def close(self):
+        """Stop worker threads, once their current call (if any) completes.
+        The policy can still be used, new workers are started as needed"""
+        self._lock.acquire()
+        try:
+            tasks = self._tasks
+            self._tasks = queue.Queue()
+            workers = self._workers
+            self._workers = 0
+            self._idle = 0
+        finally:
+            self._lock.release()
+        for x in range(workers):
+            tasks.put(None)
+
+    def callproc(self, pool, procedure_name, func_sig=None, columnar=False, records=False, binary=None, **kwargs):
+        """callproc(), hedged if procedure_name is one of procedure_names"""
+        options = {'func_sig': func_sig, 'columnar': columnar, 'records': records, 'binary': binary}
+        if procedure_name not in self.procedure_names or not isinstance(pool, BaseRSOPool):
+            return callproc(pool, procedure_name, **dict(options, **kwargs))
+        self._count('calls')
+        delay = self.get_delay(procedure_name)
+        if delay is None:
+            # learning latencies
+            start = _clock()
+            result = callproc(pool, procedure_name, **dict(options, **kwargs))
+            self.record(procedure_name, _clock() - start)
+            return result
+
+        results = queue.Queue()
+        self._start(0, pool, procedure_name, options, kwargs, results)
+        try:
+            call_result = results.get(timeout=delay)
+            pending = 0
+        except queue.Empty:
+            self._count('hedged')
+            self._start(1, pool, procedure_name, options, kwargs, results)
+            call_result = results.get()
+            pending = 1
+        while call_result.error is not None and pending:
+            # failed, use other call
+            call_result = results.get()
+            pending -= 1
+        if call_result.index == 1 and call_result.error is None:
+            self._count('hedge_wins')
+        return call_result.get()
+
+
+# Signature for chunked transfer procedures, see send_stream() and receive_stream()
+STREAM_FUNC_SIG = 'transfer_id=STRING; offset=INTEGER; length=INTEGER; data=BINARY'
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def send_stream(pool, procedure_name, transfer_id, fileobj, chunk_size=DEFAULT_CHUNK_SIZE, offset=0, max_in_flight=None, progress=None):
+    """Upload contents of file like object `fileobj` in chunks, using
+    4GL procedure `procedure_name` which must take parameters:
+
+        transfer_id - STRING, identifies the data (e.g. document id), passed as-is
+        offset - INTEGER, byte offset of this chunk, from 0
+        length - INTEGER, number of bytes in data
+        data - LongByteObject, the chunk
+
+    and write data at offset. Chunks may arrive out of order and on
+    different connections, a chunk may be sent again when resuming.
+
+    fileobj is read from its current position, which is taken to be
+    `offset` (e.g. seek() to offset when resuming). Up to max_in_flight
+    chunks (default pool max_size) are sent concurrently using
+    connections from `pool` (RSOPool) so memory use is at most about
+    chunk_size * max_in_flight. progress, if given, is called with the
+    number of bytes sent (offset) after each chunk.
+
+    Returns the final offset, i.e. offset plus number of bytes sent.
+    On failure raises TransferError, its offset can be used to resume.
+    """
+    def chunks():
+        chunk_offset = offset
+        while True:
+            data = fileobj.read(chunk_size)
+            if not data:
+                return
+            yield {'transfer_id': transfer_id, 'offset': chunk_offset, 'length': len(data), 'data': Binary(data)}
+            chunk_offset += len(data)
+
+    done = offset
+    results = callproc_imap(pool, procedure_name, chunks(), max_in_flight=max_in_flight, func_sig=STREAM_FUNC_SIG)
+    try:
+        for call_result in results:
+            if call_result.error is not None:
+                raise TransferError('send of %r failed at offset %d: %s' % (transfer_id, done, call_result.error), done, call_result.error)
+            done += call_result.kwargs['length']
+            if progress is not None:
+                progress(done)
+    finally:
+        results.close()
+    return done
+
+
+def receive_stream(pool, procedure_name, transfer_id, fileobj, chunk_size=DEFAULT_CHUNK_SIZE, offset=0, max_in_flight=None, progress=None):
+    """Download data in chunks into file like object `fileobj`, using
+    4GL procedure `procedure_name` which must take parameters:
+
+        transfer_id - STRING, identifies the data (e.g. document id), passed as-is
+        offset - INTEGER, byte offset to read from, from 0
+        length - INTEGER, on input maximum number of bytes to return
+        data - LongByteObject, output only
+
+    and return (byref) data, up to length bytes from offset. Returning
+    fewer than length bytes (including none) indicates the end of the data.
+
+    fileobj is written to, in order, from its current position, which is
+    taken to be `offset`. See send_stream() for max_in_flight, progress,
+    return value and errors. Chunks past the end of the data may be
+    requested (and discarded) when chunks are requested concurrently.
+    """
+    def chunks():
+        chunk_offset = offset
+        while True:
+            yield {'transfer_id': transfer_id, 'offset': chunk_offset, 'length': chunk_size}
+            chunk_offset += chunk_size
+
+    done = offset
+    results = callproc_imap(pool, procedure_name, chunks(), max_in_flight=max_in_flight, func_sig=STREAM_FUNC_SIG)
+    try:
+        for call_result in results:
+            if call_result.error is not None:
+                raise TransferError('receive of %r failed at offset %d: %s' % (transfer_id, done, call_result.error), done, call_result.error)
+            data = call_result.result['data']
+            if data:
+                fileobj.write(data)
+                done += len(data)
+                if progress is not None:
+                    progress(done)
+            if data is None or len(data) < chunk_size:
+                break  # end of data
+    finally:
+        results.close()  # outstanding calls are discarded
+    return done
+
+
+def fetch_meta_data_xml(rso):
+    """Get raw (SCP) metadata XML from server"""
+    func_sig = 'b_osca=USERCLASS; b_osca.i_context_id=INTEGER; b_osca.i_error_type=INTEGER; b_osca.i_error_no=INTEGER; b_so_interface=STRING'
+    # Call the procedure in the Application Server
+    result = callproc(rso, 'GetMetaDataInterface', func_sig=func_sig)
+    return result['b_so_interface']
+
+
+def get_meta_data(rso):
+    """Get metadata from server"""
+    return parse_meta_data(fetch_meta_data_xml(rso))
+
+
+GSCP_SPECIAL_NAMES = ('b_osca', 'b_so_xml', 'p_arr_UCXML_Include', 'p_so_xmlin')
+
+
+class MetaDataBuilder(object):
+    """XMLParser target that builds the get_meta_data() nested dicts
+    directly from parse events, no element tree is built so memory used
+    whilst parsing is proportional to a single SCP (or class) rather than
+    the whole document.
+
+    Expected document layout:
+
+        <root>
+            <scps><scp name=".."><param name=".." type=".."/>...</scp>...</scps>
+            <classes><class name=".."><attribute name=".." type=".."/>...</class>...</classes>
+        </root>
+    """
+    def __init__(self):
+        self.app_metadata = {'*classes*': {}}
+        self._tags = []  # currently open elements, root first
+        self._params = None  # params dict for scp/class being parsed
+        self._skip_names = ()
+        self._values = {}  # shared copies of (frequently repeated) attribute values, e.g. type names
+
+    def _compact(self, attrib):
+        values = self._values
+        compact_attrib = {}
+        for key in attrib:
+            value = attrib[key]
+            compact_attrib[key] = values.setdefault(value, value)
+        return compact_attrib
+
+    def start(self, tag, attrib):
+        tags = self._tags
+        depth = len(tags)
+        if depth == 2:
+            if tags[1] == 'scps' and tag == 'scp':
+                record = self.app_metadata[attrib['name']] = {'info': dict(attrib), 'params': {}}
+                self._params = record['params']
+                self._skip_names = GSCP_SPECIAL_NAMES
+            elif tags[1] == 'classes' and tag == 'class':
+                record = self.app_metadata['*classes*'][attrib['name']] = {'info': dict(attrib), 'params': {}}
+                self._params = record['params']
+                self._skip_names = ()
+        elif depth == 3 and self._params is not None:
+            param_name = attrib['name']
+            if param_name not in self._skip_names:
+                self._params[param_name] = self._compact(attrib)
+        tags.append(tag)
+
+    def end(self, tag):
+        self._tags.pop()
+        if len(self._tags) == 2:
+            self._params = None
+
+    def data(self, data):
+        pass  # only attributes are used
+
+    def close(self):
+        return self.app_metadata
+
+
+def element_tree():
+    """Return ElementTree module, imported on first use as it is only
+    needed for metadata"""
+    global ET
+    if ET is None:
+        try:
+            import xml.etree.cElementTree as ET
+        except ImportError:
+            try:
+                import cElementTree as ET
+            except ImportError:
+                import elementtree.ElementTree as ET
+    return ET
+
+
+def parse_meta_data(xml_metadata, chunk_size=64 * 1024):
+    """Convert metadata XML, from fetch_meta_data_xml(), into nested dicts
+    XML is parsed incrementally, see MetaDataBuilder"""
+    parser = element_tree().XMLParser(target=MetaDataBuilder())
+    for offset in range(0, len(xml_metadata), chunk_size):
+        parser.feed(xml_metadata[offset:offset + chunk_size])
+    return parser.close()
+
+
+def _replace_file(src, dst):
+    """Atomically (where supported by OS) rename src to dst, replacing dst"""
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # Python 2.x
+        if sys.platform == 'win32' and os.path.exists(dst):
+            os.remove(dst)  # not atomic, but rename fails if dst exists
+        os.rename(src, dst)
+
+
+class MetaDataCache(object):
+    """On disk cache of get_meta_data() results, keyed by
+    (appserver_hostname, w4gl_image).
+
+    Entries younger than `ttl` seconds are used without contacting the
+    server, so a changed procedure interface is not seen until the entry
+    expires (or force is used, e.g. SimpleDispatcher.reload_meta_data()).
+    Once expired the metadata XML is fetched again, if it has not changed
+    (same fingerprint) the cached copy is reused without re-parsing and
+    the entry is refreshed.
+
+    directory defaults to the ORSERVER_METADATA_CACHE_DIR environment
+    variable, or ~/.orserver_cache
+    """
+    version = 1
+
+    def __init__(self, directory=None, ttl=60):
+        if directory is None:
+            directory = os.environ.get('ORSERVER_METADATA_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.orserver_cache')
+        self.directory = directory
+        self.ttl = ttl
+
+    def __repr__(self):
+        return '<MetaDataCache %r ttl=%r>' % (self.directory, self.ttl)
+
+    def filename(self, appserver_hostname, w4gl_image):
+        key = repr((appserver_hostname.lower(), w4gl_image)).encode('utf-8')
+        return os.path.join(self.directory, 'metadata_%s.json.z' % hashlib.sha1(key).hexdigest())
+
+    def load(self, appserver_hostname, w4gl_image):
+        """Return cache entry dict (with keys created, fingerprint and app_metadata) or None"""
+        import json  # only needed for cache
+        try:
+            f = open(self.filename(appserver_hostname, w4gl_image), 'rb')
+            try:
+                entry = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+            finally:
+                f.close()
+        except (IOError, OSError, ValueError, zlib.error):
+            return None  # missing or corrupt, treat as a miss
+        if entry.get('version') != self.version:
+            return None
+        return entry
+
+    def save(self, appserver_hostname, w4gl_image, fingerprint, app_metadata):
+        import json
+        entry = {
+            'version': self.version,
+            'created': time.time(),
+            'fingerprint': fingerprint,
+            'app_metadata': app_metadata,
+        }
+        data = zlib.compress(json.dumps(entry, separators=(',', ':')).encode('utf-8'))
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+        # write to temporary file then rename, so readers never see a partial file
+        import tempfile
+        fd, tmp_filename = tempfile.mkstemp(prefix='tmp_metadata_', dir=self.directory)
+        try:
+            os.write(fd, data)
+            os.close(fd)
+            _replace_file(tmp_filename, self.filename(appserver_hostname, w4gl_image))
+        except:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+            os.remove(tmp_filename)
+            raise
+
+    def invalidate(self, appserver_hostname, w4gl_image):
+        try:
+            os.remove(self.filename(appserver_hostname, w4gl_image))
+        except OSError:
+            pass
+
+    def fetch_xml(self, rso):
+        return fetch_meta_data_xml(rso)
+
+    def get_meta_data(self, rso, appserver_hostname, w4gl_image, force=False):
+        """Same as get_meta_data(rso) but using cache.
+        If force is True the server is always contacted."""
+        entry = self.load(appserver_hostname, w4gl_image)
+        if entry is not None and not force and time.time() - entry['created'] < self.ttl:
+            return entry['app_metadata']
+        xml_metadata = self.fetch_xml(rso)
+        if isinstance(xml_metadata, unicode):
+            fingerprint = hashlib.sha1(xml_metadata.encode('utf-8')).hexdigest()
+        else:
+            fingerprint = hashlib.sha1(xml_metadata).hexdigest()
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            app_metadata = entry['app_metadata']  # unchanged, no need to parse
+        else:
+            app_metadata = parse_meta_data(xml_metadata)
+        try:
+            self.save(appserver_hostname, w4gl_image, fingerprint, app_metadata)
+        except (IOError, OSError):
+            pass  # cache is an optimization, not being able to write is not fatal
+        return app_metadata
+
+
+_default_metadata_cache = None
+
+
+def get_default_metadata_cache():
+    """Return the shared default MetaDataCache, or None if disabled by
+    setting the environment variable ORSERVER_METADATA_CACHE=0"""
+    global _default_metadata_cache
+    if os.environ.get('ORSERVER_METADATA_CACHE', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    if not get_backend().persistent_metadata:
+        return None  # e.g. simulated, do not mix with real server metadata
+    if _default_metadata_cache is None:
+        _default_metadata_cache = MetaDataCache()
+    return _default_metadata_cache
+
+
+def get_cached_meta_data(rso, metadata_key=None, metadata_cache=True, force=False):
+    """Same as get_meta_data(rso) but using a MetaDataCache, if possible.
+
+    metadata_key - (appserver_hostname, w4gl_image), not needed if rso is an RSOPool
+        or was connected with or_connect(), see get_rso_metadata_key().
+        If unknown the cache is not used.
+    metadata_cache - MetaDataCache, True for get_default_metadata_cache(), or None/False
+        to always get metadata from the server
+    force - if True always get metadata from server (and update cache)
+    """
+    if metadata_cache is True:
+        metadata_cache = get_default_metadata_cache()
+    if metadata_key is None:
+        metadata_key = get_rso_metadata_key(rso)
+    if not metadata_cache or metadata_key is None:
+        return get_meta_data(rso)
+    appserver_hostname, w4gl_image = metadata_key
+    return metadata_cache.get_meta_data(rso, appserver_hostname, w4gl_image, force=force)
+
+
+class MethodProxy(object):
+    """Callable bound to a single procedure, as returned by SimpleDispatcher
+    attribute lookup. The call plan is resolved once (from SCP metadata when
+    available) rather than on each call.
+    """
+    __slots__ = ('rso', 'method_name', 'plan', 'result_cache', 'single_flight', 'hedge')
+
+    def __init__(self, rso, method_name, plan=None, result_cache=None, single_flight=None, hedge=None):
+        self.rso = rso
+        self.method_name = method_name
+        self.plan = plan  # None means guess from values on each call
+        self.result_cache = result_cache
+        self.single_flight = single_flight
+        self.hedge = hedge
+
+    def __call__(self, *args, **kwargs):
+        return callproc(self.rso, self.method_name, func_sig=self.plan, result_cache=self.result_cache, single_flight=self.single_flight, hedge=self.hedge, *args, **kwargs)
+
+    def batch(self, list_of_kwargs, columnar=False, records=False, binary=None, return_exceptions=False):
+        """See callproc_batch(), results are not cached"""
+        return callproc_batch(self.rso, self.method_name, list_of_kwargs, func_sig=self.plan, columnar=columnar, records=records, binary=binary, return_exceptions=return_exceptions)
+
+    def __repr__(self):
+        return '<MethodProxy %s %r>' % (self.method_name, self.plan)
+
+
+METADATA_EAGER = 'eager'  # lookup metadata in SimpleDispatcher constructor
+METADATA_LAZY = 'lazy'  # lookup metadata on first call
+METADATA_BACKGROUND = 'background'  # start lookup on a background thread in constructor
+
+METADATA_PENDING_WAIT = 'wait'  # calls made before metadata is available wait for it
+METADATA_PENDING_GUESS = 'guess'  # calls made before metadata is available use guessmeta_from_values()
+
+
+class SimpleDispatcher:
+    def __init__(self, rso, lookup_meta=True, metadata_cache=True, metadata_key=None, metadata_load=METADATA_EAGER, metadata_pending=METADATA_PENDING_WAIT, result_cache=None, single_flight=None, hedge=None):
+        """rso should already be connected, or be an RSOPool
+        if lookup_meta is False then no attempt to lookup meta data is made
+        metadata_cache and metadata_key control metadata caching, see get_cached_meta_data()
+        metadata_load controls when metadata is looked up; METADATA_EAGER,
+            METADATA_LAZY, or METADATA_BACKGROUND. Background lookup
+            requires rso to be an RSOPool (an RSO must not be used from
+            another thread), otherwise METADATA_LAZY is used.
+        metadata_pending controls calls made before (lazy/background)
+            metadata is available; METADATA_PENDING_WAIT or
+            METADATA_PENDING_GUESS. Guessing requires rso to be an RSOPool
+            as the metadata lookup and calls run concurrently.
+        result_cache - ResultCache for procedure results, see ResultCache.cache_procedure()
+        single_flight - SingleFlight to coalesce identical concurrent calls
+        hedge - HedgePolicy for hedged calls of idempotent procedures
+        """
+        if metadata_load not in (METADATA_EAGER, METADATA_LAZY, METADATA_BACKGROUND):
+            raise ValueError('invalid metadata_load %r' % (metadata_load,))
+        if metadata_pending not in (METADATA_PENDING_WAIT, METADATA_PENDING_GUESS):
+            raise ValueError('invalid metadata_pending %r' % (metadata_pending,))
+        if lookup_meta and metadata_pending == METADATA_PENDING_GUESS and metadata_load != METADATA_EAGER and not isinstance(rso, BaseRSOPool):
+            raise ValueError('metadata_pending %r requires an RSOPool' % (metadata_pending,))
+        if metadata_load == METADATA_BACKGROUND and not isinstance(rso, BaseRSOPool):
+            metadata_load = METADATA_LAZY
+        self.__rso = rso
+        self.__app_metadata = None
+        self.__class_memo = (None, None)
+        self.__proxies = {}
+        self.__result_cache = result_cache
+        self.__single_flight = single_flight
+        self.__hedge = hedge
+        self.__metadata_cache = metadata_cache
+        self.__metadata_key = metadata_key
+        self.__metadata_pending = metadata_pending
+        self.__metadata_loaded = threading.Event()
+        self.__metadata_lock = threading.Lock()
+        self.__metadata_thread = None
+        self.metadata_error = None  # exception from last failed background lookup
+        if not lookup_meta:
+            self.__metadata_loaded.set()
+        elif metadata_load == METADATA_EAGER:
+            self.load_meta_data()
+            #pprint(self.__app_metadata)
+        elif metadata_load == METADATA_BACKGROUND:
+            self._start_meta_data_load()
+
+    def load_meta_data(self):
+        """Load metadata (possibly from cache), invalidates cached method proxies"""
+        self.set_meta_data(get_cached_meta_data(self.__rso, metadata_key=self.__metadata_key, metadata_cache=self.__metadata_cache))
+
+    def reload_meta_data(self):
+        """(Re)load metadata from server, invalidates cached method proxies"""
+        self.set_meta_data(get_cached_meta_data(self.__rso, metadata_key=self.__metadata_key, metadata_cache=self.__metadata_cache, force=True))
+
+    def set_meta_data(self, app_metadata):
+        """Replace metadata (output from get_meta_data()), invalidates cached method proxies"""
+        register_record_classes(app_metadata)  # one Record type per userclass, see get_record_class()
+        # NOTE order matters, see _get_proxy()
+        self.__class_memo = (app_metadata, {})  # flattened userclass metadata, see scp_class_metadata_to_meta()
+        self.__app_metadata = app_metadata
+        self.__proxies = {}
+        self.__metadata_loaded.set()
+
+    def _background_meta_data_load(self):
+        thread_init()
+        try:
+            try:
+                self.load_meta_data()
+                self.metadata_error = None
+            except Exception as info:
+                self.metadata_error = info  # calls will guess or retry
+        finally:
+            thread_uninit()
+
+    def _start_meta_data_load(self):
+        self.__metadata_lock.acquire()
+        try:
+            thread = self.__metadata_thread
+            if not self.__metadata_loaded.is_set() and (thread is None or not thread.is_alive()):
+                thread = threading.Thread(target=self._background_meta_data_load, name='SimpleDispatcher metadata')
+                thread.daemon = True
+                thread.start()
+                self.__metadata_thread = thread
+        finally:
+            self.__metadata_lock.release()
+
+    def wait_meta_data(self, timeout=None):
+        """Wait for metadata lookup. Returns True if metadata is available"""
+        thread = self.__metadata_thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.__metadata_loaded.is_set()
+
+    def _ensure_meta_data(self):
+        """Returns True if metadata lookup is complete, False if call should guess"""
+        if self.__metadata_loaded.is_set():
+            return True
+        if self.__metadata_pending == METADATA_PENDING_GUESS:
+            self._start_meta_data_load()
+            return False
+        self.wait_meta_data()
+        if not self.__metadata_loaded.is_set():
+            # lazy, or background lookup failed; lookup now
+            self.__metadata_lock.acquire()
+            try:
+                if not self.__metadata_loaded.is_set():
+                    self.load_meta_data()
+            finally:
+                self.__metadata_lock.release()
+        return True
+
+    def _raw_callproc(self, method_name, func_sig=None, *args, **kwargs):
+        return callproc(self.__rso, method_name, func_sig=func_sig, result_cache=self.__result_cache, single_flight=self.__single_flight, hedge=self.__hedge, *args, **kwargs)
+
+    def _batch_callproc(self, method_name, list_of_kwargs, return_exceptions=False):
+        """Call method_name once for each dictionary of parameters, see callproc_batch()
+        Same as dispatcher.method_name.batch(list_of_kwargs)"""
+        return self._get_proxy(method_name).batch(list_of_kwargs, return_exceptions=return_exceptions)
+
+    def _get_proxy(self, method_name):
+        # NOTE read proxies before metadata, set_meta_data() writes in reverse order
+        proxies = self.__proxies
+        proxy = proxies.get(method_name)
+        if proxy is None:
+            if not self._ensure_meta_data():
+                return MethodProxy(self.__rso, method_name, result_cache=self.__result_cache, single_flight=self.__single_flight, hedge=self.__hedge)  # guess, not cached
+            proxies = self.__proxies
+            app_metadata = self.__app_metadata
+            plan = None
+            if app_metadata:
+                memo_metadata, class_memo = self.__class_memo
+                if memo_metadata is not app_metadata:
+                    class_memo = None  # metadata being replaced
+                param_meta = scp_metadata_to_meta(app_metadata, method_name, class_memo=class_memo)
+                if param_meta:
+                    plan = get_call_plan(param_meta=param_meta, class_names=scp_metadata_class_names(app_metadata, method_name))
+            proxy = MethodProxy(self.__rso, method_name, plan, self.__result_cache, self.__single_flight, self.__hedge)
+            proxies[method_name] = proxy
+        return proxy
+
+    def __getattr__(self, key):
+        if key in self.__dict__:
+            return self.__dict__[key]
+        elif key.startswith('__'):
+            # do not treat special method lookups (e.g. copy/pickle protocol) as procedures
+            raise AttributeError(key)
+        else:
+            # Assume this is a method lookup
+            return self._get_proxy(key)
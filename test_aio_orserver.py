@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+"""OpenROAD AppServer from Python asyncio test suite
+
+Python 3.7+ only, uses same server settings as test_orserver.py
+(TestAsyncDispatcherSimulated uses the simulated backend, no server needed)
+
+To run test issue:
+
+    python test_aio_orserver.py
+"""
+
+import asyncio
+import threading
+from unittest import main, TestCase
+
+from aio_orserver import AsyncDispatcher
+from orserver import get_rso_pool
+from orserver import MethodNotFound
+from orserver import RSOPool
+from orserver import SimulatedBackend
+
+from test_orserver import APPSERVER_HOSTNAME, CONNECTION_MODE
+from test_orserver import SimulatedBackendTestCase
+
+
+class TestOpenROADServerAsyncDispatcherComtest(TestCase):
+    w4gl_image = 'comtest'
+    appserver_hostname = APPSERVER_HOSTNAME
+    connection_mode = CONNECTION_MODE
+    lookup_meta = True
+
+    def setUp(self):
+        self.rso_pool = get_rso_pool(self.w4gl_image, self.appserver_hostname, connection_mode=self.connection_mode)
+
+    def run_async(self, func):
+        async def wrapper():
+            async with AsyncDispatcher(self.rso_pool, lookup_meta=self.lookup_meta, max_concurrency=4) as server:
+                return await func(server)
+        return asyncio.run(wrapper())
+
+    def test_comtest_helloworld_001(self):
+        canon = {u'counter': 100, u'hellostring': u'Well "COMTEST" to you too.'}
+
+        async def func(server):
+            return await server.helloworld(hellostring='COMTEST', counter=99)
+        result = self.run_async(func)
+        self.assertEqual(canon, result)
+
+    def test_comtest_helloworld_gather(self):
+        canon = [{u'counter': x + 1, u'hellostring': u'Well "COMTEST" to you too.'} for x in range(10)]
+
+        async def func(server):
+            return await server.gather('helloworld', [{'hellostring': 'COMTEST', 'counter': x} for x in range(10)])
+        result = self.run_async(func)
+        self.assertEqual(canon, result)
+
+    def test_comtest_method_does_not_exist(self):
+        async def func(server):
+            return await server.gather('method_does_not_exist', [{'hellostring': 'COMTEST'}])
+        result = self.run_async(func)
+        self.assertTrue(isinstance(result[0], MethodNotFound))
+
+
+class TestOpenROADServerAsyncDispatcherComtestNoMeta(TestOpenROADServerAsyncDispatcherComtest):
+    lookup_meta = False
+
+
+class CountingSimulatedBackend(SimulatedBackend):
+    """SimulatedBackend that counts thread_init()/thread_uninit() calls"""
+    def __init__(self, *args, **kwargs):
+        SimulatedBackend.__init__(self, *args, **kwargs)
+        self.lock = threading.Lock()
+        self.thread_inits = 0
+        self.thread_uninits = 0
+
+    def thread_init(self):
+        with self.lock:
+            self.thread_inits += 1
+
+    def thread_uninit(self):
+        with self.lock:
+            self.thread_uninits += 1
+
+
+class TestAsyncDispatcherSimulated(SimulatedBackendTestCase):
+    backend_class = CountingSimulatedBackend
+
+    def setUp(self):
+        SimulatedBackendTestCase.setUp(self)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.release = threading.Event()
+
+        def slow(params):
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            try:
+                self.release.wait(5)
+            finally:
+                with self.lock:
+                    self.running -= 1
+            return {'value': params['value'] + 1}
+        self.application.register_procedure('slow', slow)
+        self.pool = RSOPool('comtest', 'localhost', max_size=4)
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.close()
+        SimulatedBackendTestCase.tearDown(self)
+
+    def slow(self, server, value):
+        return server.callproc('slow', value=value)
+
+    async def wait_running(self, count):
+        for x in range(500):
+            if self.running >= count:
+                break
+            await asyncio.sleep(0.01)
+
+    def test_loop_reuse(self):
+        server = AsyncDispatcher(self.pool, max_concurrency=1, metadata_cache=False)
+        self.release.set()
+        try:
+            for x in range(2):
+                result = asyncio.run(server.helloworld(hellostring='x', counter=x))
+                self.assertEqual(x + 1, result['counter'])
+                self.assertEqual([{'value': 1}, {'value': 2}], asyncio.run(server.gather('slow', [{'value': 0}, {'value': 1}])))
+        finally:
+            server.close()
+
+    def test_concurrency_limit(self):
+        async def func():
+            async with AsyncDispatcher(self.pool, lookup_meta=False, max_concurrency=2) as server:
+                calls = asyncio.gather(*[self.slow(server, x) for x in range(6)])
+                await self.wait_running(2)
+                await asyncio.sleep(0.05)
+                self.release.set()
+                return await calls
+        self.assertEqual([{'value': x + 1} for x in range(6)], asyncio.run(func()))
+        self.assertEqual(2, self.max_running)
+
+    def test_cancel(self):
+        async def func():
+            async with AsyncDispatcher(self.pool, lookup_meta=False, max_concurrency=1) as server:
+                task = asyncio.ensure_future(self.slow(server, 1))
+                await self.wait_running(1)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                self.assertTrue(task.cancelled())
+                self.assertEqual(1, self.pool.in_use)  # call still in progress
+                self.release.set()
+                # slot (and connection) released when the call completes
+                return await asyncio.wait_for(self.slow(server, 2), 5)
+        self.assertEqual({'value': 3}, asyncio.run(func()))
+        self.assertEqual(0, self.pool.in_use)
+
+    def test_thread_uninit(self):
+        backend = self.backend
+        self.release.set()
+        server = AsyncDispatcher(self.pool, lookup_meta=False, max_concurrency=3)
+        asyncio.run(server.gather('slow', [{'value': x} for x in range(6)]))
+        server.close()
+        server._executor.shutdown(wait=True)
+        self.assertTrue(backend.thread_inits > 0)
+        self.assertEqual(backend.thread_inits, backend.thread_uninits)
+
+    def test_thread_uninit_busy(self):
+        backend = self.backend
+
+        async def func():
+            calls = asyncio.gather(*[self.slow(server, x) for x in range(2)])
+            await self.wait_running(2)
+            server.close()  # whilst workers are busy
+            self.release.set()
+            return await calls
+        server = AsyncDispatcher(self.pool, lookup_meta=False, max_concurrency=3)
+        self.assertEqual([{'value': 1}, {'value': 2}], asyncio.run(func()))
+        server._executor.shutdown(wait=True)
+        self.assertEqual(2, backend.thread_inits)
+        self.assertEqual(2, backend.thread_uninits)
+
+
+if __name__ == "__main__":
+    main()  # NOTE execution never returns
@@ -38,16 +38,73 @@ Add additions demos/tests to comtest:
   *  OpenROAD client tests for above, using orunit
 """
 
+import array
+import atexit
 import datetime
 from decimal import Decimal
+from io import BytesIO
 import os
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
+import time
 from unittest import main, TestCase
 
+from orserver import ARRAY_INDICATOR
+from orserver import add_call_hook
+from orserver import ApplicationNotFound
+from orserver import BackendNotAvailable
+from orserver import BALANCE_EWMA
 from orserver import Binary
+from orserver import BINARY_BYTEARRAY
+from orserver import BINARY_MEMORYVIEW
+from orserver import CallPlan
+from orserver import callproc
+from orserver import callproc_batch
+from orserver import callproc_imap
+from orserver import CallTracer
+from orserver import get_backend
+from orserver import get_call_plan
+from orserver import get_meta_data
+from orserver import get_record_class
+from orserver import get_rso_metadata_key
+from orserver import get_rso_pool
 from orserver import guessmeta_from_values
+from orserver import HedgePolicy
+from orserver import LRUCache
+from orserver import METADATA_BACKGROUND
+from orserver import METADATA_LAZY
+from orserver import METADATA_PENDING_GUESS
+from orserver import MetaDataCache
+from orserver import MethodNotFound
+from orserver import MultiHostPool
 from orserver import or_connect
+from orserver import ParameterDataPool
+from orserver import parse_meta_data
+from orserver import pdo_decode
+from orserver import pdo_set_value
+from orserver import pdo2treedict
+from orserver import receive_stream
+from orserver import Record
+from orserver import register_record_classes
+from orserver import PoolTimeout
+from orserver import normalize_value
+from orserver import remove_call_hook
+from orserver import resolve_call_plan
+from orserver import ResultCache
+from orserver import RSOPool
+from orserver import scp_class_metadata_to_meta
+from orserver import scp_metadata_class_names
+from orserver import scp_metadata_to_meta
+from orserver import send_stream
+from orserver import set_backend
 from orserver import SimpleDispatcher
+from orserver import SimulatedBackend
+from orserver import SimulatedError
+from orserver import SingleFlight
+from orserver import TransferError
 
 
 # Default server details
@@ -58,6 +115,18 @@ default_connection_mode = None
 APPSERVER_HOSTNAME = os.environ.get('TEST_ORSERVER') or default_appserver_hostname
 CONNECTION_MODE = os.environ.get('TEST_ORSERVER_MODE') or default_connection_mode
 
+# default metadata cache (e.g. SimpleDispatcher in server tests) in a
+# temporary directory, not the user's ~/.orserver_cache
+METADATA_CACHE_DIR = tempfile.mkdtemp(prefix='test_orserver_cache_')
+atexit.register(shutil.rmtree, METADATA_CACHE_DIR, True)
+os.environ['ORSERVER_METADATA_CACHE_DIR'] = METADATA_CACHE_DIR
+
+try:
+    get_backend()
+except BackendNotAvailable:
+    # No OpenROAD client, client side tests can still be run. Server tests will fail.
+    set_backend('simulated')
+
 
 class TestMetaGuess(TestCase):
     def test_helloworld_api(self):
@@ -80,6 +149,1505 @@ class TestMetaGuess(TestCase):
         result = guessmeta_from_values(value)
         self.assertEqual(canon, result)
 
+    def test_array_of_userclass(self):
+        value = {
+            u'p1': [
+                {u'attr_int': None, u'attr_str': u'one'},
+                {u'attr_int': 2, u'attr_str': u'two'},
+            ],
+        }
+        canon = {u'p1': 'UCARRAY', u'p1.attr_int': 'INTEGER', u'p1.attr_str': 'STRING'}
+        result = guessmeta_from_values(value)
+        self.assertEqual(canon, result)
+
+    def test_array_of_simple_type(self):
+        self.assertRaises(NotImplementedError, guessmeta_from_values, {u'p1': [1, 2, 3]})
+
+
+class TestCallPlan(TestCase):
+    def test_plan_from_func_sig(self):
+        func_sig = 'hellostring=STRING; counter=INTEGER'
+        canon = {u'counter': 'INTEGER', u'hellostring': 'STRING'}
+        plan = get_call_plan(func_sig)
+        self.assertEqual(func_sig, plan.func_sig)
+        self.assertEqual(canon, plan.param_meta)
+        self.assertEqual(canon, plan.meta_tree)
+
+    def test_plan_from_meta(self):
+        param_meta = {u'p1': 'USERCLASS', u'p1.attr_int': 'INTEGER', u'p1.attr_str': 'STRING'}
+        canon_func_sig = 'p1=USERCLASS; p1.attr_int=INTEGER; p1.attr_str=STRING'
+        canon_meta_tree = {u'p1': {u'attr_int': 'INTEGER', u'attr_str': 'STRING'}}
+        plan = get_call_plan(param_meta=param_meta)
+        self.assertEqual(canon_func_sig, plan.func_sig)
+        self.assertEqual(canon_meta_tree, plan.meta_tree)
+
+    def test_plan_is_cached(self):
+        func_sig = 'test_plan_is_cached=STRING'
+        plan = get_call_plan(func_sig)
+        self.assertTrue(plan is get_call_plan(func_sig))
+        param_meta = {u'test_plan_is_cached': 'STRING'}
+        plan = get_call_plan(param_meta=param_meta)
+        self.assertTrue(plan is get_call_plan(param_meta=dict(param_meta)))
+
+    def test_plan_compiled_converters(self):
+        plan = get_call_plan('p1=USERCLASS; p1.attr_int=INTEGER; p1.attr_str=STRING; counter=INTEGER')
+        canon = [u'counter', u'p1', u'p1.attr_int', u'p1.attr_str']
+        self.assertEqual(canon, sorted(plan.setters))
+        canon = [(u'counter', u'counter', False), (u'p1', u'p1', False)]
+        self.assertEqual(canon, sorted((key, param_name, is_array) for key, param_name, getter, sub_getters, is_array in plan.getters))
+        p1_getters = [entry for entry in plan.getters if entry[0] == u'p1'][0][3]
+        canon = [u'p1.attr_int', u'p1.attr_str']
+        self.assertEqual(canon, sorted(entry[1] for entry in p1_getters))
+
+    def test_plan_is_immutable(self):
+        plan = get_call_plan('hellostring=STRING')
+        self.assertRaises(AttributeError, setattr, plan, 'func_sig', 'counter=INTEGER')
+        self.assertTrue(isinstance(plan, CallPlan))
+
+
+class DictPDO(object):
+    """In memory PDO, supports both COM and Java style getters/setters (for simple types)"""
+
+    def __init__(self, values):
+        self.values = values
+
+    def GetAttribute(self, param_name):
+        return self.values.get(param_name)
+
+    def isNull(self, param_name):
+        return self.values.get(param_name) is None
+
+    getString = getInt = getDouble = getBigDecimal = GetAttribute
+
+    def SetAttribute(self, param_name, value):
+        self.values[param_name] = value
+
+    setString = setInt = setDouble = setBigDecimal = SetAttribute
+
+    def getByteArray(self, param_name):
+        return JythonByteArray('b', self.values[param_name])
+
+    def setByteArray(self, param_name, value):
+        self.values[param_name] = value
+
+    def LastRow(self, param_name):
+        prefix = param_name + '['
+        return max([0] + [int(name[len(prefix):name.index(']', len(prefix))]) for name in self.values if name.startswith(prefix)])
+
+    lastRow = LastRow
+
+    # simulated backend
+    get_attribute = GetAttribute
+    set_attribute = SetAttribute
+    last_row = LastRow
+
+
+class JythonByteArray(array.array):
+    """array('b') as returned by Jython for Java byte[]"""
+    def tostring(self):
+        return self.tobytes()
+
+
+class TestColumnarDecode(TestCase):
+    func_sig = 'rows=UCARRAY; rows.id=INTEGER; rows.name=STRING; rows.score=FLOAT; rows.sub=USERCLASS; rows.sub.code=STRING; total=INTEGER'
+
+    def test_columnar(self):
+        pdo = DictPDO({
+            'total': 2,
+            'rows[1].id': 1, 'rows[1].name': 'one', 'rows[1].score': 1.5, 'rows[1].sub.code': 'a',
+            'rows[2].id': 2, 'rows[2].name': 'two', 'rows[2].score': 2.5, 'rows[2].sub.code': 'b',
+        })
+        plan = get_call_plan(self.func_sig)
+        result = pdo_decode(pdo, plan.columnar_getters)
+        canon = {'total': 2, 'rows': {'id': [1, 2], 'name': ['one', 'two'], 'score': [1.5, 2.5], 'sub.code': ['a', 'b']}}
+        self.assertEqual(['i', 'd'], [result['rows']['id'].typecode, result['rows']['score'].typecode])
+        result['rows']['id'] = result['rows']['id'].tolist()
+        result['rows']['score'] = result['rows']['score'].tolist()
+        self.assertEqual(canon, result)
+        # row based decode is unchanged
+        canon = {'total': 2, 'rows': [{'id': 1, 'name': 'one', 'score': 1.5, 'sub': {'code': 'a'}}, {'id': 2, 'name': 'two', 'score': 2.5, 'sub': {'code': 'b'}}]}
+        self.assertEqual(canon, pdo_decode(pdo, plan.getters))
+
+    def test_columnar_nulls(self):
+        pdo = DictPDO({'rows[1].id': 1, 'rows[2].id': None, 'rows[3].id': 3})
+        plan = get_call_plan(self.func_sig)
+        result = pdo_decode(pdo, plan.columnar_getters)
+        canon = {'total': None, 'rows': {'id': [1, None, 3], 'name': [None, None, None], 'score': [None, None, None], 'sub.code': [None, None, None]}}
+        self.assertEqual(canon, result)
+
+    def test_columnar_empty(self):
+        plan = get_call_plan(self.func_sig)
+        result = pdo_decode(DictPDO({}), plan.columnar_getters)
+        self.assertEqual(0, len(result['rows']['id']))
+        self.assertEqual([], result['rows']['name'])
+
+
+class TestArraySetters(TestCase):
+    value = [
+        {'id': 1, 'name': 'one', 'score': 1.5, 'sub': {'code': 'a'}},
+        {'id': 2, 'name': 'two', 'score': None, 'sub': {'code': 'b'}},
+    ]
+    canon = {
+        'rows[1].id': 1, 'rows[1].name': 'one', 'rows[1].score': 1.5, 'rows[1].sub.code': 'a',
+        'rows[2].id': 2, 'rows[2].name': 'two', 'rows[2].score': None, 'rows[2].sub.code': 'b',
+    }
+
+    def test_compiled_setters(self):
+        plan = get_call_plan(TestColumnarDecode.func_sig)
+        pdo = DictPDO({})
+        plan.setters['rows'](pdo, 'rows', self.value)
+        self.assertEqual(self.canon, pdo.values)
+        # and back again
+        self.assertEqual(self.value, pdo_decode(pdo, plan.getters)['rows'])
+
+    def test_pdo_set_value(self):
+        plan = get_call_plan(TestColumnarDecode.func_sig)
+        pdo = DictPDO({})
+        pdo_set_value(pdo, plan.param_meta, 'rows', self.value)
+        self.assertEqual(self.canon, pdo.values)
+
+
+class TestBinary(TestCase):
+    def test_from_file(self):
+        data = b'binary\x00\xff' * 100
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp_dir, 'test.bin')
+            f = open(filename, 'wb')
+            f.write(data)
+            f.close()
+            with Binary.from_file(filename) as value:
+                self.assertEqual(len(data), len(value))
+                self.assertEqual(data, value.data[:])
+            self.assertEqual(None, value.data)
+
+            f = open(filename, 'wb')
+            f.close()
+            with Binary.from_file(filename) as value:
+                self.assertEqual(0, len(value))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_result_types(self):
+        plan = get_call_plan('doc=BINARY')
+        pdo = DictPDO({'doc': b'abc\xff'})
+        result = pdo_decode(pdo, plan.result_getters(binary=BINARY_BYTEARRAY))['doc']
+        self.assertTrue(isinstance(result, bytearray))
+        self.assertEqual(bytearray(b'abc\xff'), result)
+        result = pdo_decode(pdo, plan.result_getters(binary=BINARY_MEMORYVIEW))['doc']
+        self.assertTrue(isinstance(result, memoryview))
+        self.assertEqual(b'abc\xff', result.tobytes())
+        self.assertRaises(ValueError, plan.result_getters, binary='invalid')
+
+
+class TestRecords(TestCase):
+    def test_record_class(self):
+        record_class = get_record_class(['attr_str', 'attr_int'])
+        self.assertTrue(record_class is get_record_class(('attr_int', 'attr_str')))
+        self.assertEqual(('attr_int', 'attr_str'), record_class._fields)
+        record = record_class(1, attr_str='one')
+        self.assertTrue(isinstance(record, Record))
+        self.assertEqual(1, record.attr_int)
+        self.assertEqual({'attr_int': 1, 'attr_str': 'one'}, record.to_dict())
+        self.assertEqual(record_class(1, 'one'), record)
+        self.assertRaises(AttributeError, setattr, record, 'attr_missing', 1)
+        self.assertRaises(TypeError, record_class, attr_missing=1)
+
+    def test_register_from_metadata(self):
+        app_metadata = parse_meta_data(SAMPLE_METADATA_XML)
+        record_classes = register_record_classes(app_metadata)
+        record_class = record_classes['ucsimpleintstr']
+        self.assertEqual('ucsimpleintstr', record_class.__name__)
+        self.assertTrue(record_class is get_record_class(['attr_int', 'attr_str'], 'ucsimpleintstr'))
+        # unnamed (guessed) classes do not share the userclass type
+        self.assertFalse(record_class is get_record_class(['attr_int', 'attr_str']))
+
+    def test_same_attributes_different_class(self):
+        pdo = DictPDO({'a.attr_int': 1, 'b.attr_int': 2, 'rows[1].attr_int': 3})
+        param_meta = {'a': 'USERCLASS', 'a.attr_int': 'INTEGER', 'b': 'USERCLASS', 'b.attr_int': 'INTEGER', 'rows': 'UCARRAY', 'rows.attr_int': 'INTEGER'}
+        plan = get_call_plan(param_meta=param_meta, class_names={'a': 'uc_a', 'b': 'uc_b', 'rows': 'uc_b'})
+        result = pdo_decode(pdo, plan.record_getters)
+        self.assertEqual('uc_a', result['a'].__class__.__name__)
+        self.assertEqual('uc_b', result['b'].__class__.__name__)
+        self.assertTrue(result['rows'][0].__class__ is result['b'].__class__)
+        self.assertFalse(result['a'].__class__ is result['b'].__class__)
+        # plan without class names is cached separately
+        self.assertFalse(plan is get_call_plan(param_meta=param_meta))
+
+    def test_decode_records(self):
+        pdo = DictPDO({
+            'total': 2,
+            'rows[1].id': 1, 'rows[1].name': 'one', 'rows[1].score': 1.5, 'rows[1].sub.code': 'a',
+            'rows[2].id': 2, 'rows[2].name': 'two', 'rows[2].score': 2.5, 'rows[2].sub.code': 'b',
+        })
+        plan = get_call_plan(TestColumnarDecode.func_sig)
+        result = pdo_decode(pdo, plan.record_getters)
+        row = result['rows'][1]
+        self.assertEqual(('id', 'name', 'score', 'sub'), row._fields)
+        self.assertEqual('b', row.sub.code)
+        # same content as dictionary decode
+        result['rows'] = [row.to_dict() for row in result['rows']]
+        self.assertEqual(pdo_decode(pdo, plan.getters), result)
+
+    def test_treedict_nested_userclass(self):
+        pdo = DictPDO({
+            'p1.attr_int': 1, 'p1.inner.code': 'x',
+            'rows[1].id': 1, 'rows[1].sub.code': 'a',
+            'rows[2].id': 2, 'rows[2].sub.code': 'b',
+        })
+        meta_tree = get_call_plan('p1=USERCLASS; p1.attr_int=INTEGER; p1.inner=USERCLASS; p1.inner.code=STRING; rows=UCARRAY; rows.id=INTEGER; rows.sub=USERCLASS; rows.sub.code=STRING').meta_tree
+        canon = {
+            'p1': {'attr_int': 1, 'inner': {'code': 'x'}},
+            'rows': [{'id': 1, 'sub': {'code': 'a'}}, {'id': 2, 'sub': {'code': 'b'}}],
+        }
+        self.assertEqual(canon, pdo2treedict(pdo, meta_tree))
+        result = pdo2treedict(pdo, meta_tree, records=True)
+        self.assertEqual(('attr_int', 'inner'), result['p1']._fields)
+        self.assertEqual('x', result['p1'].inner.code)
+        self.assertEqual(('id', 'sub'), result['rows'][0]._fields)
+        self.assertEqual('b', result['rows'][1].sub.code)
+        self.assertEqual(canon['p1'], result['p1'].to_dict())
+        self.assertEqual(canon['rows'], [row.to_dict() for row in result['rows']])
+
+
+class TestLRUCache(TestCase):
+    def test_hit_miss_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))  # 'a' is now most recent
+        cache.put('c', 3)  # evicts 'b'
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+        canon = {'hits': 2, 'misses': 1, 'evictions': 1, 'size': 2, 'maxsize': 2}
+        self.assertEqual(canon, cache.stats())
+
+
+class TestParameterDataPool(TestCase):
+    def test_pdo_reused(self):
+        pool = ParameterDataPool()
+        plan = get_call_plan('hellostring=STRING; counter=INTEGER')
+        pdo = pool.checkout(plan)
+        pool.checkin(plan, pdo)
+        self.assertTrue(pdo is pool.checkout(plan))
+
+    def test_pdo_not_shared(self):
+        pool = ParameterDataPool()
+        plan = get_call_plan('hellostring=STRING; counter=INTEGER')
+        pdo1 = pool.checkout(plan)
+        pdo2 = pool.checkout(plan)
+        self.assertFalse(pdo1 is pdo2)
+
+    def test_pdo_array_not_pooled(self):
+        pool = ParameterDataPool()
+        plan = get_call_plan('b_arr=UCARRAY; b_arr.i_id=INTEGER')
+        self.assertFalse(plan.reusable)
+        pdo = pool.checkout(plan)
+        pool.checkin(plan, pdo)
+        self.assertFalse(pdo is pool.checkout(plan))
+
+
+class TestSimpleDispatcherProxy(TestCase):
+    app_metadata = {
+        'SCP_helloworld': {
+            'info': {'name': 'SCP_helloworld'},
+            'params': {
+                'hellostring': {'name': 'hellostring', 'type': 'string'},
+                'counter': {'name': 'counter', 'type': 'int'},
+            },
+        },
+        '*classes*': {},
+    }
+
+    def test_proxy_is_cached(self):
+        server = SimpleDispatcher(None, lookup_meta=False)
+        self.assertTrue(server.helloworld is server.helloworld)
+        self.assertEqual(None, server.helloworld.plan)
+
+    def test_proxy_plan_from_meta(self):
+        server = SimpleDispatcher(None, lookup_meta=False)
+        server.set_meta_data(self.app_metadata)
+        canon = 'counter=INTEGER; hellostring=STRING'
+        self.assertEqual(canon, server.helloworld.plan.func_sig)
+
+    def test_proxy_invalidated_on_meta_change(self):
+        server = SimpleDispatcher(None, lookup_meta=False)
+        proxy = server.helloworld
+        server.set_meta_data(self.app_metadata)
+        self.assertFalse(proxy is server.helloworld)
+        self.assertTrue(server.helloworld.plan is not None)
+
+    def test_special_methods_not_proxied(self):
+        server = SimpleDispatcher(None, lookup_meta=False)
+        self.assertRaises(AttributeError, getattr, server, '__deepcopy__')
+
+
+class FakeRSO(object):
+    """Stand in for a connected RemoteServer, for pool tests"""
+    def __init__(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+
+def fake_connect(w4gl_image, appserver_hostname, **kwargs):
+    return FakeRSO()
+
+
+class TestRSOPool(TestCase):
+    def test_connection_reused(self):
+        pool = RSOPool('comtest', 'localhost', connect=fake_connect)
+        with pool.connection() as rso1:
+            pass
+        with pool.connection() as rso2:
+            pass
+        self.assertTrue(rso1 is rso2)
+        self.assertEqual(1, pool.size)
+
+    def test_min_size(self):
+        pool = RSOPool('comtest', 'localhost', min_size=2, connect=fake_connect)
+        self.assertEqual(2, pool.idle)
+
+    def test_checkout_timeout(self):
+        pool = RSOPool('comtest', 'localhost', max_size=1, connect=fake_connect)
+        rso = pool.checkout()
+        self.assertRaises(PoolTimeout, pool.checkout, timeout=0.01)
+        pool.checkin(rso)
+        self.assertTrue(rso is pool.checkout(timeout=0.01))
+
+    def test_broken_discarded(self):
+        pool = RSOPool('comtest', 'localhost', connect=fake_connect)
+        rso = pool.checkout()
+        pool.checkin(rso, broken=True)
+        self.assertFalse(rso.connected)
+        self.assertEqual(0, pool.size)
+
+    def test_health_check(self):
+        pool = RSOPool('comtest', 'localhost', connect=fake_connect, health_check=lambda rso: False)
+        rso = pool.checkout()
+        pool.checkin(rso)
+        self.assertFalse(rso is pool.checkout())
+        self.assertFalse(rso.connected)
+
+    def test_reap_idle(self):
+        pool = RSOPool('comtest', 'localhost', min_size=1, max_idle_time=0, connect=fake_connect)
+        rso1 = pool.checkout()
+        rso2 = pool.checkout()
+        pool.checkin(rso1)
+        pool.checkin(rso2)  # reaps down to min_size
+        self.assertEqual(1, pool.size)
+
+    def test_reap_when_unused(self):
+        pool = RSOPool('comtest', 'localhost', max_idle_time=0.05, connect=fake_connect)
+        rso1 = pool.checkout()
+        rso2 = pool.checkout()
+        pool.checkin(rso1)
+        pool.checkin(rso2)
+        self.assertEqual(2, pool.idle)
+        time.sleep(0.1)
+        self.assertEqual(2, pool.reap())  # e.g. called from a timer, no traffic
+        self.assertEqual(0, pool.size)
+        self.assertFalse(rso1.connected or rso2.connected)
+
+    def test_reap_on_checkout(self):
+        pool = RSOPool('comtest', 'localhost', max_idle_time=0.05, connect=fake_connect)
+        rso1 = pool.checkout()
+        rso2 = pool.checkout()
+        pool.checkin(rso1)
+        pool.checkin(rso2)
+        time.sleep(0.1)
+        rso3 = pool.checkout()
+        self.assertFalse(rso1.connected or rso2.connected)
+        self.assertTrue(rso3.connected)
+        self.assertEqual(1, pool.size)
+
+    def test_threads_share_connections(self):
+        pool = RSOPool('comtest', 'localhost', max_size=2, connect=fake_connect)
+        seen = set()
+
+        def worker():
+            for i in range(50):
+                with pool.connection() as rso:
+                    seen.add(rso)
+
+        threads = [threading.Thread(target=worker) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertTrue(len(seen) <= 2)
+        self.assertEqual(0, pool.in_use)
+
+    def test_shared_pool(self):
+        pool = get_rso_pool('test_shared_pool', 'localhost', connect=fake_connect)
+        self.assertTrue(pool is get_rso_pool('test_shared_pool', 'localhost'))
+
+
+SAMPLE_METADATA_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<interface>
+    <scps>
+        <scp name="SCP_helloworld">
+            <param name="b_osca" type="UCOSCA"/>
+            <param name="hellostring" type="string"/>
+            <param name="counter" type="int"/>
+        </scp>
+    </scps>
+    <classes>
+        <class name="ucsimpleintstr">
+            <attribute name="attr_int" type="int"/>
+            <attribute name="attr_str" type="string"/>
+        </class>
+    </classes>
+</interface>
+'''
+
+
+def simulated_helloworld(params):
+    return {'hellostring': u'Well "%s" to you too.' % params['hellostring'], 'counter': params['counter'] + 1}
+
+
+def simulated_total(params):
+    return {'total': sum(row['id'] for row in params['rows'])}
+
+
+class SimulatedFile(object):
+    """Data for simulated upload/download procedures"""
+    def __init__(self, data=b''):
+        self.data = bytearray(data)
+        self.lock = threading.Lock()
+
+    def write_chunk(self, params):
+        data = params['data'] or b''
+        offset = params['offset']
+        self.lock.acquire()
+        try:
+            if len(self.data) < offset + len(data):
+                self.data.extend(b'\x00' * (offset + len(data) - len(self.data)))
+            self.data[offset:offset + len(data)] = data
+        finally:
+            self.lock.release()
+        return {}
+
+    def read_chunk(self, params):
+        offset = params['offset']
+        return {'data': bytes(self.data[offset:offset + params['length']])}
+
+
+class SimulatedBackendTestCase(TestCase):
+    """Switch to a simulated backend serving 'comtest' for each test"""
+    backend_class = SimulatedBackend
+
+    def setUp(self):
+        self.previous_backend = get_backend()
+        self.backend = set_backend(self.backend_class())
+        self.application = self.backend.register_application('comtest', metadata_xml=SAMPLE_METADATA_XML)
+        self.application.register_procedure('helloworld', simulated_helloworld)
+        self.application.register_procedure('total', simulated_total)
+
+    def tearDown(self):
+        set_backend(self.previous_backend)
+
+
+class TestSimulatedBackend(SimulatedBackendTestCase):
+    def test_callproc(self):
+        canon = {u'counter': 100, u'hellostring': u'Well "COMTEST" to you too.'}
+        rso = or_connect('comtest', 'localhost')
+        result = callproc(rso, 'helloworld', hellostring='COMTEST', counter=99)
+        self.assertEqual(canon, result)
+        self.assertEqual(1, self.backend.call_count)
+
+    def test_initiate(self):
+        canon = {u'counter': 2, u'hellostring': u'Well "x" to you too.'}
+        rso = or_connect('comtest', 'localhost', connection_mode='')
+        self.assertEqual(canon, callproc(rso, 'helloworld', hellostring='x', counter=1))
+
+    def test_array(self):
+        rso = or_connect('comtest', 'localhost')
+        func_sig = 'rows=UCARRAY; rows.id=INTEGER; total=INTEGER'
+        result = callproc(rso, 'total', func_sig=func_sig, rows=[{'id': 1}, {'id': 2}, {'id': 3}], total=None)
+        self.assertEqual(6, result['total'])
+        self.assertEqual([{'id': 1}, {'id': 2}, {'id': 3}], result['rows'])
+
+    def test_method_does_not_exist(self):
+        rso = or_connect('comtest', 'localhost')
+        self.assertRaises(MethodNotFound, callproc, rso, 'method_does_not_exist', hellostring='COMTEST')
+
+    def test_application_does_not_exist(self):
+        self.assertRaises(ApplicationNotFound, or_connect, 'application_does_not_exist', 'localhost')
+
+    def test_server_error(self):
+        def fail(params):
+            raise SimulatedError('boom')
+        self.application.register_procedure('fail', fail)
+        rso = or_connect('comtest', 'localhost')
+        self.assertRaises(SimulatedError, callproc, rso, 'fail', hellostring='COMTEST')
+
+    def test_binary_buffer_result(self):
+        # pywin32 under Python 2 returns BINARY values as buffer objects,
+        # which memoryview() does not accept
+        class LegacyBuffer(object):
+            def __init__(self, data):
+                self.data = data
+
+            def __len__(self):
+                return len(self.data)
+
+            def __getitem__(self, index):
+                return self.data[index]
+
+        self.assertRaises(TypeError, memoryview, LegacyBuffer(b''))
+        self.application.register_procedure('download', lambda params: {'data': LegacyBuffer(b'abc\xff')})
+        rso = or_connect('comtest', 'localhost')
+        result = callproc(rso, 'download', func_sig='data=BINARY', binary=BINARY_MEMORYVIEW)['data']
+        self.assertTrue(isinstance(result, memoryview))
+        self.assertEqual(b'abc\xff', result.tobytes())
+        result = callproc(rso, 'download', func_sig='data=BINARY', binary=BINARY_BYTEARRAY)['data']
+        self.assertEqual(bytearray(b'abc\xff'), result)
+        self.assertEqual(normalize_value(b'abc\xff'), normalize_value(memoryview(b'abc\xff')))
+
+    def test_meta_data(self):
+        rso = or_connect('comtest', 'localhost')
+        self.assertEqual(parse_meta_data(SAMPLE_METADATA_XML), get_meta_data(rso))
+        server = SimpleDispatcher(rso, metadata_cache=False)
+        self.assertEqual('counter=INTEGER; hellostring=STRING', server.helloworld.plan.func_sig)
+        canon = {u'counter': 2, u'hellostring': u'Well "x" to you too.'}
+        self.assertEqual(canon, server.helloworld(hellostring='x', counter=1))
+
+    def test_set_backend_recompiles_plans(self):
+        server = SimpleDispatcher(or_connect('comtest', 'localhost'), metadata_cache=False)
+        plan = server.helloworld.plan
+        self.assertTrue(plan.backend is self.backend)
+        self.assertTrue(resolve_call_plan(plan, None) is plan)
+        backend = set_backend(SimulatedBackend())
+        application = backend.register_application('comtest', metadata_xml=SAMPLE_METADATA_XML)
+        application.register_procedure('helloworld', simulated_helloworld)
+        new_plan = resolve_call_plan(plan, None)
+        self.assertTrue(new_plan.backend is backend)
+        self.assertEqual(plan.func_sig, new_plan.func_sig)
+        rso = or_connect('comtest', 'localhost')
+        self.assertEqual(2, callproc(rso, 'helloworld', func_sig=plan, hellostring='x', counter=1)['counter'])
+        self.assertEqual(1, backend.call_count)
+
+    def test_meta_data_cache_plain_rso(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = MetaDataCache(directory, ttl=60)
+            rso = or_connect('comtest', 'localhost')
+            server = SimpleDispatcher(rso, metadata_cache=cache)
+            self.assertEqual(1, self.backend.call_count)  # GetMetaDataInterface
+            self.assertTrue(cache.load('localhost', 'comtest') is not None)
+            server = SimpleDispatcher(or_connect('comtest', 'localhost'), metadata_cache=cache)
+            self.assertEqual(1, self.backend.call_count)
+            self.assertEqual('counter=INTEGER; hellostring=STRING', server.helloworld.plan.func_sig)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_records_named_after_userclass(self):
+        metadata_xml = """<?xml version="1.0" encoding="UTF-8"?>
+<interface>
+    <scps>
+        <scp name="SCP_pair">
+            <param name="a" type="uc_a"/>
+            <param name="b" type="uc_b"/>
+        </scp>
+    </scps>
+    <classes>
+        <class name="uc_a"><attribute name="value" type="int"/></class>
+        <class name="uc_b"><attribute name="value" type="int"/></class>
+    </classes>
+</interface>
+"""
+        application = self.backend.register_application('pairtest', metadata_xml=metadata_xml)
+        application.register_procedure('pair', lambda params: {'b': {'value': params['a']['value'] + 1}})
+        server = SimpleDispatcher(or_connect('pairtest', 'localhost'), metadata_cache=False)
+        result = server.pair(a={'value': 1}, b={'value': None}, records=True)
+        self.assertEqual('uc_a', result['a'].__class__.__name__)
+        self.assertEqual('uc_b', result['b'].__class__.__name__)
+        self.assertEqual(2, result['b'].value)
+
+    def test_latency(self):
+        self.backend.latency = lambda: 0.01
+        rso = or_connect('comtest', 'localhost')
+        start = time.time()
+        callproc(rso, 'helloworld', hellostring='x', counter=1)
+        self.assertTrue(time.time() - start >= 0.01)
+
+
+class ResetErrorBackend(SimulatedBackend):
+    """SimulatedBackend where setting NULLs (PDO reset) can be made to fail"""
+    fail_reset = False
+
+    def pdo_set_null(self, pdo, param_name):
+        if self.fail_reset:
+            raise SimulatedError('reset failed')
+        SimulatedBackend.pdo_set_null(self, pdo, param_name)
+
+
+class TestCallprocBatch(SimulatedBackendTestCase):
+    backend_class = ResetErrorBackend
+
+    def setUp(self):
+        SimulatedBackendTestCase.setUp(self)
+        self.pdos = []
+
+        def echo(params):
+            if params['counter'] < 0:
+                raise SimulatedError('negative counter')
+            return {}
+        self.application.register_procedure('echo', echo)
+        self.rso = or_connect('comtest', 'localhost')
+
+    def test_errors_returned(self):
+        params = [{'hellostring': 'x', 'counter': x} for x in (1, -1, 2)]
+        self.assertRaises(SimulatedError, callproc_batch, self.rso, 'echo', params)
+        results, timings = callproc_batch(self.rso, 'echo', params, return_exceptions=True)
+        self.assertEqual({'hellostring': 'x', 'counter': 1}, results[0])
+        self.assertTrue(isinstance(results[1], SimulatedError))
+        self.assertEqual({'hellostring': 'x', 'counter': 2}, results[2])
+        self.assertEqual(None, timings[1])
+
+    def test_reset_error_not_reused(self):
+        def echo(params):
+            self.backend.fail_reset = params['counter'] == 1
+            return {}
+        self.application.register_procedure('echo', echo)
+        original_set_null = self.backend.pdo_set_null
+
+        def set_null(pdo, param_name):
+            if param_name == 'counter':  # first attribute reset
+                self.pdos.append(pdo)
+            original_set_null(pdo, param_name)
+        self.backend.pdo_set_null = set_null
+        params = [{'hellostring': 'x', 'counter': x} for x in range(3)]
+        results, timings = callproc_batch(self.rso, 'echo', params, func_sig='counter=INTEGER; hellostring=STRING')
+        self.assertEqual(params, results)
+        self.assertEqual(3, len(self.pdos))
+        self.assertTrue(self.pdos[0] is self.pdos[1])  # reused after first call, then reset failed
+        self.assertFalse(self.pdos[1] is self.pdos[2])  # not reused after failed reset
+
+
+    def test_decode_excludes_reset(self):
+        original_set_null = self.backend.pdo_set_null
+
+        def set_null(pdo, param_name):
+            time.sleep(0.05)
+            original_set_null(pdo, param_name)
+        self.backend.pdo_set_null = set_null
+        params = [{'hellostring': 'x', 'counter': x} for x in range(2)]
+        with CallTracer() as tracer:
+            results, timings = callproc_batch(self.rso, 'echo', params, func_sig='counter=INTEGER; hellostring=STRING')
+        self.assertEqual(params, results)
+        for timing in timings:
+            self.assertTrue(timing.decode < 0.05, timing)
+        for trace in tracer.traces:
+            self.assertTrue(trace.decode < 0.05, trace.decode)
+
+
+class ThreadInitErrorBackend(SimulatedBackend):
+    def thread_init(self):
+        raise SimulatedError('thread_init failed')
+
+
+class TestCallprocImap(SimulatedBackendTestCase):
+    def setUp(self):
+        SimulatedBackendTestCase.setUp(self)
+        self.pool = RSOPool('comtest', 'localhost', max_size=4)
+
+    def tearDown(self):
+        self.pool.close()
+        SimulatedBackendTestCase.tearDown(self)
+
+    def test_ordered(self):
+        params = [{'hellostring': 'x', 'counter': x} for x in range(10)]
+        result = [call_result.get()['counter'] for call_result in callproc_imap(self.pool, 'helloworld', params, max_in_flight=3)]
+        self.assertEqual(list(range(1, 11)), result)
+
+    def test_thread_init_error(self):
+        self.backend = set_backend(ThreadInitErrorBackend())
+        params = [{'hellostring': 'x', 'counter': x} for x in range(3)]
+        result = list(callproc_imap(self.pool, 'helloworld', params, max_in_flight=2))
+        self.assertEqual([0, 1, 2], [call_result.index for call_result in result])
+        for call_result in result:
+            self.assertTrue(isinstance(call_result.error, SimulatedError))
+
+
+class TestCallHooks(SimulatedBackendTestCase):
+    def test_tracer(self):
+        rso = or_connect('comtest', 'localhost')
+        with CallTracer() as tracer:
+            callproc(rso, 'helloworld', hellostring='x', counter=1)
+        callproc(rso, 'helloworld', hellostring='x', counter=1)  # not traced
+        self.assertEqual(1, len(tracer.traces))
+        trace = tracer.traces[0]
+        self.assertEqual('helloworld', trace.procedure_name)
+        self.assertTrue(trace.ok)
+        self.assertEqual(2, trace.attribute_count)
+        self.assertEqual({}, trace.array_rows)
+        for phase in ('plan', 'declare', 'set', 'call', 'decode'):
+            self.assertTrue(getattr(trace, phase) >= 0.0)
+        self.assertTrue(trace.total >= trace.call)
+        summary = tracer.summary()
+        self.assertEqual(1, summary['helloworld']['calls'])
+        self.assertEqual(0, summary['helloworld']['errors'])
+
+    def test_array_rows(self):
+        rso = or_connect('comtest', 'localhost')
+        with CallTracer() as tracer:
+            callproc(rso, 'total', func_sig='rows=UCARRAY; rows.id=INTEGER; total=INTEGER', rows=[{'id': 1}, {'id': 2}], total=None)
+        self.assertEqual({'rows': 2}, tracer.traces[0].array_rows)
+        self.assertEqual(3, tracer.traces[0].attribute_count)
+
+    def test_error(self):
+        rso = or_connect('comtest', 'localhost')
+        with CallTracer() as tracer:
+            self.assertRaises(MethodNotFound, callproc, rso, 'method_does_not_exist', hellostring='x')
+        trace = tracer.traces[0]
+        self.assertFalse(trace.ok)
+        self.assertTrue(isinstance(trace.error, MethodNotFound))
+        self.assertEqual(1, tracer.summary()['method_does_not_exist']['errors'])
+
+    def test_batch(self):
+        rso = or_connect('comtest', 'localhost')
+        with CallTracer() as tracer:
+            callproc_batch(rso, 'helloworld', [{'hellostring': 'x', 'counter': x} for x in range(3)])
+        self.assertEqual(3, len(tracer.traces))
+        self.assertEqual(['helloworld'] * 3, [trace.procedure_name for trace in tracer.traces])
+
+    def test_hook_errors_ignored(self):
+        def hook(trace):
+            raise RuntimeError('broken hook')
+        rso = or_connect('comtest', 'localhost')
+        add_call_hook(hook)
+        try:
+            result = callproc(rso, 'helloworld', hellostring='x', counter=1)
+        finally:
+            remove_call_hook(hook)
+        self.assertEqual(2, result['counter'])
+
+
+class TestNormalizeValue(TestCase):
+    def test_stable(self):
+        value = {'b': [{'x': 1, 'y': u'a'}], 'a': Decimal('1.5'), 'd': datetime.datetime(2000, 1, 2, 3, 4, 5), 'bin': Binary(b'abc')}
+        same = {'bin': Binary(bytearray(b'abc')), 'd': datetime.datetime(2000, 1, 2, 3, 4, 5), 'a': Decimal('1.5'), 'b': [{'y': u'a', 'x': 1}]}
+        self.assertEqual(normalize_value(value), normalize_value(same))
+        self.assertEqual(hash(normalize_value(value)), hash(normalize_value(same)))
+
+    def test_types_differ(self):
+        self.assertNotEqual(normalize_value(1), normalize_value(1.0))
+        self.assertNotEqual(normalize_value(1), normalize_value(Decimal('1')))
+        self.assertNotEqual(normalize_value(datetime.date(2000, 1, 2)), normalize_value(datetime.datetime(2000, 1, 2)))
+
+    def test_unsupported(self):
+        self.assertRaises(TypeError, normalize_value, object())
+
+
+class TestResultCache(SimulatedBackendTestCase):
+    def setUp(self):
+        SimulatedBackendTestCase.setUp(self)
+        self.calls = []
+        self.value = 1
+
+        def lookup(params):
+            self.calls.append(params['key'])
+            return {'value': self.value}
+        self.application.register_procedure('lookup', lookup)
+        self.application.register_procedure('update', lambda params: {})
+        self.cache = ResultCache()
+        self.cache.cache_procedure('lookup', ttl=60, tags=['lookup'])
+        self.cache.invalidate_on('update', ['lookup'])
+        self.rso = or_connect('comtest', 'localhost')
+
+    def lookup(self, key='a', rso=None):
+        return callproc(rso or self.rso, 'lookup', func_sig='key=STRING; value=INTEGER', result_cache=self.cache, key=key)
+
+    def test_hit(self):
+        self.assertEqual({'key': 'a', 'value': 1}, self.lookup())
+        self.value = 2
+        self.assertEqual({'key': 'a', 'value': 1}, self.lookup())
+        self.assertEqual({'key': 'b', 'value': 2}, self.lookup('b'))
+        self.assertEqual(['a', 'b'], self.calls)
+        stats = self.cache.stats()
+        self.assertEqual((1, 2), (stats['hits'], stats['misses']))
+
+    def test_copy(self):
+        self.lookup()['value'] = 'changed'
+        self.assertEqual(1, self.lookup()['value'])
+
+    def test_not_cached(self):
+        callproc(self.rso, 'helloworld', result_cache=self.cache, hellostring='x', counter=1)
+        self.assertEqual(0, len(self.cache))
+
+    def test_ttl(self):
+        self.cache.cache_procedure('lookup', ttl=0)
+        self.lookup()
+        self.lookup()
+        self.assertEqual(['a', 'a'], self.calls)
+
+    def test_lru(self):
+        self.cache.maxsize = 2
+        for key in 'abca':
+            self.lookup(key)
+        self.assertEqual(['a', 'b', 'c', 'a'], self.calls)
+        self.assertEqual(2, self.cache.stats()['evictions'])
+
+    def test_max_bytes(self):
+        self.lookup('a')
+        self.cache.max_bytes = self.cache.stats()['bytes'] * 2 - 1
+        self.lookup('b')
+        self.assertEqual(1, len(self.cache))
+
+    def test_invalidate_on(self):
+        self.lookup()
+        self.value = 2
+        callproc(self.rso, 'update', func_sig='key=STRING', result_cache=self.cache, key='a')
+        self.assertEqual(2, self.lookup()['value'])
+        self.assertEqual(1, self.cache.stats()['invalidated'])
+
+    def test_stale_while_revalidate(self):
+        self.cache.cache_procedure('lookup', ttl=0, stale_ttl=60)
+        pool = RSOPool('comtest', 'localhost')
+        try:
+            self.assertEqual(1, self.lookup(rso=pool)['value'])
+            self.value = 2
+            self.assertEqual(1, self.lookup(rso=pool)['value'])  # stale, refresh started
+            for x in range(100):
+                if len(self.calls) == 2 and not self.cache._data[list(self.cache._data)[0]].refreshing:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(['a', 'a'], self.calls)
+            self.assertEqual(1, self.cache.stats()['stale_hits'])
+        finally:
+            pool.close()
+
+    def test_keyed_by_server(self):
+        other = self.backend.register_application('othertest')
+        other.register_procedure('lookup', lambda params: {'value': 100})
+        self.assertEqual(1, self.lookup()['value'])
+        self.assertEqual(100, self.lookup(rso=or_connect('othertest', 'localhost'))['value'])
+        self.assertEqual(1, self.lookup(rso=or_connect('comtest', 'localhost'))['value'])  # same server, cached
+        self.assertEqual(['a'], self.calls)
+
+    def test_dispatcher(self):
+        server = SimpleDispatcher(self.rso, lookup_meta=False, result_cache=self.cache)
+        server.lookup(key='a', value=None)
+        server.lookup(key='a', value=None)
+        self.assertEqual(['a'], self.calls)
+
+
+class TestSingleFlight(SimulatedBackendTestCase):
+    def setUp(self):
+        SimulatedBackendTestCase.setUp(self)
+        self.calls = []
+        self.release = threading.Event()
+
+        def slow_lookup(params):
+            self.calls.append(params['key'])
+            self.release.wait(5)
+            if params['key'] == 'error':
+                raise SimulatedError('lookup failed')
+            return {'value': len(self.calls)}
+        self.application.register_procedure('lookup', slow_lookup)
+        self.pool = RSOPool('comtest', 'localhost', max_size=4)
+        self.single_flight = SingleFlight(['lookup'])
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.close()
+        SimulatedBackendTestCase.tearDown(self)
+
+    def concurrent_lookups(self, keys):
+        results = [None] * len(keys)
+
+        def lookup(index):
+            try:
+                results[index] = callproc(self.pool, 'lookup', func_sig='key=STRING; value=INTEGER', single_flight=self.single_flight, key=keys[index])
+            except Exception as info:
+                results[index] = info
+        threads = [threading.Thread(target=lookup, args=(index,)) for index in range(len(keys))]
+        for t in threads:
+            t.start()
+        for x in range(500):
+            stats = self.single_flight.stats()
+            if self.release.is_set() or stats['calls'] + stats['coalesced'] == len(keys):
+                break
+            time.sleep(0.01)
+        self.release.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_coalesced(self):
+        results = self.concurrent_lookups(['a'] * 4)
+        self.assertEqual(['a'], self.calls)
+        self.assertEqual([{'key': 'a', 'value': 1}] * 4, results)
+        self.assertEqual(4, len(set(id(result) for result in results)))  # copies
+        self.assertEqual({'calls': 1, 'coalesced': 3, 'in_flight': 0}, self.single_flight.stats())
+
+    def test_different_args(self):
+        self.concurrent_lookups(['a', 'b', 'a'])
+        self.assertEqual(['a', 'b'], sorted(self.calls))
+
+    def test_error(self):
+        results = self.concurrent_lookups(['error'] * 3)
+        self.assertEqual(['error'], self.calls)
+        for result in results:
+            self.assertTrue(isinstance(result, SimulatedError))
+
+    def test_not_coalesced(self):
+        self.single_flight.procedure_names = set()
+        self.release.set()
+        self.concurrent_lookups(['a'] * 2)
+        self.assertEqual(['a', 'a'], self.calls)
+
+    def test_result_cache_miss(self):
+        cache = ResultCache()
+        cache.cache_procedure('lookup', ttl=60)
+        self.single_flight = cache.single_flight
+        results = [None] * 3
+
+        def lookup(index):
+            results[index] = callproc(self.pool, 'lookup', func_sig='key=STRING; value=INTEGER', result_cache=cache, key='a')
+        threads = [threading.Thread(target=lookup, args=(index,)) for index in range(3)]
+        for t in threads:
+            t.start()
+        for x in range(500):
+            if cache.single_flight.stats()['coalesced'] == 2:
+                break
+            time.sleep(0.01)
+        self.release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(['a'], self.calls)
+        self.assertEqual([{'key': 'a', 'value': 1}] * 3, results)
+
+
+class ThreadCountingBackend(SimulatedBackend):
+    """SimulatedBackend that counts thread_init()/thread_uninit() calls"""
+    def __init__(self, *args, **kwargs):
+        SimulatedBackend.__init__(self, *args, **kwargs)
+        self.lock = threading.Lock()
+        self.thread_inits = 0
+        self.thread_uninits = 0
+
+    def thread_init(self):
+        with self.lock:
+            self.thread_inits += 1
+
+    def thread_uninit(self):
+        with self.lock:
+            self.thread_uninits += 1
+
+
+class TestHedgePolicy(SimulatedBackendTestCase):
+    backend_class = ThreadCountingBackend
+
+    def setUp(self):
+        SimulatedBackendTestCase.setUp(self)
+        self.delays = []  # seconds to sleep for each call, then no delay
+
+        def lookup(params):
+            if self.delays:
+                time.sleep(self.delays.pop(0))
+            if params['key'] == 'error':
+                raise SimulatedError('lookup failed')
+            return {'value': 1}
+        self.application.register_procedure('lookup', lookup)
+        self.pool = RSOPool('comtest', 'localhost', max_size=4)
+
+    def tearDown(self):
+        self.pool.close()
+        SimulatedBackendTestCase.tearDown(self)
+
+    def lookup(self, hedge, key='a', rso=None):
+        return callproc(rso or self.pool, 'lookup', func_sig='key=STRING; value=INTEGER', hedge=hedge, key=key)
+
+    def test_hedge_wins(self):
+        hedge = HedgePolicy(['lookup'], delay=0.05)
+        self.delays = [1.0]
+        start = time.time()
+        self.assertEqual({'key': 'a', 'value': 1}, self.lookup(hedge))
+        self.assertTrue(time.time() - start < 0.9)
+        stats = hedge.stats()
+        self.assertEqual((1, 1, 1), (stats['calls'], stats['hedged'], stats['hedge_wins']))
+        self.assertEqual(1.0, stats['hedge_rate'])
+
+    def test_not_hedged(self):
+        hedge = HedgePolicy(['lookup'], delay=5)
+        self.assertEqual({'key': 'a', 'value': 1}, self.lookup(hedge))
+        self.assertEqual(0, hedge.stats()['hedged'])
+        other = HedgePolicy(['other'], delay=0)
+        self.lookup(other)
+        self.assertEqual(0, other.stats()['calls'])
+
+    def test_error(self):
+        hedge = HedgePolicy(['lookup'], delay=5)
+        self.assertRaises(SimulatedError, self.lookup, hedge, 'error')
+        hedge = HedgePolicy(['lookup'], delay=0.01)
+        self.delays = [0.1]
+        self.assertRaises(SimulatedError, self.lookup, hedge, 'error')  # both fail
+        self.assertEqual(1, hedge.stats()['hedged'])
+
+    def test_workers_reused(self):
+        hedge = HedgePolicy(['lookup'], delay=5)
+        for x in range(5):
+            self.assertEqual({'key': 'a', 'value': 1}, self.lookup(hedge))
+        self.assertEqual(1, self.backend.thread_inits)
+        hedge.close()
+        for x in range(100):
+            if self.backend.thread_uninits:
+                break
+            time.sleep(0.01)
+        self.assertEqual(1, self.backend.thread_uninits)
+        self.assertEqual({'key': 'a', 'value': 1}, self.lookup(hedge))
+        self.assertEqual(2, self.backend.thread_inits)
+        hedge.close()
+
+    def test_observed_delay(self):
+        hedge = HedgePolicy(['lookup'], min_samples=5, percentile=50)
+        self.assertEqual(None, hedge.get_delay('lookup'))
+        for seconds in (0.5, 0.1, 0.2, 0.3, 0.4):
+            hedge.record('lookup', seconds)
+        self.assertEqual(0.3, hedge.get_delay('lookup'))
+        self.assertEqual({'lookup': 0.3}, hedge.stats()['delays'])
+
+    def test_learning(self):
+        hedge = HedgePolicy(['lookup'], min_samples=3)
+        for x in range(3):
+            self.lookup(hedge)
+        self.assertEqual(0, hedge.stats()['hedged'])
+        self.assertTrue(hedge.get_delay('lookup') is not None)
+
+
+class TestMultiHostPool(SimulatedBackendTestCase):
+    def setUp(self):
+        SimulatedBackendTestCase.setUp(self)
+        self.down = set()  # hosts that refuse connections
+        self.calls = {}  # host -> number of calls
+        self.latency = {}  # host -> seconds
+        self.pools = []
+        for host in ('host1', 'host2', 'bad'):
+            application = self.backend.register_application('comtest_' + host)
+            application.register_procedure('whoami', self.make_whoami(host))
+
+    def make_whoami(self, host):
+        def whoami(params):
+            self.calls[host] = self.calls.get(host, 0) + 1
+            time.sleep(self.latency.get(host, 0))
+            return {'host': host}
+        return whoami
+
+    def connect(self, w4gl_image, appserver_hostname, **kwargs):
+        if appserver_hostname in self.down:
+            raise ApplicationNotFound('%r is down' % appserver_hostname)
+        return or_connect('%s_%s' % (w4gl_image, appserver_hostname), appserver_hostname)
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.close()
+        SimulatedBackendTestCase.tearDown(self)
+
+    def get_pool(self, hosts, **kwargs):
+        pool = MultiHostPool('comtest', hosts, connect=self.connect, **kwargs)
+        self.pools.append(pool)
+        return pool
+
+    def whoami(self, pool):
+        return callproc(pool, 'whoami', func_sig='host=STRING', host=None)['host']
+
+    def test_least_outstanding(self):
+        pool = self.get_pool(['host1', ('host2', 2)])
+        rsos = [pool.checkout() for x in range(3)]
+        self.assertEqual({'host1': 1, 'host2': 2}, pool.in_flight())
+        for rso in rsos:
+            pool.checkin(rso)
+        self.assertEqual({'host1': 0, 'host2': 0}, pool.in_flight())
+        self.assertEqual(8 * 2, pool.max_size)
+
+    def test_ewma(self):
+        self.latency['host2'] = 0.02
+        pool = self.get_pool(['host1', 'host2'], strategy=BALANCE_EWMA)
+        for x in range(10):
+            self.whoami(pool)
+        self.assertEqual({'host1': 9, 'host2': 1}, self.calls)
+        self.assertTrue(pool.stats()['host2']['ewma'] >= 0.02)
+
+    def test_failover_and_eject(self):
+        self.down.add('bad')
+        pool = self.get_pool(['host1', 'bad'], eject_after=2, eject_time=60)
+        # ties are broken at random, keep calling until 'bad' has been tried twice
+        for x in range(200):
+            self.assertEqual('host1', self.whoami(pool))
+            if pool.stats()['bad']['ejected']:
+                break
+        for x in range(10):
+            self.assertEqual('host1', self.whoami(pool))
+        stats = pool.stats()['bad']
+        self.assertTrue(stats['ejected'])
+        self.assertEqual(2, stats['errors'])
+
+    def test_probe(self):
+        self.down.add('bad')
+        pool = self.get_pool(['host1', 'bad'], eject_after=1, eject_time=0)
+        rso = pool.checkout()
+        rso2 = pool.checkout()
+        self.assertTrue(pool.stats()['bad']['ejected'])
+        pool.checkin(rso)
+        pool.checkin(rso2)
+        self.down.discard('bad')
+        self.assertEqual('bad', self.whoami(pool))  # probe
+        self.assertFalse(pool.stats()['bad']['ejected'])
+
+    def test_saturated_host(self):
+        pool = self.get_pool(['host1', 'host2'], strategy=BALANCE_EWMA, max_size=1)
+        pool.hosts[1].ewma = 1.0  # host1 is always tried first
+        busy = pool.hosts[0].pool.checkout()
+        try:
+            for x in range(3):
+                rso = pool.checkout(timeout=0.01)
+                self.assertEqual('host2', get_rso_metadata_key(rso)[0])
+                pool.checkin(rso)
+            rso = pool.checkout(timeout=0.01)
+            try:
+                self.assertRaises(PoolTimeout, pool.checkout, timeout=0.01)
+            finally:
+                pool.checkin(rso)
+        finally:
+            pool.hosts[0].pool.checkin(busy)
+        self.assertEqual({'host1': 0, 'host2': 0}, pool.in_flight())
+        self.assertEqual(0, pool.stats()['host1']['errors'])
+
+    def test_stale_success_keeps_ejection(self):
+        pool = self.get_pool(['host1'], eject_after=1, eject_time=60)
+        rso = pool.checkout()  # e.g. slow call, in progress when host is ejected
+        self.down.add('host1')
+        self.assertRaises(ApplicationNotFound, pool.checkout)
+        self.assertTrue(pool.stats()['host1']['ejected'])
+        pool.checkin(rso)
+        self.assertTrue(pool.stats()['host1']['ejected'])
+        self.down.discard('host1')
+        self.assertEqual('host1', self.whoami(pool))  # started after ejection
+        self.assertFalse(pool.stats()['host1']['ejected'])
+
+    def test_all_down(self):
+        self.down.update(['host1', 'bad'])
+        pool = self.get_pool(['host1', 'bad'])
+        self.assertRaises(ApplicationNotFound, pool.checkout)
+        self.assertEqual({'host1': 0, 'bad': 0}, pool.in_flight())
+
+    def test_dispatcher(self):
+        pool = self.get_pool(['host1', 'host2'])
+        server = SimpleDispatcher(pool, lookup_meta=False)
+        self.assertTrue(server.whoami(host=None)['host'] in ('host1', 'host2'))
+
+
+class TestStream(SimulatedBackendTestCase):
+    data = b''.join([chr(x % 256).encode('latin1') for x in range(10000)])
+
+    def setUp(self):
+        SimulatedBackendTestCase.setUp(self)
+        self.upload = SimulatedFile()
+        self.download = SimulatedFile(self.data)
+        self.application.register_procedure('upload', self.upload.write_chunk)
+        self.application.register_procedure('download', self.download.read_chunk)
+        self.pool = RSOPool('comtest', 'localhost', max_size=3)
+
+    def tearDown(self):
+        self.pool.close()
+        SimulatedBackendTestCase.tearDown(self)
+
+    def test_send(self):
+        offsets = []
+        result = send_stream(self.pool, 'upload', 'doc1', BytesIO(self.data), chunk_size=1000, progress=offsets.append)
+        self.assertEqual(len(self.data), result)
+        self.assertEqual(self.data, bytes(self.upload.data))
+        self.assertEqual(list(range(1000, 10001, 1000)), offsets)
+
+    def test_receive(self):
+        fileobj = BytesIO()
+        result = receive_stream(self.pool, 'download', 'doc1', fileobj, chunk_size=999)
+        self.assertEqual(len(self.data), result)
+        self.assertEqual(self.data, fileobj.getvalue())
+
+    def test_receive_resume(self):
+        fileobj = BytesIO()
+        result = receive_stream(self.pool, 'download', 'doc1', fileobj, chunk_size=1000, offset=4000)
+        self.assertEqual(len(self.data), result)
+        self.assertEqual(self.data[4000:], fileobj.getvalue())
+
+    def test_send_error(self):
+        try:
+            send_stream(self.pool, 'method_does_not_exist', 'doc1', BytesIO(self.data), chunk_size=1000)
+            self.fail('TransferError not raised')
+        except TransferError as info:
+            self.assertEqual(0, info.offset)
+            self.assertTrue(isinstance(info.error, MethodNotFound))
+
+    def test_send_resume(self):
+        self.upload.data = bytearray(self.data[:3000])
+        fileobj = BytesIO(self.data)
+        fileobj.seek(3000)
+        result = send_stream(self.pool, 'upload', 'doc1', fileobj, chunk_size=1000, offset=3000, max_in_flight=1)
+        self.assertEqual(len(self.data), result)
+        self.assertEqual(self.data, bytes(self.upload.data))
+
+    def test_receive_error(self):
+        fileobj = BytesIO()
+        try:
+            receive_stream(self.pool, 'method_does_not_exist', 'doc1', fileobj, chunk_size=1000, offset=2000)
+            self.fail('TransferError not raised')
+        except TransferError as info:
+            self.assertEqual(2000, info.offset)
+            self.assertTrue(isinstance(info.error, MethodNotFound))
+        self.assertEqual(b'', fileobj.getvalue())
+
+    def test_imap_binary_kwargs_unchanged(self):
+        params = [{'transfer_id': 'doc1', 'offset': 0, 'length': 10}]
+        result = list(callproc_imap(self.pool, 'download', params, func_sig='transfer_id=STRING; offset=INTEGER; length=INTEGER; data=BINARY', binary=BINARY_MEMORYVIEW))
+        self.assertTrue(isinstance(result[0].get()['data'], memoryview))
+        self.assertEqual([{'transfer_id': 'doc1', 'offset': 0, 'length': 10}], params)
+        self.assertTrue(result[0].kwargs is params[0])
+
+
+class TestLazyImport(TestCase):
+    def test_import_is_lazy(self):
+        # new process, as the test suite has already loaded everything
+        code = 'import sys, orserver; orserver.func_sig2meta("a=STRING"); print(orserver._backend is None, orserver.ET is None, "xml.etree.ElementTree" in sys.modules)'
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual('True True False', output.decode('ascii').strip())
+
+
+class TestParseMetaData(TestCase):
+    def test_parse_sample(self):
+        canon = {
+            'SCP_helloworld': {
+                'info': {'name': 'SCP_helloworld'},
+                'params': {
+                    'hellostring': {'name': 'hellostring', 'type': 'string'},
+                    'counter': {'name': 'counter', 'type': 'int'},
+                },
+            },
+            '*classes*': {
+                'ucsimpleintstr': {
+                    'info': {'name': 'ucsimpleintstr'},
+                    'params': {
+                        'attr_int': {'name': 'attr_int', 'type': 'int'},
+                        'attr_str': {'name': 'attr_str', 'type': 'string'},
+                    },
+                },
+            },
+        }
+        result = parse_meta_data(SAMPLE_METADATA_XML)
+        self.assertEqual(canon, result)
+
+    def test_parse_small_chunks(self):
+        canon = parse_meta_data(SAMPLE_METADATA_XML)
+        result = parse_meta_data(SAMPLE_METADATA_XML, chunk_size=7)
+        self.assertEqual(canon, result)
+
+
+NESTED_METADATA_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<interface>
+    <scps>
+        <scp name="SCP_echoorder">
+            <param name="b_osca" type="UCOSCA"/>
+            <param name="order" type="ucorder"/>
+            <param name="orders" type="ucorder" isarray="1"/>
+        </scp>
+        <scp name="SCP_echonode">
+            <param name="node" type="ucnode"/>
+        </scp>
+    </scps>
+    <classes>
+        <class name="ucorder">
+            <attribute name="order_id" type="int"/>
+            <attribute name="customer" type="uccustomer"/>
+            <attribute name="lines" type="ucline" isarray="1"/>
+        </class>
+        <class name="uccustomer">
+            <attribute name="name" type="string"/>
+        </class>
+        <class name="ucline">
+            <attribute name="qty" type="int"/>
+            <attribute name="price" type="money"/>
+        </class>
+        <class name="ucnode">
+            <attribute name="value" type="int"/>
+            <attribute name="next" type="ucnode"/>
+        </class>
+    </classes>
+</interface>
+'''
+
+
+class TestScpMetaDataFlatten(TestCase):
+    def test_nested(self):
+        app_metadata = parse_meta_data(NESTED_METADATA_XML)
+        order_canon = {
+            'order_id': 'INTEGER',
+            'customer': 'USERCLASS',
+            'customer.name': 'STRING',
+            'lines': 'UCARRAY',
+            'lines.qty': 'INTEGER',
+            'lines.price': 'MONEY',
+        }
+        canon = {'order': 'USERCLASS', 'orders': 'UCARRAY'}
+        for name in order_canon:
+            canon['order.' + name] = order_canon[name]
+            canon['orders.' + name] = order_canon[name]
+        class_memo = {}
+        result = scp_metadata_to_meta(app_metadata, 'echoorder', class_memo=class_memo)
+        self.assertEqual(canon, result)
+        self.assertEqual(order_canon, class_memo['ucorder'])
+        self.assertTrue(class_memo['ucorder'] is scp_class_metadata_to_meta(app_metadata, 'ucorder', class_memo))
+        # signature can be compiled
+        plan = get_call_plan(param_meta=result)
+        self.assertTrue(plan.meta_tree['orders']['lines'][ARRAY_INDICATOR])
+
+    def test_class_names(self):
+        app_metadata = parse_meta_data(NESTED_METADATA_XML)
+        canon = {
+            'order': 'ucorder', 'order.customer': 'uccustomer', 'order.lines': 'ucline',
+            'orders': 'ucorder', 'orders.customer': 'uccustomer', 'orders.lines': 'ucline',
+        }
+        self.assertEqual(canon, scp_metadata_class_names(app_metadata, 'echoorder'))
+        plan = get_call_plan(param_meta=scp_metadata_to_meta(app_metadata, 'echoorder'), class_names=canon)
+        pdo = DictPDO({'order.order_id': 1, 'order.customer.name': 'x', 'order.lines[1].qty': 2, 'orders[1].order_id': 3, 'orders[1].lines[1].qty': 4})
+        result = pdo_decode(pdo, plan.record_getters)
+        self.assertEqual('ucorder', result['order'].__class__.__name__)
+        self.assertEqual('uccustomer', result['order'].customer.__class__.__name__)
+        self.assertEqual('ucline', result['order'].lines[0].__class__.__name__)
+        self.assertEqual('ucorder', result['orders'][0].__class__.__name__)
+        result = pdo_decode(pdo, plan.result_getters(columnar=True, records=True))
+        self.assertEqual('ucline', result['orders']['lines'][0][0].__class__.__name__)
+
+    def test_recursive_class(self):
+        app_metadata = parse_meta_data(NESTED_METADATA_XML)
+        self.assertRaises(NotImplementedError, scp_metadata_to_meta, app_metadata, 'echonode')
+
+    def test_guessmeta_nested(self):
+        value = {u'order': {u'order_id': 1, u'customer': {u'name': u'x'}, u'lines': [{u'qty': 1}]}}
+        canon = {
+            u'order': 'USERCLASS',
+            u'order.order_id': 'INTEGER',
+            u'order.customer': 'USERCLASS',
+            u'order.customer.name': 'STRING',
+            u'order.lines': 'UCARRAY',
+            u'order.lines.qty': 'INTEGER',
+        }
+        self.assertEqual(canon, guessmeta_from_values(value))
+
+
+class CannedMetaDataCache(MetaDataCache):
+    """MetaDataCache that does not contact a server"""
+    xml_metadata = SAMPLE_METADATA_XML
+    fetch_count = 0
+
+    def fetch_xml(self, rso):
+        self.fetch_count += 1
+        return self.xml_metadata
+
+
+class TestMetaDataCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cache_hit(self):
+        cache = CannedMetaDataCache(self.directory, ttl=60)
+        app_metadata = cache.get_meta_data(None, 'localhost', 'comtest')
+        self.assertEqual(1, cache.fetch_count)
+        self.assertEqual(['counter', 'hellostring'], sorted(app_metadata['SCP_helloworld']['params']))
+        cache = CannedMetaDataCache(self.directory, ttl=60)  # e.g. new process
+        self.assertEqual(app_metadata, cache.get_meta_data(None, 'localhost', 'comtest'))
+        self.assertEqual(0, cache.fetch_count)
+
+    def test_cache_expired(self):
+        cache = CannedMetaDataCache(self.directory, ttl=0)
+        cache.get_meta_data(None, 'localhost', 'comtest')
+        cache.get_meta_data(None, 'localhost', 'comtest')
+        self.assertEqual(2, cache.fetch_count)
+        self.assertTrue(cache.load('localhost', 'comtest') is not None)
+
+    def test_cache_changed(self):
+        cache = CannedMetaDataCache(self.directory, ttl=0)
+        cache.get_meta_data(None, 'localhost', 'comtest')
+        cache.xml_metadata = SAMPLE_METADATA_XML.replace('hellostring', 'newstring')
+        app_metadata = cache.get_meta_data(None, 'localhost', 'comtest')
+        self.assertEqual(['counter', 'newstring'], sorted(app_metadata['SCP_helloworld']['params']))
+
+    def test_cache_keyed(self):
+        cache = CannedMetaDataCache(self.directory, ttl=60)
+        cache.get_meta_data(None, 'localhost', 'comtest')
+        cache.get_meta_data(None, 'localhost', 'mycomtest')
+        self.assertEqual(2, cache.fetch_count)
+
+    def test_cache_corrupt(self):
+        cache = CannedMetaDataCache(self.directory, ttl=60)
+        f = open(cache.filename('localhost', 'comtest'), 'wb')
+        f.write(b'not valid')
+        f.close()
+        self.assertEqual(None, cache.load('localhost', 'comtest'))
+
+
+class BlockingMetaDataCache(CannedMetaDataCache):
+    """CannedMetaDataCache where fetch blocks until released"""
+    def __init__(self, *args, **kwargs):
+        CannedMetaDataCache.__init__(self, *args, **kwargs)
+        self.release = threading.Event()
+
+    def fetch_xml(self, rso):
+        self.release.wait()
+        return CannedMetaDataCache.fetch_xml(self, rso)
+
+
+class TestSimpleDispatcherMetaDataLoad(TestCase):
+    metadata_key = ('localhost', 'comtest')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lazy(self):
+        cache = CannedMetaDataCache(self.directory)
+        server = SimpleDispatcher(None, metadata_cache=cache, metadata_key=self.metadata_key, metadata_load=METADATA_LAZY)
+        self.assertEqual(0, cache.fetch_count)
+        self.assertEqual('counter=INTEGER; hellostring=STRING', server.helloworld.plan.func_sig)
+        self.assertEqual(1, cache.fetch_count)
+
+    def test_background_wait(self):
+        cache = BlockingMetaDataCache(self.directory)
+        pool = RSOPool('comtest', 'localhost', connect=fake_connect)
+        server = SimpleDispatcher(pool, metadata_cache=cache, metadata_key=self.metadata_key, metadata_load=METADATA_BACKGROUND)
+        self.assertFalse(server.wait_meta_data(timeout=0.01))
+        cache.release.set()
+        self.assertEqual('counter=INTEGER; hellostring=STRING', server.helloworld.plan.func_sig)
+
+    def test_background_plain_rso_is_lazy(self):
+        cache = BlockingMetaDataCache(self.directory)
+        cache.release.set()
+        server = SimpleDispatcher(None, metadata_cache=cache, metadata_key=self.metadata_key, metadata_load=METADATA_BACKGROUND)
+        self.assertFalse(server.wait_meta_data(timeout=0.01))  # no background thread
+        self.assertEqual(0, cache.fetch_count)
+        self.assertEqual('counter=INTEGER; hellostring=STRING', server.helloworld.plan.func_sig)
+        self.assertEqual(1, cache.fetch_count)
+
+    def test_background_guess(self):
+        cache = BlockingMetaDataCache(self.directory)
+        pool = RSOPool('comtest', 'localhost', connect=fake_connect)
+        server = SimpleDispatcher(pool, metadata_cache=cache, metadata_key=self.metadata_key, metadata_load=METADATA_BACKGROUND, metadata_pending=METADATA_PENDING_GUESS)
+        self.assertEqual(None, server.helloworld.plan)  # not available yet, guess
+        cache.release.set()
+        self.assertTrue(server.wait_meta_data())
+        self.assertEqual('counter=INTEGER; hellostring=STRING', server.helloworld.plan.func_sig)
+
+    def test_guess_requires_pool(self):
+        self.assertRaises(ValueError, SimpleDispatcher, None, metadata_load=METADATA_LAZY, metadata_pending=METADATA_PENDING_GUESS)
+
 
 class BaseOpenROADServerComtestWithMetaData(TestCase):
     w4gl_image = 'comtest'
@@ -90,13 +1658,14 @@ class BaseOpenROADServerComtestWithMetaData(TestCase):
     def setUp(self):
         # NOTE using Python unittest, setUp() is called before EACH and every
         # test. There is no single setup routine hook (other than hacking init,
-        # module main, etc.)
-        self.rso = or_connect(self.w4gl_image, self.appserver_hostname, connection_mode=self.connection_mode)
+        # module main, etc.) so use a (shared) pool to avoid reconnecting
+        self.rso_pool = get_rso_pool(self.w4gl_image, self.appserver_hostname, connection_mode=self.connection_mode)
+        self.rso = self.rso_pool.checkout()
         self.server = SimpleDispatcher(self.rso, lookup_meta=self.lookup_meta)
 
     def tearDown(self):
         # NOTE like setUp(), tearDown() is called before EACH and every test.
-        self.rso.disconnect()
+        self.rso_pool.checkin(self.rso)
 
 
 class TestOpenROADServerSimpleCallProcComtestNoMetaDataLookup(BaseOpenROADServerComtestWithMetaData):
@@ -172,6 +1741,54 @@ class TestOpenROADServerSimpleProxyComtestNoMeta(TestOpenROADServerSimpleProxyCo
         self.assertEqual(canon, result)
 
 
+class TestOpenROADServerCallprocImapComtest(BaseOpenROADServerComtestWithMetaData):
+    lookup_meta = False
+    helloworld_func_sig = 'hellostring=STRING; counter=INTEGER'
+
+    def test_comtest_helloworld_imap_ordered(self):
+        params = [{'hellostring': 'COMTEST', 'counter': x} for x in range(20)]
+        canon = [{u'counter': x + 1, u'hellostring': u'Well "COMTEST" to you too.'} for x in range(20)]
+        result = [call_result.get() for call_result in callproc_imap(self.rso_pool, 'helloworld', params, max_in_flight=4, func_sig=self.helloworld_func_sig)]
+        self.assertEqual(canon, result)
+
+    def test_comtest_helloworld_imap_unordered(self):
+        params = [{'hellostring': 'COMTEST', 'counter': x} for x in range(20)]
+        canon = list(range(20))
+        result = sorted(call_result.index for call_result in callproc_imap(self.rso_pool, 'helloworld', params, max_in_flight=4, ordered=False))
+        self.assertEqual(canon, result)
+
+    def test_comtest_imap_errors_per_item(self):
+        params = [{'hellostring': 'COMTEST'}] * 3
+        result = list(callproc_imap(self.rso_pool, 'method_does_not_exist', params, max_in_flight=2))
+        self.assertEqual(3, len(result))
+        for call_result in result:
+            self.assertTrue(isinstance(call_result.error, MethodNotFound))
+
+
+class TestOpenROADServerBatchComtest(BaseOpenROADServerComtestWithMetaData):
+    helloworld_func_sig = 'hellostring=STRING; counter=INTEGER'
+
+    def test_comtest_helloworld_batch(self):
+        params = [{'hellostring': 'COMTEST', 'counter': x} for x in range(10)]
+        canon = [{u'counter': x + 1, u'hellostring': u'Well "COMTEST" to you too.'} for x in range(10)]
+        results, timings = callproc_batch(self.rso, 'helloworld', params, func_sig=self.helloworld_func_sig)
+        self.assertEqual(canon, results)
+        self.assertEqual(10, len(timings))
+
+    def test_comtest_helloworld_batch_missing_param(self):
+        # values from one call must not leak into the next
+        params = [{'hellostring': 'COMTEST', 'counter': 99}, {'hellostring': 'COMTEST'}]
+        canon = [{u'counter': 100, u'hellostring': u'Well "COMTEST" to you too.'}, {u'counter': 1, u'hellostring': u'Well "COMTEST" to you too.'}]
+        results, timings = callproc_batch(self.rso, 'helloworld', params, func_sig=self.helloworld_func_sig)
+        self.assertEqual(canon, results)
+
+    def test_comtest_helloworld_batch_proxy(self):
+        params = [{'hellostring': 'COMTEST', 'counter': x} for x in range(10)]
+        canon = [{u'counter': x + 1, u'hellostring': u'Well "COMTEST" to you too.'} for x in range(10)]
+        results, timings = self.server.helloworld.batch(params)
+        self.assertEqual(canon, results)
+
+
 MYLONGBYTEOBJVCHAR_LEN = 1234  # EchoTypesNullable() declared myLongbyteobjVchar = varchar(1234)
 
 